@@ -0,0 +1,186 @@
+from dataclasses import dataclass
+from datetime import date, timedelta
+
+from django.conf import settings
+from django.db.models import Count, F, Q, Sum
+from django.utils.encoding import smart_str
+
+from . import archive
+from .models import AttendanceRecord, Student, StudentMonthRollup
+from .reporting import EXPORT_CHUNK_SIZE, _filtered, day_start, filtered_archive, filtered_rollups, filtered_sessions
+from .rollups import month_start, next_month
+
+# Per-student attendance over the sessions a report covers. Session totals
+# come from DailyRollup, the stored counters of sessions not rolled up yet
+# (open, or just ended) and, for archived months, ArchivedSessionSummary.
+# Attended counts come from StudentMonthRollup for the whole months in range
+# and from the records for the rest: the partly covered months at either
+# end and sessions not rolled up. Archived months have no records left, so
+# one the filters only partly cover counts whole, on both sides of the
+# percentage. Every student is assumed to be due at every session in range.
+
+
+@dataclass
+class StudentAttendance:
+    pk: int
+    student_id: str
+    full_name: str
+    attended: int
+    total: int
+    percent: float
+    subjects: list  # (attended, total, percent) per StudentTotals.subjects
+
+
+def _percent(attended, total):
+    return round(attended * 100 / total, 1) if total else 0.0
+
+
+def months(first, last, horizon=None):
+    # [start, end) of the whole months within first..last (None for no
+    # bound); months before the archive horizon are taken whole if touched
+    start = end = None
+    if first:
+        archived = horizon is not None and first < horizon
+        start = month_start(first) if first.day == 1 or archived else next_month(first)
+    if last:
+        archived = horizon is not None and last < horizon
+        end = next_month(last) if (last + timedelta(days=1)).day == 1 or archived else month_start(last)
+    return start, end
+
+
+class StudentTotals:
+    def __init__(self, first, last, subjects, totals, rows):
+        self.first = first  # first day covered, or None for no lower bound
+        self.last = last  # last day covered, or None for no upper bound
+        self.subjects = subjects  # subject names, 'Unassigned' for none
+        self.totals = totals  # sessions per subject
+        self.session_count = sum(totals)
+        self.rows = rows  # student pk -> sessions attended per subject
+
+    def row(self, pk, student_id, full_name) -> StudentAttendance:
+        hits = self.rows.get(pk) or [0] * len(self.subjects)
+        attended = sum(hits)
+        return StudentAttendance(
+            pk=pk,
+            student_id=student_id,
+            full_name=full_name,
+            attended=attended,
+            total=self.session_count,
+            percent=_percent(attended, self.session_count),
+            subjects=[(hit, total, _percent(hit, total)) for hit, total in zip(hits, self.totals)],
+        )
+
+    def _students(self):
+        # Active students, plus inactive ones who attended something here
+        students = Student.objects.order_by('student_id').values_list('id', 'student_id', 'full_name', 'is_active')
+        for pk, student_id, full_name, is_active in students.iterator(chunk_size=EXPORT_CHUNK_SIZE):
+            if is_active or pk in self.rows:
+                yield pk, student_id, full_name
+
+    def students(self):
+        for student in self._students():
+            yield self.row(*student)
+
+
+def build(teacher_id='', subject_id='', date_from='', date_to='', include_archive=False) -> StudentTotals:
+    first = date.fromisoformat(date_from) if date_from else None
+    last = date.fromisoformat(date_to) if date_to else None
+    start, end = months(first, last, archive.horizon() if include_archive else None)
+    if start and start < first:
+        first = start
+    if end and end > last + timedelta(days=1):
+        last = end - timedelta(days=1)
+
+    live = filtered_sessions(teacher_id, subject_id, first, last).filter(rolled_up=False)
+    sources = [
+        filtered_rollups(teacher_id, subject_id, first, last).values('subject_id', 'subject__name')
+        .annotate(n=Sum('sessions')),
+        live.values('subject_id', 'subject__name').annotate(n=Count('id')),
+    ]
+    if include_archive:
+        sources.append(filtered_archive(teacher_id, subject_id, first, last).values('subject_id', 'subject__name')
+                       .annotate(n=Count('id')))
+    sessions = {}
+    for qs in sources:
+        for subject, name, n in qs.order_by().values_list('subject_id', 'subject__name', 'n'):
+            label, total = sessions.get(subject, (name or 'Unassigned', 0))
+            sessions[subject] = (label, total + n)
+    ordered = sorted(sessions.items(), key=lambda item: item[1][0])
+    index = {subject: i for i, (subject, _) in enumerate(ordered)}
+
+    # Records outside the whole months, and those of sessions not rolled up
+    in_months = Q(session__rolled_up=True)
+    if start:
+        in_months &= Q(session__starts_at__gte=day_start(start))
+    if end:
+        in_months &= Q(session__starts_at__lt=day_start(end))
+    sources = [
+        AttendanceRecord.objects.filter(
+            session__in=filtered_sessions(teacher_id, subject_id, first, last).order_by().values('id'),
+        ).exclude(in_months)
+        .values('student_id', subject_id=F('session__subject_id')).annotate(n=Count('id')),
+    ]
+    if not (start and end and start >= end):
+        attended = _filtered(StudentMonthRollup.objects.all(), teacher_id, subject_id)
+        if start:
+            attended = attended.filter(month__gte=start)
+        if end:
+            attended = attended.filter(month__lt=end)
+        sources.append(attended.values('student_id', 'subject_id').annotate(n=Sum('present')))
+    rows = {}
+    for qs in sources:
+        for student_pk, subject, n in qs.order_by().values_list('student_id', 'subject_id', 'n'):
+            i = index.get(subject)
+            if i is None:
+                # Month rows without session totals (e.g. an archived month
+                # whose teacher couldn't be told apart)
+                continue
+            rows.setdefault(student_pk, [0] * len(ordered))[i] += n
+
+    return StudentTotals(
+        first=first,
+        last=last,
+        subjects=[label for _, (label, _) in ordered],
+        totals=[total for _, (_, total) in ordered],
+        rows=rows,
+    )
+
+
+def summarize(totals: StudentTotals, threshold, limit=None) -> dict:
+    # One pass over the students; only the defaulters shown get the
+    # per-subject breakdown
+    limit = settings.DEFAULTERS_SHOWN if limit is None else limit
+    count, percent_sum, below = 0, 0.0, []
+    for student in totals._students():
+        percent = _percent(sum(totals.rows.get(student[0], ())), totals.session_count)
+        count += 1
+        percent_sum += percent
+        if percent < threshold:
+            below.append((percent, student[1], student))
+    below.sort(key=lambda entry: entry[:2])
+    return {
+        'first': totals.first,
+        'last': totals.last,
+        'sessions': totals.session_count,
+        'subjects': totals.subjects,
+        'students': count,
+        'average': round(percent_sum / count, 1) if count else 0.0,
+        'threshold': threshold,
+        'defaulter_count': len(below),
+        'defaulters': [totals.row(*student) for _, _, student in below[:limit]],
+    }
+
+
+def student_rows(totals: StudentTotals, threshold):
+    header = ['Student ID', 'Student Name', 'Attended', 'Sessions', 'Percent', 'Below Threshold']
+    for name in totals.subjects:
+        header += [f'{name} Attended', f'{name} Sessions', f'{name} %']
+    yield header
+    for s in totals.students():
+        row = [
+            smart_str(s.student_id), smart_str(s.full_name), s.attended, s.total, s.percent,
+            'yes' if s.percent < threshold else 'no',
+        ]
+        for hit, total, percent in s.subjects:
+            row += [hit, total, percent]
+        yield row
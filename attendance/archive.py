@@ -0,0 +1,163 @@
+import gzip
+import json
+import os
+from dataclasses import dataclass
+from datetime import date
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from . import rollups, scanning
+from .models import ArchivedSessionSummary, AttendanceRecord, AttendanceSession
+from .reporting import day_start
+
+# Hot/cold split for attendance. archive_attendance moves closed sessions
+# that started before a cutoff, with their records, into a gzipped JSONL file
+# (one line per session, records embedded) and leaves an
+# ArchivedSessionSummary row per session. The cutoff is always the first of
+# a month so archived months are complete: their daily rollup rows are
+# dropped, the per-student month rows are kept, and reports add the
+# summaries back in when the date filters reach before the horizon.
+
+CHUNK_SIZE = 200
+HORIZON_KEY = 'archive:horizon'
+
+
+@dataclass
+class ArchiveResult:
+    path: str = ''
+    sessions: int = 0
+    records: int = 0
+
+
+def cutoff(before: date) -> date:
+    return before.replace(day=1)
+
+
+def horizon():
+    # Start of the first month still in the hot tables, or None if nothing
+    # has been archived. archive_attendance runs in its own process, so the
+    # value is only cached when the cache is shared with it; otherwise it is
+    # one MAX() over the starts_at index per call.
+    value = cache.get(HORIZON_KEY) if settings.CACHE_SHARED else None
+    if value is None:
+        latest = ArchivedSessionSummary.objects.aggregate(latest=Max('starts_at'))['latest']
+        value = rollups.next_month(timezone.localdate(latest)).isoformat() if latest else ''
+        if settings.CACHE_SHARED:
+            cache.set(HORIZON_KEY, value, None)
+    return date.fromisoformat(value) if value else None
+
+
+def reaches_archive(date_from) -> bool:
+    limit = horizon()
+    if limit is None:
+        return False
+    if isinstance(date_from, str):
+        date_from = date.fromisoformat(date_from) if date_from else None
+    return date_from is None or date_from < limit
+
+
+def candidates(before: date):
+    return AttendanceSession.objects.filter(rollups.closed_q(), starts_at__lt=day_start(cutoff(before)))
+
+
+def _entry(session, records):
+    return {
+        'code': session.code,
+        'title': session.title,
+        'teacher': session.teacher.full_name if session.teacher else None,
+        'subject': session.subject.name if session.subject else None,
+        'time_slot': session.time_slot,
+        'starts_at': session.starts_at.isoformat(),
+        'ends_at': session.ends_at.isoformat(),
+        'present_count': session.present_count,
+        'unique_devices_count': session.unique_devices_count,
+        'records': [
+            {
+                'student_id': student_id,
+                'full_name': full_name,
+                'scanned_at': scanned_at.isoformat(),
+                'device_fingerprint': fingerprint,
+            }
+            for student_id, full_name, scanned_at, fingerprint in records
+        ],
+    }
+
+
+def _summary(session, path):
+    return ArchivedSessionSummary(
+        code=session.code,
+        title=session.title,
+        teacher_id=session.teacher_id,
+        subject_id=session.subject_id,
+        teacher_name=session.teacher.full_name if session.teacher else None,
+        subject_name=session.subject.name if session.subject else None,
+        time_slot=session.time_slot,
+        starts_at=session.starts_at,
+        ends_at=session.ends_at,
+        present_count=session.present_count,
+        unique_devices_count=session.unique_devices_count,
+        archive_file=path,
+    )
+
+
+def archive(before: date, chunk_size=CHUNK_SIZE, progress=None) -> ArchiveResult:
+    # Each chunk is written and flushed to the file before its sessions are
+    # deleted, so a crash can at worst leave sessions in the file that are
+    # still in the database; the next run archives them again and the
+    # unique code keeps their summary single.
+    result = ArchiveResult()
+    sessions = candidates(before).select_related('teacher', 'subject').order_by('id')
+    if not sessions.exists():
+        return result
+
+    os.makedirs(settings.ARCHIVE_DIR, exist_ok=True)
+    stamp = timezone.localtime().strftime('%Y%m%d-%H%M%S')
+    result.path = str(settings.ARCHIVE_DIR / f"attendance-before-{cutoff(before)}-{stamp}.jsonl.gz")
+    last_id = 0
+    with open(result.path, 'ab') as raw, gzip.GzipFile(fileobj=raw, mode='ab') as fh:
+        while True:
+            chunk = list(sessions.filter(id__gt=last_id)[:chunk_size])
+            if not chunk:
+                break
+            last_id = chunk[-1].id
+            records = {}
+            for session_id, *row in (
+                AttendanceRecord.objects.filter(session_id__in=[s.id for s in chunk])
+                .order_by('id')
+                .values_list('session_id', 'student__student_id', 'student__full_name', 'scanned_at',
+                             'device_fingerprint')
+            ):
+                records.setdefault(session_id, []).append(row)
+            for session in chunk:
+                line = json.dumps(_entry(session, records.get(session.id, [])), separators=(',', ':'))
+                fh.write(line.encode('utf-8') + b'\n')
+            fh.flush()
+            os.fsync(raw.fileno())
+
+            ids = [s.id for s in chunk]
+            with transaction.atomic():
+                # A closed session the sweeper hasn't got to yet would take
+                # its students' month rows with it
+                rollups.roll_up(ids)
+                groups = rollups.groups_of(ids)
+                ArchivedSessionSummary.objects.bulk_create(
+                    [_summary(s, result.path) for s in chunk], ignore_conflicts=True,
+                )
+                AttendanceSession.objects.filter(id__in=ids).delete()
+                for group in groups:
+                    # Archived months keep their per-student month rows
+                    rollups.refresh(group, students=False)
+            for session in chunk:
+                scanning.forget_session(session.code, session.id)
+            result.sessions += len(chunk)
+            result.records += sum(len(rows) for rows in records.values())
+            if progress is not None:
+                progress(result)
+            if len(chunk) < chunk_size:
+                break
+    cache.delete(HORIZON_KEY)
+    return result
@@ -0,0 +1,43 @@
+from django.db.models import Count, F, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+from .models import AttendanceRecord, AttendanceSession
+
+# AttendanceSession.present_count / unique_devices_count are stored counters.
+# Single inserts and deletes adjust them with F() updates in the same
+# transaction; batch paths (write-behind flush, repairs) recount from the
+# records.
+
+
+def adjust(session_id: int, delta: int):
+    # ('session', 'device_fingerprint') is unique, so every record is also a
+    # distinct device within its session and both counters move together.
+    AttendanceSession.objects.filter(pk=session_id).update(
+        present_count=F('present_count') + delta,
+        unique_devices_count=F('unique_devices_count') + delta,
+    )
+
+
+def _actual():
+    records = AttendanceRecord.objects.filter(session=OuterRef('pk')).order_by().values('session')
+    present = records.annotate(n=Count('id')).values('n')
+    devices = records.annotate(n=Count('device_fingerprint', distinct=True)).values('n')
+    return (
+        Coalesce(Subquery(present), Value(0)),
+        Coalesce(Subquery(devices), Value(0)),
+    )
+
+
+def recount(sessions_qs):
+    present, devices = _actual()
+    return sessions_qs.update(present_count=present, unique_devices_count=devices)
+
+
+def drift(sessions_qs):
+    # Sessions whose stored counters disagree with their records
+    present, devices = _actual()
+    return (
+        sessions_qs.annotate(actual_present=present, actual_devices=devices)
+        .exclude(present_count=F('actual_present'), unique_devices_count=F('actual_devices'))
+        .order_by('id')
+    )
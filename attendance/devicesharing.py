@@ -0,0 +1,184 @@
+import time
+from dataclasses import dataclass
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, F, Max, Min, Sum, Value
+from django.db.models.functions import Greatest, Least
+from django.utils import timezone
+
+from .models import AnalysisCheckpoint, AttendanceRecord, DeviceStudentLink
+
+# Cross-session device sharing. The per-session unique constraint stops one
+# phone marking two students in the same session, but not across sessions.
+# Records are streamed in id order a chunk at a time and folded into
+# DeviceStudentLink (fingerprint -> student, with a session count), with the
+# checkpoint advanced in the same transaction, so each run only reads records
+# added since the last one and memory is bounded by the chunk size. A device
+# linked to several students is reported as a shared-device cluster.
+#
+# Ids are handed out at INSERT but become visible at COMMIT, so a record can
+# show up after one with a higher id (concurrent MySQL inserts, write-behind
+# flushes). Small holes in the ids a run reads are kept on the checkpoint
+# and looked up again by later runs for GAP_SECONDS; larger holes are
+# deletions or archived sessions.
+
+CHECKPOINT = 'device_sharing'
+CHUNK_SIZE = 5000
+GAP_SECONDS = 15 * 60
+MAX_GAP = 1000  # ids in one hole
+MAX_GAPS = 10000  # ids kept on the checkpoint
+
+
+@dataclass
+class ScanResult:
+    records: int = 0
+    created: int = 0
+    updated: int = 0
+    last_record_id: int = 0
+
+
+@dataclass
+class DeviceCluster:
+    fingerprint: str
+    sessions: int
+    first_seen: object
+    last_seen: object
+    students: list  # (student_id, full_name, sessions), most sessions first
+
+
+def _checkpoint():
+    return AnalysisCheckpoint.objects.get_or_create(name=CHECKPOINT)[0]
+
+
+def reset():
+    with transaction.atomic():
+        DeviceStudentLink.objects.all().delete()
+        AnalysisCheckpoint.objects.filter(name=CHECKPOINT).delete()
+
+
+def _fold(rows):
+    # (fingerprint, student) -> [sessions, first_seen, last_seen] for a chunk
+    pairs = {}
+    tz = timezone.get_current_timezone()
+    for _, fingerprint, student_id, scanned_at in rows:
+        if not fingerprint:
+            continue
+        day = scanned_at.astimezone(tz).date()
+        entry = pairs.get((fingerprint, student_id))
+        if entry is None:
+            pairs[(fingerprint, student_id)] = [1, day, day]
+            continue
+        entry[0] += 1
+        entry[1] = min(entry[1], day)
+        entry[2] = max(entry[2], day)
+    return pairs
+
+
+def _missing(prev, ids, now) -> list:
+    # Ids skipped between prev and each of the ids read, as gaps entries
+    gaps = []
+    for record_id in ids:
+        if 1 < record_id - prev <= MAX_GAP + 1:
+            gaps.extend([missing, now] for missing in range(prev + 1, record_id))
+        prev = record_id
+    return gaps
+
+
+def _apply(pairs, checkpoint, result):
+    # New pairs are inserted; known ones are bumped with one UPDATE per
+    # (sessions added, first day, last day) combination, which in a chunk of
+    # records in id order is a handful. Links are looked up by fingerprint
+    # alone, the unique index's prefix.
+    bumps = {}
+    with transaction.atomic():
+        existing = DeviceStudentLink.objects.filter(
+            fingerprint__in={fingerprint for fingerprint, _ in pairs}
+        ).values_list('id', 'fingerprint', 'student_id')
+        for link_id, fingerprint, student_id in existing:
+            entry = pairs.pop((fingerprint, student_id), None)
+            if entry is not None:
+                bumps.setdefault(tuple(entry), []).append(link_id)
+        for (sessions, first_seen, last_seen), link_ids in bumps.items():
+            DeviceStudentLink.objects.filter(id__in=link_ids).update(
+                sessions=F('sessions') + sessions,
+                first_seen=Least('first_seen', Value(first_seen)),
+                last_seen=Greatest('last_seen', Value(last_seen)),
+            )
+        DeviceStudentLink.objects.bulk_create(
+            [
+                DeviceStudentLink(
+                    fingerprint=fingerprint, student_id=student_id, sessions=sessions,
+                    first_seen=first_seen, last_seen=last_seen,
+                )
+                for (fingerprint, student_id), (sessions, first_seen, last_seen) in pairs.items()
+            ],
+            batch_size=1000,
+        )
+        checkpoint.save(update_fields=['last_record_id', 'gaps', 'updated_at'])
+    result.created += len(pairs)
+    result.updated += sum(len(link_ids) for link_ids in bumps.values())
+
+
+def scan(chunk_size=CHUNK_SIZE, progress=None) -> ScanResult:
+    checkpoint = _checkpoint()
+    result = ScanResult(last_record_id=checkpoint.last_record_id)
+    now = int(time.time())
+    records = AttendanceRecord.objects.order_by('id').values_list(
+        'id', 'device_fingerprint', 'student_id', 'scanned_at'
+    )
+
+    # Holes left by earlier runs whose records have committed since
+    gaps = {record_id: seen for record_id, seen in checkpoint.gaps if now - seen < GAP_SECONDS}
+    late = list(records.filter(id__in=list(gaps))) if gaps else []
+    for row in late:
+        del gaps[row[0]]
+    if late or len(gaps) != len(checkpoint.gaps):
+        checkpoint.gaps = [[record_id, seen] for record_id, seen in gaps.items()]
+        _apply(_fold(late), checkpoint, result)
+        result.records += len(late)
+
+    while True:
+        rows = list(records.filter(id__gt=result.last_record_id)[:chunk_size])
+        if not rows:
+            return result
+        checkpoint.gaps = (checkpoint.gaps + _missing(result.last_record_id, [row[0] for row in rows], now))[-MAX_GAPS:]
+        result.last_record_id = checkpoint.last_record_id = rows[-1][0]
+        _apply(_fold(rows), checkpoint, result)
+        result.records += len(rows)
+        if progress is not None:
+            progress(result)
+        if len(rows) < chunk_size:
+            return result
+
+
+def clusters(min_students=None, limit=None) -> list:
+    # Devices linked to at least min_students students, most students first
+    min_students = settings.DEVICE_SHARING_MIN_STUDENTS if min_students is None else min_students
+    limit = settings.DEVICE_SHARING_SHOWN if limit is None else limit
+    devices = list(
+        DeviceStudentLink.objects.values('fingerprint')
+        .annotate(
+            students=Count('id'), sessions=Sum('sessions'),
+            first_seen=Min('first_seen'), last_seen=Max('last_seen'),
+        )
+        .filter(students__gte=min_students)
+        .order_by('-students', '-last_seen')[:limit]
+    )
+    members = {}
+    links = (
+        DeviceStudentLink.objects.filter(fingerprint__in=[d['fingerprint'] for d in devices])
+        .order_by('-sessions', 'student__student_id')
+        .values_list('fingerprint', 'student__student_id', 'student__full_name', 'sessions')
+    )
+    for fingerprint, student_id, full_name, sessions in links:
+        members.setdefault(fingerprint, []).append((student_id, full_name, sessions))
+    return [
+        DeviceCluster(
+            fingerprint=d['fingerprint'], sessions=d['sessions'],
+            first_seen=d['first_seen'], last_seen=d['last_seen'],
+            students=members.get(d['fingerprint'], []),
+        )
+        for d in devices
+    ]
+
@@ -0,0 +1,164 @@
+import asyncio
+import json
+import logging
+import threading
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+# Live attendance feed: views publish record events per session code, and
+# the SSE endpoint relays them to open teacher screens.
+
+RESET = {'type': 'reset'}
+
+
+def record_payload(record, student) -> dict:
+    return {
+        'id': record.id,
+        'student_id': student.student_id,
+        'full_name': student.full_name,
+        'scanned_at': record.scanned_at.isoformat(),
+    }
+
+
+def created_event(record, student) -> dict:
+    return {'type': 'created', 'record': record_payload(record, student)}
+
+
+def deleted_event(record_id) -> dict:
+    return {'type': 'deleted', 'id': int(record_id)}
+
+
+class _Subscription:
+    def __init__(self, broadcaster, channel):
+        self.broadcaster = broadcaster
+        self.channel = channel
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(maxsize=settings.LIVE_QUEUE_SIZE)
+        self.overflowed = False
+
+    def offer(self, event):
+        # Runs on the subscriber's loop. A consumer that falls behind gets a
+        # single reset instead of an unbounded backlog; the client then
+        # reloads the full list.
+        if self.overflowed:
+            return
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self.overflowed = True
+
+    async def get(self, timeout):
+        if self.overflowed:
+            self.overflowed = False
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            return RESET
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    async def close(self):
+        self.broadcaster._remove(self)
+
+
+class InProcessBroadcaster:
+    # Fan-out within a single worker process. Publishing is thread-safe, so
+    # sync views running in a thread pool can publish to async subscribers.
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = {}
+
+    def publish(self, channel: str, event: dict):
+        with self._lock:
+            subscribers = list(self._subscribers.get(channel, ()))
+        for sub in subscribers:
+            try:
+                sub.loop.call_soon_threadsafe(sub.offer, event)
+            except RuntimeError:
+                # Loop already closed; the subscriber is going away
+                self._remove(sub)
+
+    async def subscribe(self, channel: str):
+        sub = _Subscription(self, channel)
+        with self._lock:
+            self._subscribers.setdefault(channel, set()).add(sub)
+        return sub
+
+    def _remove(self, sub):
+        with self._lock:
+            subs = self._subscribers.get(sub.channel)
+            if subs is not None:
+                subs.discard(sub)
+                if not subs:
+                    del self._subscribers[sub.channel]
+
+
+class _RedisSubscription:
+    def __init__(self, pubsub):
+        self.pubsub = pubsub
+
+    async def get(self, timeout):
+        message = await self.pubsub.get_message(ignore_subscribe_messages=True, timeout=timeout)
+        if message is None:
+            return None
+        return json.loads(message['data'])
+
+    async def close(self):
+        await self.pubsub.aclose()
+
+
+class RedisBroadcaster:
+    # Pub/sub through Redis (or a compatible server such as Valkey) so that
+    # events published by one worker reach subscribers on every worker.
+
+    def __init__(self):
+        try:
+            import redis
+            import redis.asyncio
+        except ImportError as exc:
+            raise ImproperlyConfigured("RedisBroadcaster requires the 'redis' package") from exc
+        self._url = settings.LIVE_REDIS_URL
+        self._client = redis.Redis.from_url(self._url)
+        self._async_client = redis.asyncio.Redis.from_url(self._url)
+
+    def _key(self, channel):
+        return f"qrat:live:{channel}"
+
+    def publish(self, channel: str, event: dict):
+        try:
+            self._client.publish(self._key(channel), json.dumps(event))
+        except Exception:
+            # The feed is best effort; polling clients still see the change
+            logger.exception("live publish failed for %s", channel)
+
+    async def subscribe(self, channel: str):
+        pubsub = self._async_client.pubsub()
+        await pubsub.subscribe(self._key(channel))
+        return _RedisSubscription(pubsub)
+
+
+_broadcaster = None
+_broadcaster_lock = threading.Lock()
+
+
+def get_broadcaster():
+    global _broadcaster
+    if _broadcaster is None:
+        with _broadcaster_lock:
+            if _broadcaster is None:
+                _broadcaster = import_string(settings.LIVE_BROADCASTER)()
+    return _broadcaster
+
+
+def publish(channel: str, event: dict):
+    get_broadcaster().publish(channel, event)
+
+
+def sse(event: dict) -> str:
+    return f"event: {event['type']}\ndata: {json.dumps(event)}\n\n"
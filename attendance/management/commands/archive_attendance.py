@@ -0,0 +1,36 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+
+from attendance import archive
+
+
+class Command(BaseCommand):
+    help = "Move closed sessions and their records into a gzipped JSONL archive, keeping a summary row per session"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--before", required=True, help="YYYY-MM-DD; rounded down to the first of its month")
+        parser.add_argument("--chunk-size", type=int, default=archive.CHUNK_SIZE, help="Sessions per transaction")
+        parser.add_argument("--dry-run", action="store_true", help="Only count what would be archived")
+
+    def handle(self, *args, **options):
+        try:
+            before = date.fromisoformat(options["before"])
+        except ValueError as exc:
+            raise CommandError(exc)
+        cutoff = archive.cutoff(before)
+        if options["dry_run"]:
+            count = archive.candidates(before).count()
+            self.stdout.write(f"{count} closed session(s) started before {cutoff} would be archived")
+            return
+
+        def progress(result):
+            self.stdout.write(f"{result.sessions} sessions, {result.records} records")
+
+        result = archive.archive(before, chunk_size=options["chunk_size"], progress=progress)
+        if not result.sessions:
+            self.stdout.write(f"No closed sessions started before {cutoff}")
+            return
+        self.stdout.write(self.style.SUCCESS(
+            f"Archived {result.sessions} sessions and {result.records} records to {result.path}"
+        ))
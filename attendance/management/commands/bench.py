@@ -0,0 +1,268 @@
+import asyncio
+import json
+import queue
+import random
+import re
+import threading
+import time
+from collections import defaultdict
+from pathlib import Path
+
+import django
+from asgiref.sync import ThreadSensitiveContext
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import AsyncClient, Client
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from attendance import tokens
+from attendance.models import Subject, Teacher
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    rank = max(0, min(len(sorted_values) - 1, round(pct / 100 * len(sorted_values)) - 1))
+    return sorted_values[rank]
+
+
+SERVER_TIMING_QUERIES = re.compile(r'desc="(\d+) queries"')
+
+
+class QueryCounter:
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+class Command(BaseCommand):
+    help = "Simulate a class-start burst against a throwaway test database and report latency per endpoint"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--students", type=int, default=200, help="Students scanning in the burst")
+        parser.add_argument("--concurrency", type=int, default=20, help="Concurrent client threads")
+        parser.add_argument("--polls", type=int, default=200, help="records.json polls during the burst")
+        parser.add_argument("--qr", type=int, default=100, help="QR image fetches during the burst")
+        parser.add_argument("--seed", type=int, default=1, help="Random seed for request ordering")
+        parser.add_argument("--label", default="", help="Free-form label stored with the results")
+        parser.add_argument("--output", help="Where to write the JSON results (default: var/bench/<vendor>-<time>.json)")
+        parser.add_argument("--keepdb", action="store_true", help="Keep the test database between runs")
+        parser.add_argument(
+            "--asgi", action="store_true",
+            help="Drive the burst through the async handler on one event loop, as an ASGI server would",
+        )
+
+    def handle(self, *args, **options):
+        setup_test_environment()
+        db = settings.DATABASES['default']
+        if connection.vendor == 'sqlite':
+            # A file, not the default in-memory test DB, so concurrent
+            # connections behave like they do in production.
+            bench_db = Path(settings.BASE_DIR) / 'var' / 'bench.sqlite3'
+            bench_db.parent.mkdir(parents=True, exist_ok=True)
+            db.setdefault('TEST', {})['NAME'] = str(bench_db)
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, keepdb=options["keepdb"])
+        try:
+            results = self.run_bench(options)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0, keepdb=options["keepdb"])
+            teardown_test_environment()
+
+        output = options["output"]
+        if not output:
+            stamp = time.strftime('%Y%m%d-%H%M%S')
+            output = Path(settings.BASE_DIR) / 'var' / 'bench' / f"{results['meta']['vendor']}-{stamp}.json"
+        output = Path(output)
+        output.parent.mkdir(parents=True, exist_ok=True)
+        output.write_text(json.dumps(results, indent=2))
+        self.report(results)
+        self.stdout.write(self.style.SUCCESS(f"Results written to {output}"))
+
+    def run_bench(self, options):
+        call_command('seed_students', count=options["students"], stdout=self.stdout)
+        call_command('seed_meta', stdout=self.stdout)
+
+        teacher = Client()
+        teacher.post('/login/', {'pin': '1234'})
+        response = teacher.post('/start/', {
+            'title': 'Bench Session',
+            'time_slot': 'bench',
+            'duration': '60',
+            'teacher': Teacher.objects.values_list('id', flat=True).first(),
+            'subject': Subject.objects.values_list('id', flat=True).first(),
+        })
+        code = response.url.rstrip('/').rsplit('/', 1)[-1]
+
+        rng = random.Random(options["seed"])
+        tasks = []
+        for i in range(1, options["students"] + 1):
+            ip = f"10.{i // 65536 % 256}.{i // 256 % 256}.{i % 256}"
+            tasks.append(('scan_page', self._scan_page(code, ip)))
+            tasks.append(('roster_json', self._get('/roster.json', ip)))
+            tasks.append(('scan_mark', self._scan_mark(code, f"S{i:03d}", ip)))
+        tasks.extend(('records_json', self._get(f'/t/{code}/records.json')) for _ in range(options["polls"]))
+        # The QR image is teacher-only; replay the teacher's session cookie
+        cookies = {settings.SESSION_COOKIE_NAME: teacher.cookies[settings.SESSION_COOKIE_NAME].value}
+        tasks.extend(('qr_image', self._get(f'/qr/{code}.png', cookies=cookies)) for _ in range(options["qr"]))
+        rng.shuffle(tasks)
+
+        samples = defaultdict(list)
+        errors = defaultdict(int)
+        started = time.perf_counter()
+        if options["asgi"]:
+            asyncio.run(self._run_async(tasks, options["concurrency"], samples, errors))
+        else:
+            self._run_threads(tasks, options["concurrency"], samples, errors)
+        wall = time.perf_counter() - started
+
+        endpoints = {}
+        for name, values in sorted(samples.items()):
+            latencies = sorted(v[0] * 1000 for v in values)
+            endpoints[name] = {
+                'requests': len(values),
+                'errors': errors[name],
+                'p50_ms': round(percentile(latencies, 50), 3),
+                'p95_ms': round(percentile(latencies, 95), 3),
+                'p99_ms': round(percentile(latencies, 99), 3),
+                'max_ms': round(latencies[-1], 3),
+                'throughput_rps': round(len(values) / wall, 2),
+                'queries_per_request': round(sum(v[1] for v in values) / len(values), 2),
+            }
+        return {
+            'meta': {
+                'label': options["label"],
+                'vendor': connection.vendor,
+                'django': django.get_version(),
+                'conn_max_age': settings.DATABASES['default'].get('CONN_MAX_AGE', 0),
+                'journal_mode': self._journal_mode(),
+                'scan_write_behind': settings.SCAN_WRITE_BEHIND,
+                'handler': 'asgi' if options["asgi"] else 'wsgi',
+                'students': options["students"],
+                'concurrency': options["concurrency"],
+                'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            },
+            'total': {
+                'requests': len(tasks),
+                'wall_seconds': round(wall, 3),
+                'throughput_rps': round(len(tasks) / wall, 2),
+            },
+            'endpoints': endpoints,
+        }
+
+    def _run_threads(self, tasks, concurrency, samples, errors):
+        work = queue.Queue()
+        for task in tasks:
+            work.put(task)
+        lock = threading.Lock()
+
+        def worker():
+            client = Client()
+            try:
+                while True:
+                    try:
+                        name, fn = work.get_nowait()
+                    except queue.Empty:
+                        return
+                    counter = QueryCounter()
+                    started = time.perf_counter()
+                    with connection.execute_wrapper(counter):
+                        status = fn(client).status_code
+                    elapsed = time.perf_counter() - started
+                    with lock:
+                        samples[name].append((elapsed, counter.count))
+                        if self._failed(name, status):
+                            errors[name] += 1
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+    async def _run_async(self, tasks, concurrency, samples, errors):
+        work = asyncio.Queue()
+        for task in tasks:
+            work.put_nowait(task)
+
+        async def worker():
+            client = AsyncClient()
+            while not work.empty():
+                name, fn = work.get_nowait()
+                started = time.perf_counter()
+                # One sync thread per request, as Django's ASGIHandler does
+                async with ThreadSensitiveContext():
+                    response = await fn(client)
+                elapsed = time.perf_counter() - started
+                # Queries run in per-request threads; the metrics middleware
+                # already counted them for the Server-Timing header
+                match = SERVER_TIMING_QUERIES.search(response.get('Server-Timing', ''))
+                samples[name].append((elapsed, int(match.group(1)) if match else 0))
+                if self._failed(name, response.status_code):
+                    errors[name] += 1
+
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+
+    def _failed(self, name, status):
+        # 409 is scan_mark turning away a repeat student or device, which
+        # the burst is expected to produce; anything else outside 2xx/304
+        # is an error
+        if name == 'scan_mark' and status == 409:
+            return False
+        return not (200 <= status < 300 or status == 304)
+
+    def _journal_mode(self):
+        if connection.vendor != 'sqlite':
+            return ''
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA journal_mode')
+            return cursor.fetchone()[0]
+
+    def _client_ip(self, ip):
+        # Via X-Forwarded-For (which the device fingerprint prefers): the
+        # async test client doesn't map REMOTE_ADDR into the ASGI scope.
+        return {'X-Forwarded-For': ip}
+
+    def _scan_page(self, code, ip):
+        def run(client):
+            return client.get(f'/scan/{code}', {'t': tokens.make_token(code)}, headers=self._client_ip(ip))
+        return run
+
+    def _scan_mark(self, code, student_id, ip):
+        def run(client):
+            return client.post(
+                f'/scan/{code}/mark',
+                {'t': tokens.make_token(code), 'student_id': student_id},
+                headers=self._client_ip(ip),
+            )
+        return run
+
+    def _get(self, path, ip='127.0.0.1', cookies=None):
+        def run(client):
+            if cookies:
+                # On a client of its own: AsyncClient ignores a Cookie
+                # header, and the worker's client shouldn't carry the
+                # teacher's session into the scans
+                client = type(client)()
+                client.cookies.load(cookies)
+            return client.get(path, headers=self._client_ip(ip))
+        return run
+
+    def report(self, results):
+        meta, total = results['meta'], results['total']
+        self.stdout.write(
+            f"{meta['vendor']} ({meta['handler']}) · {total['requests']} requests in {total['wall_seconds']}s "
+            f"({total['throughput_rps']} req/s, concurrency {meta['concurrency']})"
+        )
+        self.stdout.write(f"{'endpoint':<14}{'reqs':>7}{'err':>5}{'p50':>9}{'p95':>9}{'p99':>9}{'req/s':>9}{'q/req':>7}")
+        for name, row in results['endpoints'].items():
+            self.stdout.write(
+                f"{name:<14}{row['requests']:>7}{row['errors']:>5}{row['p50_ms']:>9.2f}{row['p95_ms']:>9.2f}"
+                f"{row['p99_ms']:>9.2f}{row['throughput_rps']:>9.2f}{row['queries_per_request']:>7.2f}"
+            )
@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+
+from attendance import devicesharing
+
+
+class Command(BaseCommand):
+    help = "Fold new attendance records into the device -> student links and list devices shared between students"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--full", action="store_true", help="Drop the links and checkpoint and rescan every record")
+        parser.add_argument("--chunk-size", type=int, default=devicesharing.CHUNK_SIZE, help="Records per transaction")
+        parser.add_argument("--min-students", type=int, help="Students a device must have marked to be listed")
+        parser.add_argument("--limit", type=int, help="Devices to list")
+
+    def handle(self, *args, **options):
+        if options["full"]:
+            devicesharing.reset()
+
+        def progress(result):
+            self.stdout.write(f"{result.records} records up to id {result.last_record_id}")
+
+        result = devicesharing.scan(chunk_size=options["chunk_size"], progress=progress)
+        self.stdout.write(self.style.SUCCESS(
+            f"Scanned {result.records} new records: {result.created} links created, {result.updated} updated"
+        ))
+        for cluster in devicesharing.clusters(options["min_students"], options["limit"]):
+            self.stdout.write(
+                f"{cluster.fingerprint}: {len(cluster.students)} students over {cluster.sessions} sessions, "
+                f"{cluster.first_seen} to {cluster.last_seen}"
+            )
+            for student_id, full_name, sessions in cluster.students:
+                self.stdout.write(f"  {student_id} {full_name} ({sessions})")
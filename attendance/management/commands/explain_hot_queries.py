@@ -0,0 +1,67 @@
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.utils import timezone
+
+from attendance import sessionlist
+from attendance.models import AttendanceRecord, AttendanceSession, Student
+from attendance.reporting import filtered_archive, filtered_rollups, filtered_sessions
+
+
+def looks_like_full_scan(vendor, plan):
+    # SQLite reports "SCAN <table>" for a table walk (a covering index shows
+    # as "USING ... INDEX"); MySQL marks it with access type ALL.
+    for line in plan.splitlines():
+        if vendor == 'sqlite' and ' SCAN ' in f" {line.strip()} " and 'INDEX' not in line:
+            return True
+        if vendor == 'mysql' and ' ALL ' in f" {line} ":
+            return True
+    return False
+
+
+class Command(BaseCommand):
+    help = "Print EXPLAIN output for the app's hot queries and flag full table scans"
+
+    def handle(self, *args, **options):
+        session = AttendanceSession.objects.order_by('-id').first()
+        session_id = session.id if session else 1
+        code = session.code if session else 'code'
+        teacher_id = session.teacher_id if session and session.teacher_id else 1
+        subject_id = session.subject_id if session and session.subject_id else 1
+        today = timezone.localdate().isoformat()
+
+        queries = [
+            ('reports: teacher + subject + dates',
+             filtered_sessions(teacher_id, subject_id, '2000-01-01', today)),
+            ('reports: subject only', filtered_sessions('', subject_id)),
+            ('reports: date range only', filtered_sessions('', '', '2000-01-01', today)),
+            ('reports: daily rollups', filtered_rollups(teacher_id, '', '2000-01-01', today)),
+            ('reports: sessions not rolled up', filtered_sessions('', '', '2000-01-01', today).filter(rolled_up=False)),
+            ('reports: archived summaries', filtered_archive(teacher_id, subject_id, '2000-01-01', today)),
+            ('reports: records export',
+             AttendanceRecord.objects.filter(session__in=filtered_sessions(teacher_id).values('id')).order_by('id')),
+            ('dashboard: first page', sessionlist.listing()[:sessionlist.PAGE_SIZE + 1]),
+            ('dashboard: older page', sessionlist.listing(sessionlist.encode_cursor(session))[:sessionlist.PAGE_SIZE + 1]
+             if session else sessionlist.listing()[:sessionlist.PAGE_SIZE + 1]),
+            ('dashboard: totals', AttendanceSession.objects.filter(sessionlist.open_q())),
+            ('scan: session by code', AttendanceSession.objects.filter(code=code)),
+            ('scan: student by id', Student.objects.filter(student_id='S001')),
+            ('scan: seen set warm-up',
+             AttendanceRecord.objects.filter(session_id=session_id).values_list('student__student_id', 'device_fingerprint')),
+            ('teacher page: live records',
+             AttendanceRecord.objects.filter(session_id=session_id).order_by('-scanned_at')),
+            ('records.json: delta since cursor',
+             AttendanceRecord.objects.filter(session_id=session_id, id__gt=0).order_by('id')),
+        ]
+
+        flagged = 0
+        for name, qs in queries:
+            plan = qs.explain()
+            full_scan = looks_like_full_scan(connection.vendor, plan)
+            flagged += full_scan
+            title = f"== {name}" + (" [FULL SCAN]" if full_scan else "")
+            self.stdout.write(self.style.WARNING(title) if full_scan else self.style.MIGRATE_HEADING(title))
+            self.stdout.write(str(qs.query))
+            self.stdout.write(plan)
+            self.stdout.write("")
+        summary = f"{len(queries)} queries explained on {connection.vendor}, {flagged} with a full scan"
+        self.stdout.write(self.style.WARNING(summary) if flagged else self.style.SUCCESS(summary))
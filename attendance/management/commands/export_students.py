@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from attendance import studentio
+
+
+class Command(BaseCommand):
+    help = "Write the student roster as CSV or JSONL"
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", nargs="?", default="-", help="Output file (default: stdout)")
+        parser.add_argument("--format", choices=studentio.FORMATS, help="Default: from the file extension, else csv")
+
+    def handle(self, *args, **options):
+        path = options["path"]
+        fmt = options["format"] or studentio.guess_format(path)
+        if path == '-':
+            for line in studentio.export_lines(fmt):
+                self.stdout.write(line, ending='')
+            return
+        count = 0
+        with open(path, 'w', encoding='utf-8', newline='') as fh:
+            for line in studentio.export_lines(fmt):
+                fh.write(line)
+                count += 1
+        rows = count - 1 if fmt == 'csv' else count
+        self.stderr.write(self.style.SUCCESS(f"Exported {rows} students to {path}"))
@@ -0,0 +1,47 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from attendance import studentio
+
+
+class Command(BaseCommand):
+    help = "Create or update students from a CSV (student_id,full_name[,is_active]) or JSONL roster"
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="Roster file, or - for stdin")
+        parser.add_argument("--format", choices=studentio.FORMATS, help="Default: from the file extension, else csv")
+        parser.add_argument("--chunk-size", type=int, default=studentio.CHUNK_SIZE, help="Rows per transaction")
+        parser.add_argument("--no-update", action="store_true", help="Only add new students, leave existing ones alone")
+
+    def handle(self, *args, **options):
+        path = options["path"]
+        fmt = options["format"] or studentio.guess_format(path)
+
+        def progress(result):
+            self.stdout.write(
+                f"{result.rows} rows: {result.created} created, {result.updated} updated, "
+                f"{result.unchanged} unchanged, {result.skipped} skipped"
+            )
+
+        try:
+            fh = sys.stdin if path == '-' else open(path, encoding='utf-8-sig', newline='')
+        except OSError as exc:
+            raise CommandError(exc)
+        with fh:
+            try:
+                result = studentio.import_students(
+                    studentio.read_rows(fh, fmt),
+                    chunk_size=options["chunk_size"],
+                    update_existing=not options["no_update"],
+                    progress=progress,
+                )
+            except ValueError as exc:
+                raise CommandError(f"Could not read {path}: {exc}")
+        for error in result.errors:
+            self.stderr.write(error)
+        if result.skipped > len(result.errors):
+            self.stderr.write(f"... {result.skipped - len(result.errors)} more rows skipped")
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {result.rows} rows: {result.created} created, {result.updated} updated"
+        ))
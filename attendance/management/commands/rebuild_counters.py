@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from attendance import counters
+from attendance.models import AttendanceSession
+
+
+class Command(BaseCommand):
+    help = "Recompute the stored present/device counters on sessions, or report drift with --check"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--check", action="store_true", help="Only report sessions whose counters drifted")
+        parser.add_argument("--session", help="Limit to one session code")
+
+    def handle(self, *args, **options):
+        sessions = AttendanceSession.objects.all()
+        if options["session"]:
+            sessions = sessions.filter(code=options["session"])
+        drifted = list(counters.drift(sessions))
+        for s in drifted:
+            self.stdout.write(
+                f"{s.code}: present {s.present_count} (actual {s.actual_present}), "
+                f"devices {s.unique_devices_count} (actual {s.actual_devices})"
+            )
+        if options["check"]:
+            if drifted:
+                raise CommandError(f"{len(drifted)} session(s) drifted")
+            self.stdout.write(self.style.SUCCESS("All session counters are consistent"))
+            return
+        fixed = counters.recount(sessions.filter(id__in=[s.id for s in drifted])) if drifted else 0
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt counters on {fixed} session(s)"))
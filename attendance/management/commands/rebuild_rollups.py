@@ -0,0 +1,24 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+
+from attendance import rollups
+
+
+class Command(BaseCommand):
+    help = "Rebuild the daily and per-student monthly rollups that reports read from"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--from", dest="date_from", help="First day (YYYY-MM-DD); widened to the start of its month")
+        parser.add_argument("--to", dest="date_to", help="Last day (YYYY-MM-DD); widened to the end of its month")
+
+    def handle(self, *args, **options):
+        try:
+            date_from = date.fromisoformat(options["date_from"]) if options["date_from"] else None
+            date_to = date.fromisoformat(options["date_to"]) if options["date_to"] else None
+        except ValueError as exc:
+            raise CommandError(exc)
+        counts = rollups.rebuild(date_from, date_to)
+        self.stdout.write(self.style.SUCCESS(
+            f"Rebuilt {counts['daily']} daily and {counts['monthly']} student-month rollup rows"
+        ))
@@ -0,0 +1,26 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from attendance import sweeper
+
+
+class Command(BaseCommand):
+    help = "Close sessions whose end time has passed, once or every --interval seconds"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--once", action="store_true", help="Sweep once and exit")
+        parser.add_argument(
+            "--interval", type=int, default=settings.SESSION_SWEEP_SECONDS,
+            help="Seconds between sweeps (default: SESSION_SWEEP_SECONDS)",
+        )
+
+    def handle(self, *args, **options):
+        if options["once"]:
+            closed = sweeper.sweep()
+            self.stdout.write(self.style.SUCCESS(f"Closed {closed} expired session(s)"))
+            return
+        self.stdout.write(f"Sweeping every {options['interval']}s; Ctrl-C to stop")
+        try:
+            sweeper.run(options["interval"])
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,109 @@
+import threading
+import time
+from contextvars import ContextVar
+from dataclasses import dataclass
+
+# Per-request timings collected by RequestMetricsMiddleware and the timed
+# template backend, plus per-view totals for the /metrics endpoint.
+
+
+@dataclass
+class RequestStats:
+    queries: int = 0
+    db_seconds: float = 0.0
+    template_seconds: float = 0.0
+    branch: str = ''
+
+
+@dataclass
+class ViewTotals:
+    requests: int = 0
+    seconds: float = 0.0
+    queries: int = 0
+    db_seconds: float = 0.0
+    template_seconds: float = 0.0
+    budget_exceeded: int = 0
+
+
+current = ContextVar('attendance_request_stats', default=None)
+
+_lock = threading.Lock()
+_totals = {}
+
+
+class QueryTimer:
+    # connection.execute_wrapper hook
+    def __init__(self, stats):
+        self.stats = stats
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.stats.queries += 1
+            self.stats.db_seconds += time.perf_counter() - started
+
+
+def add_template_time(seconds: float):
+    stats = current.get()
+    if stats is not None:
+        stats.template_seconds += seconds
+
+
+def set_branch(branch: str):
+    # Views whose query count depends on the path taken name it, so the
+    # budget for "<url name>:<branch>" applies instead of the plain one
+    stats = current.get()
+    if stats is not None:
+        stats.branch = branch
+
+
+def record(view: str, stats: RequestStats, seconds: float, over_budget: bool):
+    with _lock:
+        totals = _totals.setdefault(view, ViewTotals())
+        totals.requests += 1
+        totals.seconds += seconds
+        totals.queries += stats.queries
+        totals.db_seconds += stats.db_seconds
+        totals.template_seconds += stats.template_seconds
+        totals.budget_exceeded += 1 if over_budget else 0
+
+
+def snapshot() -> dict:
+    with _lock:
+        return {view: ViewTotals(**vars(t)) for view, t in _totals.items()}
+
+
+def reset():
+    with _lock:
+        _totals.clear()
+
+
+def server_timing(stats: RequestStats, seconds: float) -> str:
+    return (
+        f'db;dur={stats.db_seconds * 1000:.1f};desc="{stats.queries} queries", '
+        f'tpl;dur={stats.template_seconds * 1000:.1f}, '
+        f'total;dur={seconds * 1000:.1f}'
+    )
+
+
+_METRICS = [
+    ('qrat_requests_total', 'counter', 'Requests handled per view', 'requests'),
+    ('qrat_request_duration_seconds_total', 'counter', 'Wall time spent per view', 'seconds'),
+    ('qrat_db_queries_total', 'counter', 'SQL queries issued per view', 'queries'),
+    ('qrat_db_duration_seconds_total', 'counter', 'Time spent in SQL per view', 'db_seconds'),
+    ('qrat_template_duration_seconds_total', 'counter', 'Time spent rendering templates per view', 'template_seconds'),
+    ('qrat_query_budget_exceeded_total', 'counter', 'Requests that went over the view query budget', 'budget_exceeded'),
+]
+
+
+def prometheus_text() -> str:
+    totals = snapshot()
+    lines = []
+    for name, kind, help_text, attr in _METRICS:
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {kind}')
+        for view in sorted(totals):
+            lines.append(f'{name}{{view="{view}"}} {getattr(totals[view], attr)}')
+    return '\n'.join(lines) + '\n'
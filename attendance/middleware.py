@@ -0,0 +1,81 @@
+import logging
+import time
+from contextlib import ExitStack
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import connections
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+class RequestMetricsMiddleware:
+    # Counts queries and DB/template/wall time for every request, reports them
+    # in a Server-Timing header and accumulates per-view totals for /metrics.
+    # QUERY_BUDGETS maps URL names (or "<url name>:<branch>", see
+    # metrics.set_branch) to a query limit; going over it logs a warning, or
+    # raises when QUERY_BUDGET_STRICT is on (as in tests).
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        stats, token, started = self._start()
+        try:
+            with self._timers(stats):
+                response = self.get_response(request)
+        finally:
+            metrics.current.reset(token)
+        return self._finish(request, response, stats, started)
+
+    async def __acall__(self, request):
+        stats, token, started = self._start()
+        # Connections are per thread and async views run their queries in
+        # the request's sync worker thread, so the timers go on there.
+        timers = await sync_to_async(self._timers)(stats)
+        try:
+            response = await self.get_response(request)
+        finally:
+            await sync_to_async(timers.close)()
+            metrics.current.reset(token)
+        return self._finish(request, response, stats, started)
+
+    def _start(self):
+        stats = metrics.RequestStats()
+        return stats, metrics.current.set(stats), time.perf_counter()
+
+    def _timers(self, stats):
+        stack = ExitStack()
+        timer = metrics.QueryTimer(stats)
+        for alias in connections:
+            stack.enter_context(connections[alias].execute_wrapper(timer))
+        return stack
+
+    def _finish(self, request, response, stats, started):
+        elapsed = time.perf_counter() - started
+        match = getattr(request, 'resolver_match', None)
+        view = (match.url_name or match.view_name) if match else 'unresolved'
+        budget = settings.QUERY_BUDGETS.get(view)
+        if stats.branch:
+            budget = settings.QUERY_BUDGETS.get(f"{view}:{stats.branch}", budget)
+        over_budget = budget is not None and stats.queries > budget
+        metrics.record(view, stats, elapsed, over_budget)
+        response['Server-Timing'] = metrics.server_timing(stats, elapsed)
+        if over_budget:
+            message = f"{view} ran {stats.queries} queries, budget is {budget}"
+            if settings.QUERY_BUDGET_STRICT:
+                raise QueryBudgetExceeded(message)
+            logger.warning(message)
+        return response
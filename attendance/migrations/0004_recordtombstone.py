@@ -0,0 +1,23 @@
+# Generated by Django 5.2.6 on 2026-10-18 03:19
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('attendance', '0003_subject_teacher_attendancesession_date_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RecordTombstone',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('record_id', models.BigIntegerField()),
+                ('deleted_at', models.DateTimeField(auto_now_add=True)),
+                ('session', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='tombstones', to='attendance.attendancesession')),
+            ],
+        ),
+    ]
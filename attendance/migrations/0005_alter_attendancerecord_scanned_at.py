@@ -0,0 +1,19 @@
+# Generated by Django 5.2.6 on 2026-10-18 03:22
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('attendance', '0004_recordtombstone'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='attendancerecord',
+            name='scanned_at',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False),
+        ),
+    ]
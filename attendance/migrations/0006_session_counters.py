@@ -0,0 +1,23 @@
+# Generated by Django 5.2.6 on 2026-10-18 03:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('attendance', '0005_alter_attendancerecord_scanned_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='attendancesession',
+            name='present_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='attendancesession',
+            name='unique_devices_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,26 @@
+from django.db import migrations
+from django.db.models import Count, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def backfill(apps, schema_editor):
+    AttendanceSession = apps.get_model('attendance', 'AttendanceSession')
+    AttendanceRecord = apps.get_model('attendance', 'AttendanceRecord')
+    records = AttendanceRecord.objects.filter(session=OuterRef('pk')).order_by().values('session')
+    AttendanceSession.objects.update(
+        present_count=Coalesce(Subquery(records.annotate(n=Count('id')).values('n')), Value(0)),
+        unique_devices_count=Coalesce(
+            Subquery(records.annotate(n=Count('device_fingerprint', distinct=True)).values('n')), Value(0)
+        ),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('attendance', '0006_session_counters'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill, migrations.RunPython.noop),
+    ]
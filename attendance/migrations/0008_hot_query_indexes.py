@@ -0,0 +1,29 @@
+# Generated by Django 5.2.6 on 2026-10-18 03:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('attendance', '0007_backfill_session_counters'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='attendancerecord',
+            index=models.Index(fields=['session', 'scanned_at'], name='att_record_session_scanned'),
+        ),
+        migrations.AddIndex(
+            model_name='attendancesession',
+            index=models.Index(fields=['teacher', 'subject', 'starts_at'], name='att_session_tch_subj_start'),
+        ),
+        migrations.AddIndex(
+            model_name='attendancesession',
+            index=models.Index(fields=['subject', 'starts_at'], name='att_session_subj_start'),
+        ),
+        migrations.AddIndex(
+            model_name='attendancesession',
+            index=models.Index(fields=['starts_at'], name='att_session_starts'),
+        ),
+    ]
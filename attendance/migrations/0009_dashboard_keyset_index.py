@@ -0,0 +1,21 @@
+# Generated by Django 5.2.6 on 2026-10-18 03:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('attendance', '0008_hot_query_indexes'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='attendancesession',
+            name='att_session_starts',
+        ),
+        migrations.AddIndex(
+            model_name='attendancesession',
+            index=models.Index(fields=['starts_at', 'id'], name='att_session_starts_id'),
+        ),
+    ]
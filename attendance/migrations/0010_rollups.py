@@ -0,0 +1,82 @@
+# Generated by Django 5.2.6 on 2026-10-18 03:37
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('attendance', '0009_dashboard_keyset_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('sessions', models.PositiveIntegerField(default=0)),
+                ('present', models.PositiveIntegerField(default=0)),
+                ('unique_devices', models.PositiveIntegerField(default=0)),
+                ('latest_start', models.DateTimeField()),
+            ],
+        ),
+        migrations.CreateModel(
+            name='StudentMonthRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField()),
+                ('present', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='attendancesession',
+            name='rolled_up',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddIndex(
+            model_name='attendancesession',
+            index=models.Index(fields=['rolled_up', 'starts_at'], name='att_session_rolled_start'),
+        ),
+        migrations.AddField(
+            model_name='dailyrollup',
+            name='subject',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='attendance.subject'),
+        ),
+        migrations.AddField(
+            model_name='dailyrollup',
+            name='teacher',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='attendance.teacher'),
+        ),
+        migrations.AddField(
+            model_name='studentmonthrollup',
+            name='student',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='month_rollups', to='attendance.student'),
+        ),
+        migrations.AddField(
+            model_name='studentmonthrollup',
+            name='subject',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='attendance.subject'),
+        ),
+        migrations.AddIndex(
+            model_name='dailyrollup',
+            index=models.Index(fields=['date', 'teacher', 'subject'], name='att_daily_date_tch_subj'),
+        ),
+        migrations.AddIndex(
+            model_name='dailyrollup',
+            index=models.Index(fields=['teacher', 'date'], name='att_daily_tch_date'),
+        ),
+        migrations.AddIndex(
+            model_name='dailyrollup',
+            index=models.Index(fields=['subject', 'date'], name='att_daily_subj_date'),
+        ),
+        migrations.AddIndex(
+            model_name='studentmonthrollup',
+            index=models.Index(fields=['student', 'subject', 'month'], name='att_stmonth_student'),
+        ),
+        migrations.AddIndex(
+            model_name='studentmonthrollup',
+            index=models.Index(fields=['month', 'subject'], name='att_stmonth_month_subj'),
+        ),
+    ]
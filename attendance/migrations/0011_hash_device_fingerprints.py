@@ -0,0 +1,42 @@
+import hashlib
+
+from django.db import migrations, models
+
+CHUNK_SIZE = 2000
+
+
+def hash_fingerprint(raw):
+    # Same digest as attendance.scanning.hash_fingerprint at the time of
+    # writing; the stored values are already truncated to 120 chars, so the
+    # old collisions between long user agents remain for existing rows.
+    return hashlib.blake2b(raw.encode('utf-8', 'surrogatepass'), digest_size=16).hexdigest()
+
+
+def hash_existing(apps, schema_editor):
+    AttendanceRecord = apps.get_model('attendance', 'AttendanceRecord')
+    records = AttendanceRecord.objects.exclude(device_fingerprint='').order_by('id')
+    last_id = 0
+    while True:
+        chunk = list(records.filter(id__gt=last_id).only('id', 'device_fingerprint')[:CHUNK_SIZE])
+        for record in chunk:
+            record.device_fingerprint = hash_fingerprint(record.device_fingerprint)
+        AttendanceRecord.objects.bulk_update(chunk, ['device_fingerprint'])
+        if len(chunk) < CHUNK_SIZE:
+            return
+        last_id = chunk[-1].id
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('attendance', '0010_rollups'),
+    ]
+
+    operations = [
+        migrations.RunPython(hash_existing, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='attendancerecord',
+            name='device_fingerprint',
+            field=models.CharField(blank=True, default='', max_length=32),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.2.6 on 2026-10-18 04:02
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('attendance', '0011_hash_device_fingerprints'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AnalysisCheckpoint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=64, unique=True)),
+                ('last_record_id', models.BigIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='DeviceStudentLink',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fingerprint', models.CharField(max_length=32)),
+                ('sessions', models.PositiveIntegerField(default=0)),
+                ('first_seen', models.DateField()),
+                ('last_seen', models.DateField()),
+                ('student', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='device_links', to='attendance.student')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['student'], name='att_devlink_student')],
+                'unique_together': {('fingerprint', 'student')},
+            },
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 5.2.6 on 2026-10-18 04:07
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('attendance', '0012_device_sharing'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedSessionSummary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('code', models.CharField(max_length=64, unique=True)),
+                ('title', models.CharField(max_length=128)),
+                ('teacher_name', models.CharField(blank=True, max_length=128, null=True)),
+                ('subject_name', models.CharField(blank=True, max_length=128, null=True)),
+                ('time_slot', models.CharField(default='', max_length=64)),
+                ('starts_at', models.DateTimeField()),
+                ('ends_at', models.DateTimeField()),
+                ('present_count', models.PositiveIntegerField(default=0)),
+                ('unique_devices_count', models.PositiveIntegerField(default=0)),
+                ('archive_file', models.CharField(max_length=255)),
+                ('archived_at', models.DateTimeField(auto_now_add=True)),
+                ('subject', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='attendance.subject')),
+                ('teacher', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='attendance.teacher')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['teacher', 'subject', 'starts_at'], name='att_archived_tch_subj_start'), models.Index(fields=['subject', 'starts_at'], name='att_archived_subj_start'), models.Index(fields=['starts_at'], name='att_archived_start')],
+            },
+        ),
+    ]
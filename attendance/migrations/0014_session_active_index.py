@@ -0,0 +1,17 @@
+# Generated by Django 5.2.6 on 2026-10-18 04:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('attendance', '0013_archived_sessions'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='attendancesession',
+            index=models.Index(fields=['is_active', 'ends_at'], name='att_session_active_end'),
+        ),
+    ]
@@ -0,0 +1,76 @@
+# Generated by Django 5.2.6 on 2026-10-18 04:22
+
+from datetime import datetime, time, timedelta
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, DateField, Max
+from django.db.models.functions import TruncMonth
+from django.utils import timezone
+
+
+def split_by_teacher(apps, schema_editor):
+    # Month rows still backed by records are recomputed per teacher. Months
+    # already archived have no records left; their rows get the teacher when
+    # the archived sessions of that subject and month all had the same one.
+    StudentMonthRollup = apps.get_model('attendance', 'StudentMonthRollup')
+    AttendanceRecord = apps.get_model('attendance', 'AttendanceRecord')
+    ArchivedSessionSummary = apps.get_model('attendance', 'ArchivedSessionSummary')
+
+    monthly = StudentMonthRollup.objects.all()
+    records = AttendanceRecord.objects.filter(session__rolled_up=True)
+    latest = ArchivedSessionSummary.objects.aggregate(latest=Max('starts_at'))['latest']
+    if latest is not None:
+        horizon = (timezone.localdate(latest).replace(day=1) + timedelta(days=32)).replace(day=1)
+        archived = (
+            ArchivedSessionSummary.objects.annotate(month=TruncMonth('starts_at', output_field=DateField()))
+            .values('subject_id', 'month')
+            .annotate(teachers=Count('teacher_id', distinct=True), teacher_id=Max('teacher_id'))
+            .filter(teachers=1)
+            .order_by()
+        )
+        for row in archived:
+            monthly.filter(subject_id=row['subject_id'], month=row['month']).update(teacher_id=row['teacher_id'])
+        monthly = monthly.filter(month__gte=horizon)
+        records = records.filter(session__starts_at__gte=timezone.make_aware(datetime.combine(horizon, time.min)))
+
+    monthly.delete()
+    rows = (
+        records.annotate(month=TruncMonth('session__starts_at', output_field=DateField()))
+        .values('student_id', 'session__teacher_id', 'session__subject_id', 'month')
+        .annotate(present=Count('id'))
+        .order_by()
+    )
+    StudentMonthRollup.objects.bulk_create(
+        [
+            StudentMonthRollup(
+                student_id=row['student_id'],
+                teacher_id=row['session__teacher_id'],
+                subject_id=row['session__subject_id'],
+                month=row['month'],
+                present=row['present'],
+            )
+            for row in rows
+        ],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('attendance', '0014_session_active_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='studentmonthrollup',
+            name='teacher',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='attendance.teacher'),
+        ),
+        migrations.AddIndex(
+            model_name='studentmonthrollup',
+            index=models.Index(fields=['teacher', 'month'], name='att_stmonth_tch_month'),
+        ),
+        migrations.RunPython(split_by_teacher, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.6 on 2026-10-18 04:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('attendance', '0015_student_month_teacher'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='analysischeckpoint',
+            name='gaps',
+            field=models.JSONField(blank=True, default=list),
+        ),
+    ]
@@ -0,0 +1,95 @@
+# Generated by Django 5.2.6 on 2026-10-18 04:44
+
+from datetime import datetime, time, timedelta
+
+from django.db import migrations, models
+from django.db.models import Count, DateField, Max, Min, Q, Sum
+from django.db.models.functions import TruncDate, TruncMonth
+from django.utils import timezone
+
+
+def backfill(apps, schema_editor):
+    # Sessions that closed before 0010 were never rolled up, and rows from
+    # racing refreshes may be doubled. Everything after the archive horizon
+    # is rebuilt as rollups.rebuild does at the time of writing; archived
+    # months keep their month rows, less any duplicates.
+    AttendanceSession = apps.get_model('attendance', 'AttendanceSession')
+    AttendanceRecord = apps.get_model('attendance', 'AttendanceRecord')
+    ArchivedSessionSummary = apps.get_model('attendance', 'ArchivedSessionSummary')
+    DailyRollup = apps.get_model('attendance', 'DailyRollup')
+    StudentMonthRollup = apps.get_model('attendance', 'StudentMonthRollup')
+
+    sessions = AttendanceSession.objects.all()
+    daily = DailyRollup.objects.all()
+    monthly = StudentMonthRollup.objects.all()
+    latest = ArchivedSessionSummary.objects.aggregate(latest=Max('starts_at'))['latest']
+    if latest is not None:
+        horizon = (timezone.localdate(latest).replace(day=1) + timedelta(days=32)).replace(day=1)
+        sessions = sessions.filter(starts_at__gte=timezone.make_aware(datetime.combine(horizon, time.min)))
+        daily = daily.filter(date__gte=horizon)
+        monthly = monthly.filter(month__gte=horizon)
+
+    sessions.filter(Q(is_active=False) | Q(ends_at__lt=timezone.now())).update(rolled_up=True)
+    sessions = sessions.filter(rolled_up=True)
+    daily.delete()
+    rows = (
+        sessions.annotate(day=TruncDate('starts_at'))
+        .values('day', 'teacher_id', 'subject_id')
+        .annotate(
+            sessions=Count('id'),
+            present=Sum('present_count'),
+            unique_devices=Sum('unique_devices_count'),
+            latest_start=Max('starts_at'),
+        )
+        .order_by()
+    )
+    DailyRollup.objects.bulk_create([DailyRollup(date=row.pop('day'), **row) for row in rows], batch_size=1000)
+    monthly.delete()
+    rows = (
+        AttendanceRecord.objects.filter(session__in=sessions)
+        .annotate(month=TruncMonth('session__starts_at', output_field=DateField()))
+        .values('student_id', 'session__teacher_id', 'session__subject_id', 'month')
+        .annotate(present=Count('id'))
+        .order_by()
+    )
+    StudentMonthRollup.objects.bulk_create(
+        [
+            StudentMonthRollup(
+                student_id=row['student_id'],
+                teacher_id=row['session__teacher_id'],
+                subject_id=row['session__subject_id'],
+                month=row['month'],
+                present=row['present'],
+            )
+            for row in rows
+        ],
+        batch_size=1000,
+    )
+
+    # Doubled rows are identical recounts, so one of each is kept
+    for model, fields in (
+        (DailyRollup, ['date', 'teacher_id', 'subject_id']),
+        (StudentMonthRollup, ['student_id', 'teacher_id', 'subject_id', 'month']),
+    ):
+        doubled = model.objects.values(*fields).annotate(n=Count('id'), keep=Min('id')).filter(n__gt=1).order_by()
+        for row in doubled:
+            model.objects.filter(**{f: row[f] for f in fields}).exclude(id=row['keep']).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('attendance', '0016_checkpoint_gaps'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='dailyrollup',
+            constraint=models.UniqueConstraint(fields=('date', 'teacher', 'subject'), name='att_daily_unique_group'),
+        ),
+        migrations.AddConstraint(
+            model_name='studentmonthrollup',
+            constraint=models.UniqueConstraint(fields=('student', 'teacher', 'subject', 'month'), name='att_stmonth_unique_group'),
+        ),
+    ]
@@ -35,6 +35,25 @@ class AttendanceSession(models.Model):
     time_slot = models.CharField(max_length=64, default="")
     teacher = models.ForeignKey(Teacher, on_delete=models.SET_NULL, null=True, blank=True)
     subject = models.ForeignKey(Subject, on_delete=models.SET_NULL, null=True, blank=True)
+    # Denormalized counters, kept in step with the records by attendance.counters
+    present_count = models.PositiveIntegerField(default=0)
+    unique_devices_count = models.PositiveIntegerField(default=0)
+    # Set once the closed session is counted in the rollup tables
+    rolled_up = models.BooleanField(default=False)
+
+    class Meta:
+        indexes = [
+            # reports filters (teacher/subject + date range, newest first)
+            models.Index(fields=['teacher', 'subject', 'starts_at'], name='att_session_tch_subj_start'),
+            models.Index(fields=['subject', 'starts_at'], name='att_session_subj_start'),
+            # dashboard keyset paging on (starts_at, id) and unfiltered date ranges
+            models.Index(fields=['starts_at', 'id'], name='att_session_starts_id'),
+            # sessions reports still read live (not yet rolled up)
+            models.Index(fields=['rolled_up', 'starts_at'], name='att_session_rolled_start'),
+            # open sessions (is_active, kept current by attendance.sweeper)
+            # and the sweeper's expiry scan
+            models.Index(fields=['is_active', 'ends_at'], name='att_session_active_end'),
+        ]
 
     def __str__(self) -> str:
         return f"{self.title} ({self.code})"
@@ -44,26 +63,148 @@ class AttendanceSession(models.Model):
         now = timezone.now()
         return self.is_active and self.starts_at <= now <= self.ends_at
 
-    @property
-    def present_count(self) -> int:
-        return self.records.count()
-
-    @property
-    def unique_devices_count(self) -> int:
-        return self.records.values('device_fingerprint').distinct().count()
-
 
 class AttendanceRecord(models.Model):
     session = models.ForeignKey(AttendanceSession, on_delete=models.CASCADE, related_name='records')
     student = models.ForeignKey(Student, on_delete=models.CASCADE, related_name='attendance')
-    scanned_at = models.DateTimeField(auto_now_add=True)
-    device_fingerprint = models.CharField(max_length=128, blank=True, default="")
+    # Set by the app rather than auto_now_add so buffered scans keep their time
+    scanned_at = models.DateTimeField(default=timezone.now, editable=False)
+    # blake2b digest of "ip|user agent" as hex, see scanning.hash_fingerprint
+    device_fingerprint = models.CharField(max_length=32, blank=True, default="")
 
     class Meta:
         unique_together = (
             ('session', 'student'),
             ('session', 'device_fingerprint'),
         )
+        indexes = [
+            # live record lists, newest first
+            models.Index(fields=['session', 'scanned_at'], name='att_record_session_scanned'),
+        ]
 
     def __str__(self) -> str:
         return f"{self.student_id} @ {self.session_id}"
+
+
+class RecordTombstone(models.Model):
+    # Left behind when a record is deleted so that polling clients holding a
+    # records.json cursor can be told which rows to drop.
+    session = models.ForeignKey(AttendanceSession, on_delete=models.CASCADE, related_name='tombstones')
+    record_id = models.BigIntegerField()
+    deleted_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self) -> str:
+        return f"-{self.record_id} @ {self.session_id}"
+
+
+class DailyRollup(models.Model):
+    # Closed sessions summed per (local day, teacher, subject); see
+    # attendance.rollups. Reports read these instead of sessions and records.
+    date = models.DateField()
+    teacher = models.ForeignKey(Teacher, on_delete=models.SET_NULL, null=True, blank=True)
+    subject = models.ForeignKey(Subject, on_delete=models.SET_NULL, null=True, blank=True)
+    sessions = models.PositiveIntegerField(default=0)
+    present = models.PositiveIntegerField(default=0)
+    unique_devices = models.PositiveIntegerField(default=0)
+    # Newest session start in the group, for ordering chart labels
+    latest_start = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            # Rows with no teacher or subject aren't covered (NULLs are
+            # distinct); rollups.refresh locks the group's sessions as well
+            models.UniqueConstraint(fields=['date', 'teacher', 'subject'], name='att_daily_unique_group'),
+        ]
+        indexes = [
+            models.Index(fields=['date', 'teacher', 'subject'], name='att_daily_date_tch_subj'),
+            models.Index(fields=['teacher', 'date'], name='att_daily_tch_date'),
+            models.Index(fields=['subject', 'date'], name='att_daily_subj_date'),
+        ]
+
+    def __str__(self) -> str:
+        return f"{self.date} {self.teacher_id}/{self.subject_id}: {self.present}"
+
+
+class StudentMonthRollup(models.Model):
+    # Records in closed sessions per (student, teacher, subject, local
+    # month); attendance.analytics reads these for per-student percentages.
+    student = models.ForeignKey(Student, on_delete=models.CASCADE, related_name='month_rollups')
+    teacher = models.ForeignKey(Teacher, on_delete=models.SET_NULL, null=True, blank=True)
+    subject = models.ForeignKey(Subject, on_delete=models.SET_NULL, null=True, blank=True)
+    month = models.DateField()  # first day of the month
+    present = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['student', 'teacher', 'subject', 'month'], name='att_stmonth_unique_group'),
+        ]
+        indexes = [
+            models.Index(fields=['student', 'subject', 'month'], name='att_stmonth_student'),
+            models.Index(fields=['month', 'subject'], name='att_stmonth_month_subj'),
+            models.Index(fields=['teacher', 'month'], name='att_stmonth_tch_month'),
+        ]
+
+    def __str__(self) -> str:
+        return f"{self.student_id} {self.teacher_id}/{self.subject_id} {self.month:%Y-%m}: {self.present}"
+
+
+class DeviceStudentLink(models.Model):
+    # Which students each device fingerprint has marked, accumulated by
+    # attendance.devicesharing; a device linked to several students is a
+    # likely proxy. Deleting records doesn't retract links until a --full run.
+    fingerprint = models.CharField(max_length=32)
+    student = models.ForeignKey(Student, on_delete=models.CASCADE, related_name='device_links')
+    sessions = models.PositiveIntegerField(default=0)
+    # Local days, so a batch's updates group into a few statements
+    first_seen = models.DateField()
+    last_seen = models.DateField()
+
+    class Meta:
+        unique_together = (('fingerprint', 'student'),)
+        indexes = [
+            models.Index(fields=['student'], name='att_devlink_student'),
+        ]
+
+    def __str__(self) -> str:
+        return f"{self.fingerprint[:8]} -> {self.student_id} ({self.sessions})"
+
+
+class AnalysisCheckpoint(models.Model):
+    # Highest AttendanceRecord id a batch job has processed, plus the ids it
+    # skipped below that which may still commit, as [id, unix time seen]
+    name = models.CharField(max_length=64, unique=True)
+    last_record_id = models.BigIntegerField(default=0)
+    gaps = models.JSONField(default=list, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self) -> str:
+        return f"{self.name} @ {self.last_record_id}"
+
+
+class ArchivedSessionSummary(models.Model):
+    # What stays in the database for a session moved out by
+    # archive_attendance; its records are in the gzipped JSONL archive_file.
+    # Names are kept in case the teacher or subject is deleted later.
+    code = models.CharField(max_length=64, unique=True)
+    title = models.CharField(max_length=128)
+    teacher = models.ForeignKey(Teacher, on_delete=models.SET_NULL, null=True, blank=True)
+    subject = models.ForeignKey(Subject, on_delete=models.SET_NULL, null=True, blank=True)
+    teacher_name = models.CharField(max_length=128, null=True, blank=True)
+    subject_name = models.CharField(max_length=128, null=True, blank=True)
+    time_slot = models.CharField(max_length=64, default="")
+    starts_at = models.DateTimeField()
+    ends_at = models.DateTimeField()
+    present_count = models.PositiveIntegerField(default=0)
+    unique_devices_count = models.PositiveIntegerField(default=0)
+    archive_file = models.CharField(max_length=255)
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['teacher', 'subject', 'starts_at'], name='att_archived_tch_subj_start'),
+            models.Index(fields=['subject', 'starts_at'], name='att_archived_subj_start'),
+            models.Index(fields=['starts_at'], name='att_archived_start'),
+        ]
+
+    def __str__(self) -> str:
+        return f"{self.code} (archived)"
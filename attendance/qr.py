@@ -0,0 +1,185 @@
+import asyncio
+import hashlib
+import io
+import multiprocessing
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from django.conf import settings
+from django.core.cache import caches
+
+import qrcode
+import qrcode.image.svg
+
+from . import tokens
+
+# Module size in pixels for the named presets the views accept via ?size=
+SIZES = {
+    'phone': 6,
+    'projector': 10,
+    'print': 20,
+}
+DEFAULT_SIZE = 'projector'
+
+CONTENT_TYPES = {
+    'png': 'image/png',
+    'svg': 'image/svg+xml',
+}
+
+
+def scan_url(code: str, token: str = '', base_url: str = '') -> str:
+    base_url = (base_url or settings.PUBLIC_BASE_URL).rstrip('/')
+    url = f"{base_url}/scan/{code}"
+    return f"{url}?t={token}" if token else url
+
+
+def _build(data: str, box_size: int):
+    qr = qrcode.QRCode(
+        version=1,
+        error_correction=qrcode.constants.ERROR_CORRECT_L,
+        box_size=box_size,
+        border=4,
+    )
+    qr.add_data(data)
+    qr.make(fit=True)
+    return qr
+
+
+def render(data: str, box_size: int, fmt: str = 'png') -> bytes:
+    # Runs in the render pool's worker processes
+    qr = _build(data, box_size)
+    if fmt == 'svg':
+        # Pure-Python path, no Pillow rasterization involved
+        return qr.make_image(image_factory=qrcode.image.svg.SvgPathImage).to_string()
+    img = qr.make_image(fill_color="black", back_color="white")
+    buf = io.BytesIO()
+    img.save(buf, format='PNG', optimize=True)
+    return buf.getvalue()
+
+
+# Encoding is CPU-bound and would hold the GIL against every other request,
+# so it runs in a small process pool. Results go into the "qr" cache, which
+# is shared between workers when it is backed by Redis.
+_lock = threading.Lock()
+_pool_lock = threading.Lock()
+_pool = None
+_inflight = {}
+_scheduled = {}  # code -> last rotation bucket queued
+
+
+def _get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # spawn, not fork: forking a threaded server process is unsafe
+            _pool = ProcessPoolExecutor(
+                max_workers=settings.QR_RENDER_PROCESSES,
+                mp_context=multiprocessing.get_context('spawn'),
+            )
+        return _pool
+
+
+def _reset_pool():
+    global _pool
+    with _pool_lock:
+        _pool = None
+
+
+def cache_key(data: str, box_size: int, fmt: str = 'png') -> str:
+    return f"qr:{etag(data, box_size, fmt)}"
+
+
+def _timeout(bucket):
+    # An image is only served while its token is current
+    if bucket is None:
+        return None
+    return max(1, (bucket + 2) * settings.QR_ROTATION_SECONDS - int(time.time()))
+
+
+def _submit(data: str, box_size: int, fmt: str, bucket=None):
+    # One render per key at a time; concurrent misses share the future, so
+    # the lookup and the insert happen under one lock.
+    key = cache_key(data, box_size, fmt)
+    with _lock:
+        future = _inflight.get(key)
+        if future is not None:
+            return future
+        try:
+            future = _get_pool().submit(render, data, box_size, fmt)
+        except BrokenProcessPool:
+            # A worker died (e.g. OOM-killed); start a fresh pool once
+            _reset_pool()
+            future = _get_pool().submit(render, data, box_size, fmt)
+        _inflight[key] = future
+
+    def stored(done):
+        with _lock:
+            _inflight.pop(key, None)
+        if not done.cancelled() and done.exception() is None:
+            caches['qr'].set(key, done.result(), _timeout(bucket))
+
+    future.add_done_callback(stored)
+    return future
+
+
+async def aimage(data: str, box_size: int, fmt: str = 'png', bucket=None) -> bytes:
+    body = await caches['qr'].aget(cache_key(data, box_size, fmt))
+    if body is None:
+        body = await asyncio.wrap_future(_submit(data, box_size, fmt, bucket))
+    return body
+
+
+def _wanted(code: str) -> dict:
+    # cache key -> (data, box_size, bucket) of the PNGs still to queue for
+    # the current rotation window and the next QR_PRERENDER_WINDOWS - 1.
+    # Without rotation the payload never changes, so there is nothing to
+    # track per code and the cache alone says what is missing.
+    rotating = tokens.enabled()
+    buckets = [None]
+    if rotating:
+        now = tokens.current_bucket()
+        last = now + settings.QR_PRERENDER_WINDOWS - 1
+        with _lock:
+            first = max(now, _scheduled.get(code, now - 1) + 1)
+            if first > last:
+                return {}
+            for stale in [c for c, b in _scheduled.items() if b < now]:
+                del _scheduled[stale]
+            _scheduled[code] = last
+        buckets = range(first, last + 1)
+
+    wanted = {}
+    for bucket in buckets:
+        data = scan_url(code, tokens.make_token(code, bucket) if rotating else '')
+        for box_size in SIZES.values():
+            wanted[cache_key(data, box_size)] = (data, box_size, bucket)
+    return wanted
+
+
+def _queue(wanted: dict, present):
+    for key, (data, box_size, bucket) in wanted.items():
+        if key not in present:
+            _submit(data, box_size, 'png', bucket)
+
+
+def prerender(code: str):
+    # Queue PNGs in every size ahead of time. Called from start_session;
+    # aprerender runs as an open session's image is served so the window
+    # rolls forward.
+    wanted = _wanted(code)
+    if wanted:
+        _queue(wanted, caches['qr'].get_many(list(wanted)))
+
+
+async def aprerender(code: str):
+    wanted = _wanted(code)
+    if wanted:
+        _queue(wanted, await caches['qr'].aget_many(list(wanted)))
+
+
+def etag(data: str, box_size: int, fmt: str = 'png') -> str:
+    # Rendering is deterministic, so the tag can be derived from the inputs
+    # and a conditional request is answered without touching the encoder.
+    return hashlib.sha1(f"{fmt}|{box_size}|{data}".encode()).hexdigest()
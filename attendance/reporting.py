@@ -0,0 +1,210 @@
+from datetime import date, datetime, time, timedelta
+from itertools import islice
+
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
+from django.db.models import Count, F, Max, Q, Sum
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from django.utils.encoding import smart_str
+
+from .models import ArchivedSessionSummary, AttendanceRecord, AttendanceSession, DailyRollup
+
+
+def _filtered(qs, teacher_id, subject_id):
+    if teacher_id:
+        qs = qs.filter(teacher_id=teacher_id)
+    if subject_id:
+        qs = qs.filter(subject_id=subject_id)
+    return qs
+
+
+def filtered_sessions(teacher_id='', subject_id='', date_from='', date_to=''):
+    sessions_qs = _filtered(AttendanceSession.objects.all().order_by('-starts_at'), teacher_id, subject_id)
+    # Date bounds become datetime ranges on starts_at (local days) so the
+    # filter can use the starts_at indexes; __date would wrap the column.
+    if date_from:
+        sessions_qs = sessions_qs.filter(starts_at__gte=day_start(date_from))
+    if date_to:
+        sessions_qs = sessions_qs.filter(starts_at__lt=day_start(date_to, days=1))
+    return sessions_qs
+
+
+def day_start(value, days=0):
+    # Local midnight at the start of the given day (plus `days`)
+    if isinstance(value, str):
+        value = date.fromisoformat(value)
+    return timezone.make_aware(datetime.combine(value + timedelta(days=days), time.min))
+
+
+def with_related(sessions_qs):
+    return sessions_qs.select_related('teacher', 'subject')
+
+
+def _grouped(rows_qs, subject, teacher, sessions, present, devices, latest):
+    # One row per (subject, teacher); both chart series are folded from it
+    return list(
+        rows_qs.order_by()
+        .values(subject_label=subject, teacher_label=teacher)
+        .annotate(sessions=sessions, present=Sum(present), devices=Sum(devices), latest=Max(latest))
+    )
+
+
+def _rolled_rows(rollups_qs):
+    return _grouped(
+        rollups_qs, F('subject__name'), F('teacher__full_name'),
+        Sum('sessions'), 'present', 'unique_devices', 'latest_start',
+    )
+
+
+def _live_rows(sessions_qs):
+    return _grouped(
+        sessions_qs, F('subject__name'), F('teacher__full_name'),
+        Count('id'), 'present_count', 'unique_devices_count', 'starts_at',
+    )
+
+
+def _archived_rows(archived_qs):
+    # Current names where the teacher/subject still exists, else the ones
+    # saved at archive time
+    return _grouped(
+        archived_qs, Coalesce('subject__name', 'subject_name'), Coalesce('teacher__full_name', 'teacher_name'),
+        Count('id'), 'present_count', 'unique_devices_count', 'starts_at',
+    )
+
+
+def _series(rows, label_field):
+    # Labels keep the order in which they first show up in the report
+    # (newest session first), matching the old per-session loop. The same
+    # label can come from several rows and sources.
+    merged = {}
+    for row in rows:
+        label = row[label_field] or 'Unassigned'
+        present, latest = merged.get(label, (0, row['latest']))
+        merged[label] = (present + row['present'], max(latest, row['latest']))
+    ordered = sorted(merged.items(), key=lambda item: item[1][1], reverse=True)
+    return {
+        'labels': [label for label, _ in ordered],
+        'counts': [present for _, (present, _) in ordered],
+    }
+
+
+def filtered_rollups(teacher_id='', subject_id='', date_from='', date_to=''):
+    rollups_qs = _filtered(DailyRollup.objects.all(), teacher_id, subject_id)
+    if date_from:
+        rollups_qs = rollups_qs.filter(date__gte=date_from)
+    if date_to:
+        rollups_qs = rollups_qs.filter(date__lte=date_to)
+    return rollups_qs
+
+
+def filtered_archive(teacher_id='', subject_id='', date_from='', date_to=''):
+    archived_qs = _filtered(ArchivedSessionSummary.objects.all(), teacher_id, subject_id)
+    if date_from:
+        archived_qs = archived_qs.filter(starts_at__gte=day_start(date_from))
+    if date_to:
+        archived_qs = archived_qs.filter(starts_at__lt=day_start(date_to, days=1))
+    return archived_qs
+
+
+def summarize(teacher_id='', subject_id='', date_from='', date_to='', include_archive=False):
+    # Closed sessions come from the daily rollups (attendance.rollups); the
+    # few not rolled up yet (open, or just ended) from their stored counters;
+    # archived ones (attendance.archive) from their summaries, when asked.
+    # One grouped query per source however many sessions the range covers.
+    rows = _rolled_rows(filtered_rollups(teacher_id, subject_id, date_from, date_to))
+    rows += _live_rows(filtered_sessions(teacher_id, subject_id, date_from, date_to).filter(rolled_up=False))
+    if include_archive:
+        rows += _archived_rows(filtered_archive(teacher_id, subject_id, date_from, date_to))
+    metrics = {
+        'total_present': sum(row['present'] for row in rows),
+        'total_sessions': sum(row['sessions'] for row in rows),
+        'unique_devices': sum(row['devices'] for row in rows),
+    }
+    chart = {
+        'subjects': _series(rows, 'subject_label'),
+        'teachers': _series(rows, 'teacher_label'),
+    }
+    return metrics, chart
+
+
+EXPORT_CHUNK_SIZE = 2000
+
+SESSION_CSV_HEADER = ['Session Code','Title','Teacher','Subject','Slot','Start','End','Present Count']
+RECORD_CSV_HEADER = [
+    'Session Code','Title','Teacher','Subject','Slot','Start','Student ID','Student Name','Scanned At',
+]
+
+
+class Echo:
+    # File-like object for csv.writer that hands each row back instead of
+    # buffering it, so rows can be fed straight into a StreamingHttpResponse.
+    def write(self, value):
+        return value
+
+
+STREAM_BATCH = 500  # lines pulled per hop to the sync thread under ASGI
+
+
+def streaming_content(request, lines):
+    # Under ASGI, Django drains a sync iterator with sync_to_async(list),
+    # buffering the whole body; there the lines are handed over as an async
+    # iterator instead, pulled in batches on the request's sync thread (the
+    # one the generator's DB connection belongs to).
+    if not isinstance(request, ASGIRequest):
+        return lines
+    return _abatches(iter(lines), STREAM_BATCH)
+
+
+async def _abatches(lines, size):
+    pull = sync_to_async(lambda: list(islice(lines, size)))
+    while batch := await pull():
+        yield ''.join(batch)
+
+
+def _session_chunks(sessions_qs, chunk_size):
+    # Keyset pagination on (starts_at, id) descending. MySQL drivers buffer
+    # the whole result set even for .iterator(), so bounded chunks are what
+    # keeps memory flat there; elsewhere the iterator also streams each chunk.
+    qs = sessions_qs.order_by('-starts_at', '-id')
+    last = None
+    while True:
+        page = qs
+        if last is not None:
+            page = qs.filter(Q(starts_at__lt=last[0]) | Q(starts_at=last[0], id__lt=last[1]))
+        rows = list(page[:chunk_size].iterator(chunk_size=chunk_size))
+        yield from rows
+        if len(rows) < chunk_size:
+            return
+        last = (rows[-1].starts_at, rows[-1].id)
+
+
+def session_rows(sessions_qs, chunk_size=EXPORT_CHUNK_SIZE):
+    yield SESSION_CSV_HEADER
+    for s in _session_chunks(with_related(sessions_qs), chunk_size):
+        yield [
+            smart_str(s.code), smart_str(s.title), smart_str(s.teacher or ''), smart_str(s.subject or ''),
+            smart_str(s.time_slot or ''), s.starts_at, s.ends_at, s.present_count,
+        ]
+
+
+def record_rows(sessions_qs, chunk_size=EXPORT_CHUNK_SIZE):
+    yield RECORD_CSV_HEADER
+    records = (
+        AttendanceRecord.objects.filter(session__in=sessions_qs.order_by().values('id'))
+        .order_by('id')
+        .values_list(
+            'id', 'session__code', 'session__title', 'session__teacher__full_name', 'session__subject__name',
+            'session__time_slot', 'session__starts_at', 'student__student_id', 'student__full_name', 'scanned_at',
+        )
+    )
+    last_id = 0
+    while True:
+        rows = list(records.filter(id__gt=last_id)[:chunk_size].iterator(chunk_size=chunk_size))
+        for row in rows:
+            yield [smart_str(v if v is not None else '') for v in row[1:6]] + [
+                row[6], smart_str(row[7]), smart_str(row[8]), row[9],
+            ]
+        if len(rows) < chunk_size:
+            return
+        last_id = rows[-1][0]
@@ -0,0 +1,209 @@
+from dataclasses import dataclass, field
+from datetime import date, timedelta
+
+from django.db import transaction
+from django.db.models import Count, DateField, Max, Q, Sum
+from django.db.models.functions import TruncDate, TruncMonth
+from django.utils import timezone
+
+from .models import ArchivedSessionSummary, AttendanceRecord, AttendanceSession, DailyRollup, StudentMonthRollup
+from .reporting import day_start
+
+# Materialized report totals. When a session closes it is marked rolled_up
+# and the rollup rows of its groups are recomputed from the rolled-up
+# sessions in that group: the day's (teacher, subject) row from the stored
+# session counters, and the (teacher, subject) month rows of the students
+# who scanned. Sessions not yet rolled up are read live by the reports, so
+# the totals stay right between a session ending and it being rolled up.
+
+
+@dataclass
+class Group:
+    day: date
+    teacher_id: int | None
+    subject_id: int | None
+    student_ids: set = field(default_factory=set)
+
+
+def closed_q(now=None) -> Q:
+    now = now or timezone.now()
+    return Q(is_active=False) | Q(ends_at__lt=now)
+
+
+def month_start(day: date) -> date:
+    return day.replace(day=1)
+
+
+def next_month(day: date) -> date:
+    return (day.replace(day=1) + timedelta(days=32)).replace(day=1)
+
+
+def groups_of(session_ids, rolled_up_only=True) -> list:
+    # The rollup groups the given sessions count towards, merged per
+    # (day, teacher, subject)
+    sessions = AttendanceSession.objects.filter(id__in=list(session_ids))
+    if rolled_up_only:
+        sessions = sessions.filter(rolled_up=True)
+    groups = {}
+    ids = []
+    for session_id, starts_at, teacher_id, subject_id in sessions.values_list(
+        'id', 'starts_at', 'teacher_id', 'subject_id'
+    ):
+        key = (timezone.localdate(starts_at), teacher_id, subject_id)
+        groups.setdefault(key, Group(*key))
+        ids.append((session_id, key))
+    by_session = dict(ids)
+    for session_id, student_id in AttendanceRecord.objects.filter(
+        session_id__in=list(by_session)
+    ).values_list('session_id', 'student_id'):
+        groups[by_session[session_id]].student_ids.add(student_id)
+    return list(groups.values())
+
+
+def _lock(group: Group):
+    # Two workers refreshing the same group would both delete its rows and
+    # both insert new ones. Locking every session of the (teacher, subject)
+    # month, rolled up or not, serializes refreshes of the day row and of
+    # the month rows alike; in id order so they can't deadlock.
+    month = month_start(group.day)
+    list(
+        AttendanceSession.objects.select_for_update()
+        .filter(
+            teacher_id=group.teacher_id,
+            subject_id=group.subject_id,
+            starts_at__gte=day_start(month),
+            starts_at__lt=day_start(next_month(month)),
+        )
+        .order_by('id')
+        .values_list('id', flat=True)
+    )
+
+
+def refresh(group: Group, students=True):
+    with transaction.atomic():
+        _lock(group)
+        sessions = AttendanceSession.objects.filter(
+            rolled_up=True,
+            teacher_id=group.teacher_id,
+            subject_id=group.subject_id,
+            starts_at__gte=day_start(group.day),
+            starts_at__lt=day_start(group.day, days=1),
+        )
+        totals = sessions.aggregate(
+            sessions=Count('id'),
+            present=Sum('present_count', default=0),
+            unique_devices=Sum('unique_devices_count', default=0),
+            latest_start=Max('starts_at'),
+        )
+        key = {'date': group.day, 'teacher_id': group.teacher_id, 'subject_id': group.subject_id}
+        DailyRollup.objects.filter(**key).delete()
+        if totals['sessions']:
+            DailyRollup.objects.create(**key, **totals)
+
+        if not students or not group.student_ids:
+            return
+        month = month_start(group.day)
+        counts = (
+            AttendanceRecord.objects.filter(
+                student_id__in=list(group.student_ids),
+                session__rolled_up=True,
+                session__teacher_id=group.teacher_id,
+                session__subject_id=group.subject_id,
+                session__starts_at__gte=day_start(month),
+                session__starts_at__lt=day_start(next_month(month)),
+            )
+            .values('student_id')
+            .annotate(present=Count('id'))
+            .order_by()
+        )
+        StudentMonthRollup.objects.filter(
+            student_id__in=list(group.student_ids),
+            teacher_id=group.teacher_id,
+            subject_id=group.subject_id,
+            month=month,
+        ).delete()
+        StudentMonthRollup.objects.bulk_create([
+            StudentMonthRollup(
+                student_id=row['student_id'], teacher_id=group.teacher_id, subject_id=group.subject_id,
+                month=month, present=row['present'],
+            )
+            for row in counts
+        ])
+
+
+def roll_up(session_ids) -> int:
+    # Called once sessions have closed (stopped, or past ends_at)
+    session_ids = list(session_ids)
+    with transaction.atomic():
+        marked = list(
+            AttendanceSession.objects.filter(id__in=session_ids, rolled_up=False)
+            .filter(closed_q())
+            .values_list('id', flat=True)
+        )
+        AttendanceSession.objects.filter(id__in=marked).update(rolled_up=True)
+        for group in groups_of(marked):
+            refresh(group)
+    return len(marked)
+
+
+def rebuild(date_from: date | None = None, date_to: date | None = None) -> dict:
+    # Backfill or repair. Works in whole months so the student month rows
+    # are complete; marks every closed session in range as rolled up.
+    sessions = AttendanceSession.objects.all()
+    daily = DailyRollup.objects.all()
+    monthly = StudentMonthRollup.objects.all()
+    # Archived months have no sessions left to rebuild from
+    archived = ArchivedSessionSummary.objects.aggregate(latest=Max('starts_at'))['latest']
+    if archived is not None:
+        date_from = max(date_from or date.min, next_month(timezone.localdate(archived)))
+    if date_from:
+        date_from = month_start(date_from)
+        sessions = sessions.filter(starts_at__gte=day_start(date_from))
+        daily = daily.filter(date__gte=date_from)
+        monthly = monthly.filter(month__gte=date_from)
+    if date_to:
+        date_to = next_month(date_to)
+        sessions = sessions.filter(starts_at__lt=day_start(date_to))
+        daily = daily.filter(date__lt=date_to)
+        monthly = monthly.filter(month__lt=date_to)
+
+    with transaction.atomic():
+        sessions.filter(closed_q()).update(rolled_up=True)
+        sessions = sessions.filter(rolled_up=True)
+        daily.delete()
+        rows = (
+            sessions.annotate(day=TruncDate('starts_at'))
+            .values('day', 'teacher_id', 'subject_id')
+            .annotate(
+                sessions=Count('id'),
+                present=Sum('present_count'),
+                unique_devices=Sum('unique_devices_count'),
+                latest_start=Max('starts_at'),
+            )
+            .order_by()
+        )
+        daily_rows = DailyRollup.objects.bulk_create(
+            [DailyRollup(date=row.pop('day'), **row) for row in rows], batch_size=1000,
+        )
+        monthly.delete()
+        rows = (
+            AttendanceRecord.objects.filter(session__in=sessions)
+            .annotate(month=TruncMonth('session__starts_at', output_field=DateField()))
+            .values('student_id', 'session__teacher_id', 'session__subject_id', 'month')
+            .annotate(present=Count('id'))
+            .order_by()
+        )
+        monthly_rows = StudentMonthRollup.objects.bulk_create(
+            [
+                StudentMonthRollup(
+                    student_id=row['student_id'],
+                    teacher_id=row['session__teacher_id'],
+                    subject_id=row['session__subject_id'],
+                    month=row['month'],
+                    present=row['present'],
+                )
+                for row in rows
+            ],
+            batch_size=1000,
+        )
+    return {'daily': len(daily_rows), 'monthly': len(monthly_rows)}
@@ -0,0 +1,117 @@
+import gzip
+import hashlib
+import json
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .models import Student
+
+try:
+    import brotli
+except ImportError:  # optional, gzip is always available
+    brotli = None
+
+# The scan page's student list, served as one versioned JSON document. With
+# a shared cache the version lives there and changes only when a student is
+# added, toggled or removed. A per-process cache would only ever see its own
+# worker's changes, so then the version is a digest of the document itself,
+# which is read from the database at most every ROSTER_VERSION_SECONDS; any
+# change to what the page shows (including a rename to a name of the same
+# length) changes it. Each worker compresses the payload once per version.
+
+VERSION_KEY = 'roster:version'
+
+_lock = threading.Lock()
+_built = {}
+
+
+def _students():
+    return (
+        Student.objects.filter(is_active=True)
+        .order_by('full_name', 'student_id')
+        .values_list('student_id', 'full_name')
+    )
+
+
+def _body(rows) -> bytes:
+    return json.dumps([list(s) for s in rows], separators=(',', ':')).encode()
+
+
+def _keep(body: bytes) -> str:
+    # Digest of the document, remembering the document for payload()
+    current = hashlib.blake2b(body, digest_size=8).hexdigest()
+    with _lock:
+        if current not in _built:
+            # Only the latest version is worth keeping around
+            _built.clear()
+            _built[current] = {'identity': body}
+    return current
+
+
+def version() -> str:
+    current = cache.get(VERSION_KEY)
+    if current is not None:
+        return current
+    if not settings.CACHE_SHARED:
+        current = _keep(_body(_students()))
+        cache.set(VERSION_KEY, current, settings.ROSTER_VERSION_SECONDS)
+        return current
+    cache.add(VERSION_KEY, _new_version(), timeout=None)
+    return cache.get(VERSION_KEY)
+
+
+async def aversion() -> str:
+    current = await cache.aget(VERSION_KEY)
+    if current is not None:
+        return current
+    if not settings.CACHE_SHARED:
+        current = _keep(_body([row async for row in _students()]))
+        await cache.aset(VERSION_KEY, current, settings.ROSTER_VERSION_SECONDS)
+        return current
+    await cache.aadd(VERSION_KEY, _new_version(), timeout=None)
+    return await cache.aget(VERSION_KEY)
+
+
+def _new_version() -> str:
+    return format(time.time_ns(), 'x')
+
+
+def invalidate():
+    if settings.CACHE_SHARED:
+        cache.set(VERSION_KEY, _new_version(), timeout=None)
+    else:
+        # This worker rereads the roster now; the others within the TTL
+        cache.delete(VERSION_KEY)
+
+
+def _compress(body: bytes) -> dict:
+    encodings = {'identity': body, 'gzip': gzip.compress(body, compresslevel=9)}
+    if brotli is not None:
+        encodings['br'] = brotli.compress(body)
+    return encodings
+
+
+def payload(current: str) -> dict:
+    # The document for a version, compressed. Under a shared cache the
+    # version isn't derived from the rows, so the document is read the
+    # first time this worker serves that version.
+    with _lock:
+        encodings = _built.get(current)
+    if encodings is None or 'gzip' not in encodings:
+        body = encodings['identity'] if encodings else _body(_students())
+        encodings = _compress(body)
+        with _lock:
+            _built.clear()
+            _built[current] = encodings
+    return encodings
+
+
+def pick_encoding(accept_encoding: str, encodings: dict) -> str:
+    accepted = {part.split(';')[0].strip() for part in accept_encoding.split(',')}
+    for name in ('br', 'gzip'):
+        if name in encodings and name in accepted:
+            return name
+    return 'identity'
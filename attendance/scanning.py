@@ -0,0 +1,211 @@
+import hashlib
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from . import counters, live, metrics, roster, sessionmeta, writebuffer
+from .models import AttendanceRecord, RecordTombstone, Student
+
+# Hot path for marking attendance. Session state comes from sessionmeta and
+# the set of students and devices already seen per session is kept in memory,
+# so a scan costs a student lookup and an INSERT. The unique constraints on
+# AttendanceRecord stay the source of truth; the in-memory sets only answer
+# the common "already scanned" case early. A worker keeps the sets of its
+# SESSION_CACHE_SIZE most recently scanned sessions. A deleted record has to
+# leave every worker's set: with a shared cache the deleting worker bumps a
+# per-session epoch there; without one, a worker about to reject a scan
+# first checks the session's latest tombstone, so only the duplicate path
+# pays for it. The entry points are async so the scan views don't hold a
+# thread while waiting on the DB; only the INSERT transaction (and the rare
+# on-the-fly enrolment) runs in a sync thread.
+
+MSG_INVALID = 'Invalid session code'
+MSG_CLOSED = 'Session is closed'
+MSG_MISSING_ID = 'Please select your name or enter ID'
+MSG_DUPLICATE = 'Already scanned or same device detected'
+
+
+@dataclass
+class SeenSet:
+    epoch: int | None  # shared epoch, or latest tombstone id; None if unknown
+    students: set = field(default_factory=set)
+    devices: set = field(default_factory=set)
+
+    def has(self, student_id: str, fingerprint: str) -> bool:
+        return student_id in self.students or fingerprint in self.devices
+
+
+@dataclass
+class ScanResult:
+    ok: bool
+    message: str
+    status: int = 200
+
+
+_lock = threading.Lock()
+_seen = OrderedDict()  # session_id -> SeenSet, least recently used first
+
+
+def hash_fingerprint(raw: str) -> str:
+    # Fixed 32 hex chars, so the (session, device_fingerprint) unique index
+    # stays small and long user agents no longer collide after truncation
+    return hashlib.blake2b(raw.encode('utf-8', 'surrogatepass'), digest_size=16).hexdigest()
+
+
+def device_fingerprint(request) -> str:
+    ip = request.META.get('HTTP_X_FORWARDED_FOR') or request.META.get('REMOTE_ADDR') or ''
+    ua = request.META.get('HTTP_USER_AGENT', '')
+    return hash_fingerprint(ip + '|' + ua)
+
+
+def forget_session(code: str, session_id: int):
+    sessionmeta.invalidate(code)
+    with _lock:
+        _seen.pop(session_id, None)
+
+
+def _epoch_key(session_id: int) -> str:
+    return f"scan:epoch:{session_id}"
+
+
+async def _aseen_for(session_id: int) -> SeenSet:
+    # With a shared cache, other workers bump the epoch when a record is
+    # deleted and a stale local set is rebuilt; without one, see _arecheck.
+    shared = settings.CACHE_SHARED
+    epoch = await cache.aget(_epoch_key(session_id), 0) if shared else None
+    with _lock:
+        seen = _seen.get(session_id)
+        if seen is not None and (not shared or seen.epoch == epoch):
+            _seen.move_to_end(session_id)
+            return seen
+    return await _aload(session_id, epoch)
+
+
+async def _aload(session_id: int, epoch) -> SeenSet:
+    # One query, plus the scans this worker's write buffer still holds
+    seen = SeenSet(epoch=epoch)
+    async for student_id, device in AttendanceRecord.objects.filter(session_id=session_id).values_list(
+        'student__student_id', 'device_fingerprint'
+    ):
+        seen.students.add(student_id)
+        seen.devices.add(device)
+    for student_id, device in writebuffer.claims(session_id):
+        seen.students.add(student_id)
+        seen.devices.add(device)
+    with _lock:
+        _seen[session_id] = seen
+        _seen.move_to_end(session_id)
+        while len(_seen) > settings.SESSION_CACHE_SIZE:
+            _seen.popitem(last=False)
+    return seen
+
+
+async def _arecheck(session_id: int, seen: SeenSet) -> SeenSet:
+    # Without a shared cache a deletion in another worker only shows as a
+    # tombstone. Read before reloading, so a deletion in between is caught
+    # by the next check.
+    latest = await RecordTombstone.objects.filter(session_id=session_id).order_by('-id').values_list(
+        'id', flat=True
+    ).afirst() or 0
+    if latest == seen.epoch:
+        return seen
+    return await _aload(session_id, latest)
+
+
+def record_removed(session_id: int):
+    # Called after a record is deleted so the student can scan again
+    if settings.CACHE_SHARED:
+        key = _epoch_key(session_id)
+        if not cache.add(key, 1, timeout=None):
+            try:
+                cache.incr(key)
+            except ValueError:
+                cache.set(key, 1, timeout=None)
+    with _lock:
+        _seen.pop(session_id, None)
+
+
+async def _alookup_student(student_id: str):
+    row = await Student.objects.filter(student_id=student_id).values_list('id', 'full_name').afirst()
+    if row is not None:
+        return Student(id=row[0], student_id=student_id, full_name=row[1])
+    return await sync_to_async(_enroll)(student_id)
+
+
+def _enroll(student_id: str):
+    # Unknown IDs are enrolled on the fly, as the scan page always allowed
+    try:
+        with transaction.atomic():
+            student = Student.objects.create(student_id=student_id, full_name=student_id)
+        metrics.set_branch('enrol')
+        roster.invalidate()
+        return student
+    except IntegrityError:
+        return Student.objects.get(student_id=student_id)
+
+
+async def amark(state, student_id: str, fingerprint: str) -> ScanResult:
+    if state is None:
+        return ScanResult(False, MSG_INVALID, 404)
+    if not student_id:
+        return ScanResult(False, MSG_MISSING_ID, 400)
+    if not state.is_open:
+        return ScanResult(False, MSG_CLOSED, 403)
+
+    seen = await _aseen_for(state.id)
+    with _lock:
+        claimed = seen.has(student_id, fingerprint)
+    if claimed and not settings.CACHE_SHARED:
+        seen = await _arecheck(state.id, seen)
+        with _lock:
+            claimed = seen.has(student_id, fingerprint)
+    if claimed:
+        return ScanResult(False, MSG_DUPLICATE, 409)
+
+    student = await _alookup_student(student_id)
+    if settings.SCAN_WRITE_BEHIND:
+        return await sync_to_async(_mark_buffered)(state, seen, student, fingerprint)
+    if not await sync_to_async(_insert)(state, student, fingerprint):
+        # Lost a race with another worker or the set was stale; rebuild it
+        with _lock:
+            _seen.pop(state.id, None)
+        return ScanResult(False, MSG_DUPLICATE, 409)
+
+    with _lock:
+        seen.students.add(student_id)
+        seen.devices.add(fingerprint)
+    return ScanResult(True, f'✅ Attendance marked successfully for {student.full_name}')
+
+
+def _insert(state, student, fingerprint) -> bool:
+    try:
+        with transaction.atomic():
+            record = AttendanceRecord.objects.create(
+                session_id=state.id,
+                student=student,
+                device_fingerprint=fingerprint,
+            )
+            counters.adjust(state.id, 1)
+    except IntegrityError:
+        return False
+    transaction.on_commit(lambda: live.publish(state.code, live.created_event(record, student)))
+    return True
+
+
+def _mark_buffered(state, seen, student, fingerprint) -> ScanResult:
+    # Claim the student and device in the per-session set first; that check
+    # mirrors the unique_together constraints, and whatever slips through
+    # across workers is dropped by bulk_create(ignore_conflicts=True).
+    with _lock:
+        if seen.has(student.student_id, fingerprint):
+            return ScanResult(False, MSG_DUPLICATE, 409)
+        seen.students.add(student.student_id)
+        seen.devices.add(fingerprint)
+    writebuffer.get_buffer().submit(state.code, state.id, student, fingerprint, timezone.now())
+    return ScanResult(True, f'✅ Attendance marked successfully for {student.full_name}')
@@ -0,0 +1,84 @@
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.db.models import Count, F, Q
+from django.utils import timezone
+from django.utils.formats import date_format
+
+from .models import AttendanceSession
+
+# Dashboard session list, newest first, paged by keyset on (starts_at, id)
+# so older pages cost the same as the first one. The cursor is the last
+# row's starts_at in epoch microseconds and its id: "<micros>.<id>".
+
+PAGE_SIZE = 20
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+
+
+def open_q() -> Q:
+    # Sessions start when created and attendance.sweeper switches them off
+    # once ends_at passes, so is_active alone is "open" here (indexed)
+    return Q(is_active=True)
+
+
+def encode_cursor(session) -> str:
+    return f"{(session.starts_at - _EPOCH) // timedelta(microseconds=1)}.{session.id}"
+
+
+def decode_cursor(value: str):
+    # None for anything malformed, including times datetime can't hold
+    try:
+        micros, session_id = (int(part) for part in value.split('.'))
+        return _EPOCH + timedelta(microseconds=micros), session_id
+    except (ValueError, OverflowError):
+        return None
+
+
+def totals() -> dict:
+    return AttendanceSession.objects.aggregate(
+        total=Count('id'),
+        open=Count('id', filter=open_q()),
+    )
+
+
+def listing(cursor: str = ''):
+    sessions_qs = (
+        AttendanceSession.objects.select_related('teacher', 'subject')
+        .annotate(open=F('is_active'))
+        .order_by('-starts_at', '-id')
+    )
+    after = decode_cursor(cursor) if cursor else None
+    if after is not None:
+        starts_at, session_id = after
+        # The redundant starts_at bound lets the index seek to the cursor
+        sessions_qs = sessions_qs.filter(
+            Q(starts_at__lt=starts_at) | Q(starts_at=starts_at, id__lt=session_id),
+            starts_at__lte=starts_at,
+        )
+    return sessions_qs
+
+
+def page(cursor: str = '', size: int = PAGE_SIZE):
+    # Returns (sessions, next_cursor); next_cursor is None on the last page
+    sessions = list(listing(cursor)[:size + 1])
+    if len(sessions) > size:
+        sessions = sessions[:size]
+        return sessions, encode_cursor(sessions[-1])
+    return sessions, None
+
+
+def row(session) -> dict:
+    # JSON shape of a dashboard row; dates formatted as the template does
+    return {
+        'code': session.code,
+        'title': session.title,
+        'teacher': str(session.teacher) if session.teacher else '',
+        'subject': str(session.subject) if session.subject else '',
+        'time_slot': session.time_slot,
+        'open': session.open,
+        'starts_at': session.starts_at.isoformat(),
+        'ends_at': session.ends_at.isoformat(),
+        'starts_display': date_format(timezone.localtime(session.starts_at), 'DATETIME_FORMAT'),
+        'ends_display': date_format(timezone.localtime(session.ends_at), 'DATETIME_FORMAT'),
+        'present_count': session.present_count,
+    }
@@ -0,0 +1,140 @@
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+
+from .models import AttendanceSession
+
+# Session metadata by code, for the views that only need to know which
+# session a code names and whether it is open. Two tiers: a small in-process
+# LRU whose entries live SCAN_SESSION_CACHE_SECONDS, over the Django cache
+# when that is shared between workers (CACHE_SHARED). Stopping or deleting a
+# session invalidates both; other workers' LRU entries age out within the
+# TTL. A per-process default cache is skipped, since an invalidation there
+# would never reach the other workers. Counters and records are not part of
+# it; they change on every scan.
+
+
+@dataclass(frozen=True)
+class SessionMeta:
+    id: int
+    code: str
+    title: str
+    starts_at: datetime
+    ends_at: datetime
+    is_active: bool
+    time_slot: str
+    teacher_id: int | None
+    teacher: str
+    subject_id: int | None
+    subject: str
+
+    @property
+    def is_open(self) -> bool:
+        now = timezone.now()
+        return self.is_active and self.starts_at <= now <= self.ends_at
+
+
+FIELDS = (
+    'id', 'code', 'title', 'starts_at', 'ends_at', 'is_active', 'time_slot',
+    'teacher_id', 'teacher__full_name', 'subject_id', 'subject__name',
+)
+
+_lock = threading.Lock()
+_local = OrderedDict()  # code -> (fetched_at, SessionMeta)
+
+
+def _key(code: str) -> str:
+    return f"session:meta:{code}"
+
+
+def _from_row(row) -> SessionMeta:
+    values = dict(zip(FIELDS, row))
+    return SessionMeta(
+        id=values['id'],
+        code=values['code'],
+        title=values['title'],
+        starts_at=values['starts_at'],
+        ends_at=values['ends_at'],
+        is_active=values['is_active'],
+        time_slot=values['time_slot'],
+        teacher_id=values['teacher_id'],
+        teacher=values['teacher__full_name'] or '',
+        subject_id=values['subject_id'],
+        subject=values['subject__name'] or '',
+    )
+
+
+def _query(code: str):
+    return AttendanceSession.objects.filter(code=code).values_list(*FIELDS)
+
+
+def _local_get(code: str):
+    with _lock:
+        entry = _local.get(code)
+        if entry is None:
+            return None
+        if time.monotonic() - entry[0] >= settings.SCAN_SESSION_CACHE_SECONDS:
+            del _local[code]
+            return None
+        _local.move_to_end(code)
+        return entry[1]
+
+
+def _local_put(meta: SessionMeta):
+    with _lock:
+        _local[meta.code] = (time.monotonic(), meta)
+        _local.move_to_end(meta.code)
+        while len(_local) > settings.SESSION_CACHE_SIZE:
+            _local.popitem(last=False)
+
+
+def get(code: str):
+    meta = _local_get(code)
+    if meta is None:
+        shared = settings.CACHE_SHARED
+        meta = cache.get(_key(code)) if shared else None
+        if meta is None:
+            row = _query(code).first()
+            if row is None:
+                return None
+            meta = _from_row(row)
+            if shared:
+                cache.set(_key(code), meta, settings.SESSION_CACHE_SECONDS)
+        _local_put(meta)
+    return meta
+
+
+async def aget(code: str):
+    meta = _local_get(code)
+    if meta is None:
+        shared = settings.CACHE_SHARED
+        meta = await cache.aget(_key(code)) if shared else None
+        if meta is None:
+            row = await _query(code).afirst()
+            if row is None:
+                return None
+            meta = _from_row(row)
+            if shared:
+                await cache.aset(_key(code), meta, settings.SESSION_CACHE_SECONDS)
+        _local_put(meta)
+    return meta
+
+
+def invalidate(code: str):
+    with _lock:
+        _local.pop(code, None)
+    if settings.CACHE_SHARED:
+        cache.delete(_key(code))
+
+
+async def ainvalidate(code: str):
+    with _lock:
+        _local.pop(code, None)
+    if settings.CACHE_SHARED:
+        await cache.adelete(_key(code))
@@ -0,0 +1,197 @@
+import csv
+import json
+from dataclasses import dataclass, field
+from itertools import islice
+
+from django.db import transaction
+
+from . import counters, live, roster, rollups, scanning, writebuffer
+from .models import AttendanceRecord, AttendanceSession, RecordTombstone, Student
+from .reporting import Echo
+
+# Bulk roster import/export, shared by the import_students/export_students
+# commands and the settings endpoints. Rows are streamed in from CSV or JSONL
+# and handled a chunk at a time: one query finds which student_ids exist,
+# then a bulk_create and a bulk_update run in one transaction per chunk.
+
+CHUNK_SIZE = 1000
+FORMATS = ('csv', 'jsonl')
+COLUMNS = ['student_id', 'full_name', 'is_active']
+# Row errors listed in an ImportResult; the rest are only counted
+ERRORS_SHOWN = 20
+
+_TRUE = {'1', 'true', 't', 'yes', 'y'}
+_FALSE = {'0', 'false', 'f', 'no', 'n'}
+
+
+@dataclass
+class ImportResult:
+    rows: int = 0
+    created: int = 0
+    updated: int = 0
+    unchanged: int = 0
+    skipped: int = 0
+    errors: list = field(default_factory=list)  # "row N: reason", first ERRORS_SHOWN
+
+    def reject(self, reason: str):
+        self.skipped += 1
+        if len(self.errors) < ERRORS_SHOWN:
+            self.errors.append(f"row {self.rows}: {reason}")
+
+
+def guess_format(name: str, default: str = 'csv') -> str:
+    return 'jsonl' if name.lower().endswith(('.jsonl', '.ndjson')) else default
+
+
+_UNREADABLE = object()
+
+
+def read_rows(lines, fmt: str = 'csv'):
+    # Yields dicts from an iterable of text lines. A JSONL line that isn't
+    # valid JSON comes through as a marker, and one that isn't an object as
+    # whatever it parsed to; import_students reports both as row errors.
+    if fmt == 'jsonl':
+        for line in lines:
+            if line.strip():
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    yield _UNREADABLE
+    else:
+        yield from csv.DictReader(lines)
+
+
+def _flag(value):
+    # None keeps the current value (or the default for new students)
+    if isinstance(value, bool) or value is None:
+        return value
+    value = str(value).strip().lower()
+    if value in _TRUE:
+        return True
+    if value in _FALSE:
+        return False
+    return None
+
+
+def _chunks(iterable, size):
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+def _parse(row):
+    # (student_id, full_name, is_active) from one row, or ValueError with
+    # the reason it can't be imported. Lengths are checked here so one long
+    # value can't fail its whole chunk under MySQL strict mode.
+    if row is _UNREADABLE:
+        raise ValueError("not valid JSON")
+    if not isinstance(row, dict):
+        raise ValueError("not a JSON object")
+    student_id = str(row.get('student_id') or '').strip()
+    full_name = str(row.get('full_name') or '').strip()
+    if not student_id:
+        raise ValueError("student_id is missing")
+    for name, value in (('student_id', student_id), ('full_name', full_name)):
+        max_length = Student._meta.get_field(name).max_length
+        if len(value) > max_length:
+            raise ValueError(f"{name} is longer than {max_length} characters")
+    return student_id, full_name, _flag(row.get('is_active'))
+
+
+def import_students(rows, chunk_size=CHUNK_SIZE, update_existing=True, progress=None) -> ImportResult:
+    result = ImportResult()
+    for chunk in _chunks(rows, chunk_size):
+        incoming = {}
+        for row in chunk:
+            result.rows += 1
+            try:
+                student_id, full_name, is_active = _parse(row)
+            except ValueError as exc:
+                result.reject(str(exc))
+                continue
+            # A later row for the same id wins
+            incoming[student_id] = (full_name, is_active)
+
+        existing = {s.student_id: s for s in Student.objects.filter(student_id__in=list(incoming))}
+        to_create, to_update = [], []
+        for student_id, (full_name, is_active) in incoming.items():
+            student = existing.get(student_id)
+            if student is None:
+                to_create.append(Student(
+                    student_id=student_id,
+                    full_name=full_name or student_id,
+                    is_active=True if is_active is None else is_active,
+                ))
+                continue
+            new_name = full_name or student.full_name
+            new_active = student.is_active if is_active is None else is_active
+            if not update_existing or (new_name, new_active) == (student.full_name, student.is_active):
+                result.unchanged += 1
+                continue
+            student.full_name, student.is_active = new_name, new_active
+            to_update.append(student)
+
+        with transaction.atomic():
+            # A scan may enrol one of these ids between the lookup and here,
+            # and ignore_conflicts drops that row silently, so what was
+            # created is counted in the table
+            new = Student.objects.filter(student_id__in=[s.student_id for s in to_create])
+            before = new.count() if to_create else 0
+            Student.objects.bulk_create(to_create, batch_size=chunk_size, ignore_conflicts=True)
+            Student.objects.bulk_update(to_update, ['full_name', 'is_active'], batch_size=chunk_size)
+            created = new.count() - before if to_create else 0
+        result.created += created
+        result.unchanged += len(to_create) - created
+        result.updated += len(to_update)
+        if progress is not None:
+            progress(result)
+
+    if result.created or result.updated:
+        roster.invalidate()
+    return result
+
+
+def delete_student(student):
+    # Deleting a student cascades to their records. Each session they were
+    # in gets what delete_record does for a single record: a tombstone for
+    # records.json deltas, the stored counters taken down and its rollup
+    # group refreshed, all in the same transaction; then the live feed and
+    # the scan path's seen sets hear about it. Deactivating a student keeps
+    # their records, so the toggle needs none of this. Scans still in a
+    # write buffer land first, so they are counted out with the rest.
+    writebuffer.drain(student_ids=[student.pk])
+    records = list(
+        AttendanceRecord.objects.filter(student=student).values_list('id', 'session_id', 'session__code')
+    )
+    with transaction.atomic():
+        groups = rollups.groups_of({session_id for _, session_id, _ in records})
+        student.delete()
+        RecordTombstone.objects.bulk_create(
+            [RecordTombstone(session_id=session_id, record_id=record_id) for record_id, session_id, _ in records]
+        )
+        counters.recount(AttendanceSession.objects.filter(id__in={session_id for _, session_id, _ in records}))
+        for group in groups:
+            rollups.refresh(group)
+    for record_id, session_id, code in records:
+        scanning.record_removed(session_id)
+        live.publish(code, live.deleted_event(record_id))
+    roster.invalidate()
+
+
+def export_lines(fmt: str = 'csv', chunk_size=CHUNK_SIZE):
+    # The whole roster as text lines, read in keyset pages by primary key
+    writer = csv.writer(Echo())
+    if fmt == 'csv':
+        yield writer.writerow(COLUMNS)
+    students = Student.objects.order_by('id').values_list('id', *COLUMNS)
+    last_id = 0
+    while True:
+        rows = list(students.filter(id__gt=last_id)[:chunk_size])
+        for row in rows:
+            if fmt == 'jsonl':
+                yield json.dumps(dict(zip(COLUMNS, row[1:]))) + '\n'
+            else:
+                yield writer.writerow([row[1], row[2], int(row[3])])
+        if len(rows) < chunk_size:
+            return
+        last_id = rows[-1][0]
@@ -0,0 +1,82 @@
+import logging
+import threading
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.utils import timezone
+
+from . import counters, rollups, scanning, writebuffer
+from .models import AttendanceSession
+
+logger = logging.getLogger(__name__)
+
+# Closes sessions whose ends_at has passed, so is_active alone says whether a
+# session is open and the dashboard can count and list open sessions from an
+# index. Expired sessions are switched off in one UPDATE every
+# SESSION_SWEEP_SECONDS, by a daemon thread in the web process (started from
+# qrat.asgi / qrat.wsgi when SESSION_SWEEPER is on) or by the sweep_sessions
+# command. The scan path still checks ends_at itself, so a scan can't slip
+# in between a session expiring and the next sweep.
+
+
+def close_hooks(sessions):
+    # Runs after sessions are closed, by a sweep or stop_session.
+    # sessions: list of (id, code)
+    ids = [session_id for session_id, _ in sessions]
+    for session_id, code in sessions:
+        scanning.forget_session(code, session_id)
+    # Stored counters are final from here on; recount them once in case an
+    # adjustment was lost, then fold the sessions into the rollups
+    counters.recount(AttendanceSession.objects.filter(id__in=ids))
+    rollups.roll_up(ids)
+
+
+def sweep(now=None) -> int:
+    now = now or timezone.now()
+    expired = list(AttendanceSession.objects.filter(is_active=True, ends_at__lt=now).values_list('id', 'code'))
+    if not expired:
+        return 0
+    ids = [session_id for session_id, _ in expired]
+    # Buffered scans accepted before the end, in any worker, must land first
+    writebuffer.drain(ids)
+    # Another worker's sweep, or stop_session, may have closed some of them
+    # since; each is switched off only if still active, and the hooks run
+    # only for those this sweep closed
+    closed = [
+        (session_id, code) for session_id, code in expired
+        if AttendanceSession.objects.filter(id=session_id, is_active=True).update(is_active=False)
+    ]
+    if closed:
+        close_hooks(closed)
+    return len(closed)
+
+
+def run(interval, stop=None):
+    stop = stop or threading.Event()
+    while not stop.wait(interval):
+        close_old_connections()
+        try:
+            closed = sweep()
+        except Exception:
+            logger.exception("session sweep failed")
+            continue
+        if closed:
+            logger.info("closed %d expired session(s)", closed)
+
+
+_thread = None
+_thread_lock = threading.Lock()
+
+
+def start():
+    # Idempotent; one sweeper thread per process. Several workers each
+    # sweeping is harmless: only rows still active are updated.
+    global _thread
+    if not settings.SESSION_SWEEPER:
+        return
+    with _thread_lock:
+        if _thread is None:
+            _thread = threading.Thread(
+                target=run, args=(settings.SESSION_SWEEP_SECONDS,), name='session-sweeper', daemon=True,
+            )
+            _thread.start()
@@ -1,3 +1,1042 @@
-from django.test import TestCase
+import asyncio
+import gzip
+import json
+import shutil
+import tempfile
+from concurrent.futures import Future
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime, time, timedelta
+from pathlib import Path
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import IntegrityError, transaction
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+
+from . import analytics, archive, counters, devicesharing, live, metrics, qr, rollups, roster, scanning, sessionlist, sessionmeta, studentio, sweeper, tokens, writebuffer
+from .models import (
+    AnalysisCheckpoint, ArchivedSessionSummary, AttendanceRecord, AttendanceSession, DailyRollup,
+    DeviceStudentLink, RecordTombstone, Student, StudentMonthRollup, Subject, Teacher,
+)
+
+
+class CacheResetMixin:
+    # Every test starts with cold per-process caches
+    def setUp(self):
+        super().setUp()
+        self.reset_caches()
+
+    def reset_caches(self):
+        for alias in settings.CACHES:
+            caches[alias].clear()
+        with sessionmeta._lock:
+            sessionmeta._local.clear()
+        with scanning._lock:
+            scanning._seen.clear()
+
+
+# TestCase's savepoints put every view over its query budget; budgets are
+# checked by QueryBudgetTests
+@override_settings(SCAN_WRITE_BEHIND=False, QUERY_BUDGETS={})
+class AttendanceTestCase(CacheResetMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.teacher = Teacher.objects.create(full_name='Asha Rao')
+        self.subject = Subject.objects.create(name='Physics')
+        for n in range(1, 4):
+            Student.objects.create(student_id=f's{n}', full_name=f'Student {n}')
+        self.session = self.make_session('live')
+
+    def make_session(self, code, starts_at=None, minutes=60, **fields):
+        starts_at = starts_at or timezone.now()
+        return AttendanceSession.objects.create(
+            code=code,
+            title='Lecture',
+            starts_at=starts_at,
+            ends_at=starts_at + timedelta(minutes=minutes),
+            date=timezone.localdate(starts_at),
+            time_slot='09:00-10:00',
+            teacher=self.teacher,
+            subject=self.subject,
+            **fields,
+        )
+
+    def scan(self, student_id, ip='10.0.0.1', code='live', token=None):
+        token = tokens.make_token(code) if token is None else token
+        return self.client.post(f'/scan/{code}/mark', {'t': token, 'student_id': student_id}, REMOTE_ADDR=ip)
+
+    def login(self):
+        self.client.post('/login/', {'pin': '1234'})
+
+    def record(self, session, student_id, device):
+        record = AttendanceRecord.objects.create(
+            session=session, student=Student.objects.get(student_id=student_id), device_fingerprint=device,
+        )
+        counters.adjust(session.id, 1)
+        return record
+
+    def close(self, session):
+        AttendanceSession.objects.filter(pk=session.pk).update(is_active=False)
+        sweeper.close_hooks([(session.id, session.code)])
+        session.refresh_from_db()
+
+
+class ScanTests(AttendanceTestCase):
+    def test_scan_marks_attendance(self):
+        response = self.scan('s1')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.json()['ok'])
+        self.session.refresh_from_db()
+        self.assertEqual(self.session.present_count, 1)
+        self.assertEqual(self.session.unique_devices_count, 1)
+        self.assertTrue(AttendanceRecord.objects.filter(session=self.session, student__student_id='s1').exists())
+
+    def test_same_student_rejected(self):
+        self.scan('s1', ip='10.0.0.1')
+        response = self.scan('s1', ip='10.0.0.2')
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(AttendanceRecord.objects.filter(session=self.session).count(), 1)
+
+    def test_same_device_rejected(self):
+        self.scan('s1', ip='10.0.0.1')
+        response = self.scan('s2', ip='10.0.0.1')
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(AttendanceRecord.objects.filter(session=self.session).count(), 1)
+
+    def test_duplicate_rejected_by_constraint_with_cold_seen_set(self):
+        # Another worker marked it; this one's seen set doesn't know yet
+        self.scan('s1', ip='10.0.0.1')
+        scanning._seen[self.session.id].students.clear()
+        scanning._seen[self.session.id].devices.clear()
+        response = self.scan('s1', ip='10.0.0.2')
+        self.assertEqual(response.status_code, 409)
+        self.session.refresh_from_db()
+        self.assertEqual(self.session.present_count, 1)
+
+    def test_unknown_id_enrolled(self):
+        response = self.scan('new-42')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Student.objects.get(student_id='new-42').full_name, 'new-42')
+
+    def test_missing_id(self):
+        self.assertEqual(self.scan('').status_code, 400)
+
+    def test_unknown_session(self):
+        self.assertEqual(self.scan('s1', code='nope').status_code, 404)
+
+    def test_closed_session_rejected(self):
+        AttendanceSession.objects.filter(pk=self.session.pk).update(is_active=False)
+        self.assertEqual(self.scan('s1').status_code, 403)
+        self.assertFalse(AttendanceRecord.objects.exists())
+
+    def test_student_can_rescan_after_record_deleted(self):
+        self.scan('s1')
+        self.login()
+        record = AttendanceRecord.objects.get()
+        self.client.post('/t/live/delete', {'record_id': record.id})
+        self.assertEqual(self.scan('s1').status_code, 200)
+
+    def delete_elsewhere(self, student_id):
+        # Delete as another worker would: this worker's seen set keeps the
+        # record
+        seen = scanning._seen[self.session.id]
+        self.login()
+        record = AttendanceRecord.objects.get(student__student_id=student_id)
+        self.client.post('/t/live/delete', {'record_id': record.id})
+        scanning._seen[self.session.id] = seen
+
+    @override_settings(CACHE_SHARED=False)
+    def test_deletion_in_other_worker_seen_without_shared_cache(self):
+        self.scan('s1')
+        self.delete_elsewhere('s1')
+        self.assertEqual(self.scan('s1', ip='10.0.0.2').status_code, 200)
+        self.assertEqual(self.scan('s1', ip='10.0.0.3').status_code, 409)
+
+    @override_settings(CACHE_SHARED=True)
+    def test_deletion_in_other_worker_seen_with_shared_cache(self):
+        self.scan('s1')
+        self.delete_elsewhere('s1')
+        self.assertEqual(self.scan('s1', ip='10.0.0.2').status_code, 200)
+
+    @override_settings(SESSION_CACHE_SIZE=2)
+    def test_seen_sets_bounded(self):
+        for n, code in enumerate(('live', 'second', 'third')):
+            if code != 'live':
+                self.make_session(code)
+            self.scan('s1', ip=f'10.0.0.{n}', code=code)
+        self.assertEqual(len(scanning._seen), 2)
+        self.assertNotIn(self.session.id, scanning._seen)
+
+    def test_no_js_form(self):
+        token = tokens.make_token('live')
+        self.assertEqual(self.client.get('/scan/live', {'t': token}).status_code, 200)
+        response = self.client.post('/scan/live', {'t': token, 'student_id': 's1'})
+        self.assertContains(response, 'Attendance marked successfully')
+
+
+@override_settings(QR_ROTATION_SECONDS=15, QR_TOKEN_GRACE_SECONDS=30)
+class TokenTests(AttendanceTestCase):
+    now = 15 * 100000 + 7
+
+    def test_current_token_valid(self):
+        bucket = tokens.current_bucket(self.now)
+        self.assertTrue(tokens.is_valid('live', tokens.make_token('live', bucket), now=self.now))
+
+    def test_grace_window(self):
+        bucket = tokens.current_bucket(self.now)
+        self.assertTrue(tokens.is_valid('live', tokens.make_token('live', bucket - 2), now=self.now))
+        self.assertFalse(tokens.is_valid('live', tokens.make_token('live', bucket - 3), now=self.now))
+
+    def test_future_and_foreign_tokens_rejected(self):
+        bucket = tokens.current_bucket(self.now)
+        self.assertFalse(tokens.is_valid('live', tokens.make_token('live', bucket + 1), now=self.now))
+        self.assertFalse(tokens.is_valid('live', tokens.make_token('other', bucket), now=self.now))
+        self.assertFalse(tokens.is_valid('live', '', now=self.now))
+
+    @override_settings(QR_ROTATION_SECONDS=0)
+    def test_rotation_off_accepts_anything(self):
+        self.assertTrue(tokens.is_valid('live', ''))
+
+    def test_expired_token_rejected_before_db(self):
+        response = self.scan('s1', token=tokens.make_token('live', tokens.current_bucket() - 3))
+        self.assertEqual(response.status_code, 403)
+        self.assertFalse(AttendanceRecord.objects.exists())
+        self.assertContains(self.client.get('/scan/live', {'t': 'stale'}), 'expired')
+
+
+@override_settings(LIVE_BROADCASTER='attendance.live.InProcessBroadcaster', LIVE_QUEUE_SIZE=2)
+class LiveFeedTests(AttendanceTestCase):
+    async def test_publish_reaches_subscriber(self):
+        broadcaster = live.InProcessBroadcaster()
+        sub = await broadcaster.subscribe('live')
+        # Published from a sync thread, as the scan views do
+        await sync_to_async(broadcaster.publish)('live', live.deleted_event(7))
+        self.assertEqual(await sub.get(timeout=1), {'type': 'deleted', 'id': 7})
+        self.assertIsNone(await sub.get(timeout=0.01))
+        await sub.close()
+        self.assertEqual(broadcaster._subscribers, {})
+
+    async def test_slow_subscriber_gets_reset(self):
+        broadcaster = live.InProcessBroadcaster()
+        sub = await broadcaster.subscribe('live')
+        for record_id in range(5):
+            broadcaster.publish('live', live.deleted_event(record_id))
+        await asyncio.sleep(0)
+        self.assertEqual(await sub.get(timeout=1), live.RESET)
+        broadcaster.publish('live', live.deleted_event(9))
+        self.assertEqual(await sub.get(timeout=1), {'type': 'deleted', 'id': 9})
+        await sub.close()
+
+    def test_stream_needs_asgi(self):
+        self.login()
+        self.assertEqual(self.client.get('/t/live/stream').status_code, 501)
+
+    async def test_stream(self):
+        response = await self.async_client.get('/t/live/stream')
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        stream = response.streaming_content
+        try:
+            self.assertEqual(await anext(stream), b'retry: 3000\n\n')
+            self.assertIn(b'event: ready', await anext(stream))
+            live.publish('live', live.deleted_event(3))
+            self.assertEqual(await anext(stream), live.sse(live.deleted_event(3)).encode())
+        finally:
+            await stream.aclose()
+
+    async def test_stream_unknown_session(self):
+        self.assertEqual((await self.async_client.get('/t/nope/stream')).status_code, 404)
+
+
+class RosterTests(AttendanceTestCase):
+    def setUp(self):
+        super().setUp()
+        with roster._lock:
+            roster._built.clear()
+
+    def test_active_students(self):
+        Student.objects.filter(student_id='s3').update(is_active=False)
+        response = self.client.get('/roster.json')
+        self.assertEqual(response.json(), [['s1', 'Student 1'], ['s2', 'Student 2']])
+        self.assertEqual(response['Cache-Control'], 'no-cache')
+
+    def test_compressed(self):
+        response = self.client.get('/roster.json', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(json.loads(gzip.decompress(response.content)), self.client.get('/roster.json').json())
+
+    def test_not_modified_until_changed(self):
+        etag = self.client.get('/roster.json')['ETag']
+        self.assertEqual(self.client.get('/roster.json', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        studentio.import_students([{'student_id': 's4', 'full_name': 'Four'}])
+        self.assertEqual(self.client.get('/roster.json', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_versioned_url_immutable(self):
+        current = roster.version()
+        response = self.client.get('/roster.json', {'v': current})
+        self.assertIn('immutable', response['Cache-Control'])
+
+    def assert_rename_seen(self):
+        etag = self.client.get('/roster.json')['ETag']
+        # Same length as before
+        studentio.import_students([{'student_id': 's1', 'full_name': 'Student X'}])
+        response = self.client.get('/roster.json', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(['s1', 'Student X'], response.json())
+
+    @override_settings(CACHE_SHARED=False)
+    def test_rename_changes_version(self):
+        self.assert_rename_seen()
+
+    @override_settings(CACHE_SHARED=True)
+    def test_rename_changes_version_with_shared_cache(self):
+        self.assert_rename_seen()
+
+    @override_settings(CACHE_SHARED=False)
+    def test_change_in_other_worker_seen_after_ttl(self):
+        etag = self.client.get('/roster.json')['ETag']
+        Student.objects.filter(student_id='s2').update(full_name='Student Y')
+        caches['default'].delete(roster.VERSION_KEY)  # ROSTER_VERSION_SECONDS passed
+        self.assertNotEqual(self.client.get('/roster.json')['ETag'], etag)
+
+
+@override_settings(QR_ROTATION_SECONDS=0)
+class QRImageTests(AttendanceTestCase):
+    def setUp(self):
+        super().setUp()
+        self.data = qr.scan_url('live')
+        self.login()
+
+    def fill_cache(self):
+        # Every size pre-rendered, as start_session leaves it
+        for box_size in qr.SIZES.values():
+            caches['qr'].set(qr.cache_key(self.data, box_size), f'png-{box_size}'.encode())
+
+    def test_requires_teacher(self):
+        self.client.logout()
+        self.assertEqual(self.client.get('/qr/live.png').status_code, 401)
+
+    def test_unknown_session(self):
+        self.assertEqual(self.client.get('/qr/nope.png').status_code, 404)
+
+    def test_served_from_cache(self):
+        self.fill_cache()
+        response = self.client.get('/qr/live.png', {'size': 'phone'})
+        self.assertEqual(response.content, b'png-6')
+        self.assertEqual(response['Content-Type'], 'image/png')
+        self.assertEqual(response['ETag'], f'"{qr.etag(self.data, 6)}"')
+        self.assertEqual(response['Cache-Control'], 'no-cache')
+
+    def test_unchanged_refresh_not_modified(self):
+        self.fill_cache()
+        etag = self.client.get('/qr/live.png')['ETag']
+        response = self.client.get('/qr/live.png', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+
+    @override_settings(QR_ROTATION_SECONDS=15)
+    def test_rotation_changes_etag(self):
+        now = tokens.current_bucket()
+        first = qr.etag(qr.scan_url('live', tokens.make_token('live', now)), 10)
+        second = qr.etag(qr.scan_url('live', tokens.make_token('live', now + 1)), 10)
+        self.assertNotEqual(first, second)
+
+    def test_render(self):
+        self.assertTrue(qr.render(self.data, 2).startswith(b'\x89PNG'))
+        self.assertIn(b'<svg', qr.render(self.data, 2, 'svg'))
+
+
+class FakePool:
+    # Stands in for the render process pool; futures complete when a test
+    # says so
+    def __init__(self, broken=0):
+        self.submitted = []
+        self.broken = broken
+
+    def submit(self, fn, *args):
+        if self.broken:
+            self.broken -= 1
+            raise BrokenProcessPool()
+        future = Future()
+        self.submitted.append((args, future))
+        return future
+
+
+class QRRenderPoolTests(AttendanceTestCase):
+    def setUp(self):
+        super().setUp()
+        self.pool = FakePool()
+        patcher = mock.patch.object(qr, '_get_pool', lambda: self.pool)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(qr._inflight.clear)
+        self.addCleanup(qr._scheduled.clear)
+
+    def test_concurrent_misses_share_a_render(self):
+        data = qr.scan_url('live')
+        first = qr._submit(data, 10, 'png')
+        self.assertIs(qr._submit(data, 10, 'png'), first)
+        self.assertEqual(len(self.pool.submitted), 1)
+        first.set_result(b'png')
+        self.assertEqual(caches['qr'].get(qr.cache_key(data, 10)), b'png')
+        self.assertEqual(qr._inflight, {})
+
+    def test_broken_pool_replaced(self):
+        self.pool.broken = 1
+        with mock.patch.object(qr, '_reset_pool') as reset:
+            qr._submit(qr.scan_url('live'), 10, 'png')
+        reset.assert_called_once()
+        self.assertEqual(len(self.pool.submitted), 1)
+
+    @override_settings(QR_ROTATION_SECONDS=15, QR_PRERENDER_WINDOWS=2)
+    def test_prerender_rolls_window_forward(self):
+        qr.prerender('live')
+        self.assertEqual(len(self.pool.submitted), 2 * len(qr.SIZES))
+        # Already queued for these windows
+        qr.prerender('live')
+        self.assertEqual(len(self.pool.submitted), 2 * len(qr.SIZES))
+        with mock.patch.object(tokens, 'current_bucket', return_value=tokens.current_bucket() + 1):
+            qr.prerender('live')
+        self.assertEqual(len(self.pool.submitted), 3 * len(qr.SIZES))
+
+    @override_settings(QR_ROTATION_SECONDS=0)
+    def test_prerender_skips_cached_sizes(self):
+        data = qr.scan_url('live')
+        caches['qr'].set(qr.cache_key(data, qr.SIZES['phone']), b'png')
+        qr.prerender('live')
+        self.assertEqual(
+            sorted(args[1] for args, _ in self.pool.submitted),
+            sorted(size for name, size in qr.SIZES.items() if name != 'phone'),
+        )
+
+
+class RecordsJsonTests(AttendanceTestCase):
+    def setUp(self):
+        super().setUp()
+        self.login()
+
+    def get(self, **kwargs):
+        return self.client.get('/t/live/records.json', **kwargs)
+
+    def test_full_list(self):
+        self.scan('s1', ip='10.0.0.1')
+        self.scan('s2', ip='10.0.0.2')
+        data = self.get().json()
+        self.assertTrue(data['full'])
+        self.assertEqual(data['count'], 2)
+        self.assertEqual({r['student_id'] for r in data['records']}, {'s1', 's2'})
+
+    def test_delta_returns_only_new_records(self):
+        self.scan('s1', ip='10.0.0.1')
+        cursor = self.get().json()['cursor']
+        self.scan('s2', ip='10.0.0.2')
+        data = self.get(data={'since': cursor}).json()
+        self.assertFalse(data['full'])
+        self.assertEqual([r['student_id'] for r in data['records']], ['s2'])
+        self.assertEqual(data['deleted'], [])
+        self.assertEqual(data['count'], 2)
+
+    def test_not_modified(self):
+        self.scan('s1')
+        first = self.get()
+        response = self.get(data={'since': first.json()['cursor']}, HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(response.status_code, 304)
+        self.scan('s2', ip='10.0.0.2')
+        response = self.get(data={'since': first.json()['cursor']}, HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(response.status_code, 200)
+
+    def test_delete_leaves_tombstone(self):
+        self.scan('s1', ip='10.0.0.1')
+        self.scan('s2', ip='10.0.0.2')
+        first = self.get()
+        record = AttendanceRecord.objects.get(student__student_id='s1')
+        self.assertTrue(self.client.post('/t/live/delete', {'record_id': record.id}).json()['ok'])
+        self.assertTrue(RecordTombstone.objects.filter(session=self.session, record_id=record.id).exists())
+        data = self.get(data={'since': first.json()['cursor']}, HTTP_IF_NONE_MATCH=first['ETag']).json()
+        self.assertEqual(data['records'], [])
+        self.assertEqual(data['deleted'], [record.id])
+        self.assertEqual(data['count'], 1)
+
+    def test_late_commit_changes_etag(self):
+        # A record whose id is below the cursor but which committed after it
+        # (concurrent inserts) moves the count, and so the ETag
+        self.scan('s1', ip='10.0.0.1')
+        late = self.record(self.session, 's2', 'dev-2')
+        self.scan('s3', ip='10.0.0.3')
+        late_id = late.id
+        late.delete()
+        counters.adjust(self.session.id, -1)
+        first = self.get()
+        AttendanceRecord.objects.create(
+            id=late_id, session=self.session, student=Student.objects.get(student_id='s2'), device_fingerprint='dev-2',
+        )
+        counters.adjust(self.session.id, 1)
+        response = self.get(data={'since': first.json()['cursor']}, HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data['records'], [])
+        self.assertEqual(data['count'], 3)
+
+    def test_requires_known_session(self):
+        self.assertEqual(self.client.get('/t/nope/records.json').status_code, 404)
+
+
+class DashboardListTests(AttendanceTestCase):
+    def setUp(self):
+        super().setUp()
+        start = timezone.now() - timedelta(days=1)
+        for n in range(4):
+            self.make_session(f'old{n}', start - timedelta(hours=n))
+        # Same start as old0; the id breaks the tie
+        self.make_session('tie', start)
+        self.login()
+
+    def test_pages_follow_on(self):
+        codes, cursor = [], ''
+        while True:
+            data = self.client.get('/dashboard/sessions.json', {'cursor': cursor} if cursor else {}).json()
+            codes += [row['code'] for row in data['sessions']]
+            cursor = data['next']
+            if cursor is None:
+                break
+        self.assertEqual(codes, ['live', 'tie', 'old0', 'old1', 'old2', 'old3'])
+
+    def test_page_size(self):
+        sessions, cursor = sessionlist.page(size=2)
+        self.assertEqual([s.code for s in sessions], ['live', 'tie'])
+        sessions, cursor = sessionlist.page(cursor, size=2)
+        self.assertEqual([s.code for s in sessions], ['old0', 'old1'])
+        self.assertIsNotNone(cursor)
+
+    def test_bad_cursor(self):
+        for cursor in ('x', '1', '1.2.3', f'{10 ** 20}.1', f'-{10 ** 20}.1'):
+            self.assertIsNone(sessionlist.decode_cursor(cursor), cursor)
+            self.assertEqual(self.client.get('/dashboard/sessions.json', {'cursor': cursor}).status_code, 400)
+            self.assertEqual(self.client.get('/dashboard/', {'cursor': cursor}).status_code, 200)
+
+
+class CounterTests(AttendanceTestCase):
+    def setUp(self):
+        super().setUp()
+        self.login()
+        self.scan('s1', ip='10.0.0.1')
+        self.scan('s2', ip='10.0.0.2')
+
+    def test_delete_record(self):
+        record = AttendanceRecord.objects.get(student__student_id='s1')
+        self.client.post('/t/live/delete', {'record_id': record.id})
+        self.session.refresh_from_db()
+        self.assertEqual((self.session.present_count, self.session.unique_devices_count), (1, 1))
+        self.assertFalse(counters.drift(AttendanceSession.objects.all()).exists())
+
+    def test_delete_student(self):
+        other = self.make_session('other')
+        self.scan('s1', ip='10.0.0.1', code='other')
+        records = set(AttendanceRecord.objects.filter(student__student_id='s1').values_list('id', flat=True))
+        self.client.post('/settings/students/delete', {'student_id': 's1'})
+        self.assertFalse(Student.objects.filter(student_id='s1').exists())
+        self.assertEqual(set(RecordTombstone.objects.values_list('record_id', flat=True)), records)
+        self.session.refresh_from_db()
+        other.refresh_from_db()
+        self.assertEqual(self.session.present_count, 1)
+        self.assertEqual(other.present_count, 0)
+        self.assertFalse(counters.drift(AttendanceSession.objects.all()).exists())
+
+    def test_recount_repairs_drift(self):
+        AttendanceSession.objects.filter(pk=self.session.pk).update(present_count=7)
+        self.assertEqual(list(counters.drift(AttendanceSession.objects.all())), [self.session])
+        counters.recount(AttendanceSession.objects.all())
+        self.assertFalse(counters.drift(AttendanceSession.objects.all()).exists())
+
+
+class RollupTests(AttendanceTestCase):
+    def setUp(self):
+        super().setUp()
+        self.login()
+        self.scan('s1', ip='10.0.0.1')
+        self.scan('s2', ip='10.0.0.2')
+
+    def month_rows(self):
+        return dict(StudentMonthRollup.objects.values_list('student__student_id', 'present'))
+
+    def test_stop_rolls_up(self):
+        self.client.post('/stop/live')
+        self.session.refresh_from_db()
+        self.assertTrue(self.session.rolled_up)
+        daily = DailyRollup.objects.get()
+        self.assertEqual((daily.sessions, daily.present, daily.teacher_id), (1, 2, self.teacher.id))
+        self.assertEqual(self.month_rows(), {'s1': 1, 's2': 1})
+        self.assertEqual(set(StudentMonthRollup.objects.values_list('teacher_id', flat=True)), {self.teacher.id})
+
+    def test_open_session_not_rolled_up(self):
+        self.assertEqual(rollups.roll_up([self.session.id]), 0)
+        self.assertFalse(DailyRollup.objects.exists())
+
+    def test_delete_record_refreshes(self):
+        self.close(self.session)
+        record = AttendanceRecord.objects.get(student__student_id='s1')
+        self.client.post('/t/live/delete', {'record_id': record.id})
+        self.assertEqual(DailyRollup.objects.get().present, 1)
+        self.assertEqual(self.month_rows(), {'s2': 1})
+
+    def test_delete_student_refreshes(self):
+        self.close(self.session)
+        studentio.delete_student(Student.objects.get(student_id='s2'))
+        self.assertEqual(DailyRollup.objects.get().present, 1)
+        self.assertEqual(self.month_rows(), {'s1': 1})
+
+    def test_rebuild_matches_incremental(self):
+        self.close(self.session)
+        self.close(self.make_session('second'))
+        daily = list(DailyRollup.objects.values_list('date', 'teacher_id', 'subject_id', 'sessions', 'present'))
+        monthly = self.month_rows()
+        rollups.rebuild()
+        self.assertEqual(
+            list(DailyRollup.objects.values_list('date', 'teacher_id', 'subject_id', 'sessions', 'present')), daily,
+        )
+        self.assertEqual(self.month_rows(), monthly)
+
+    def test_refresh_keeps_one_row_per_group(self):
+        self.close(self.session)
+        for group in rollups.groups_of([self.session.id]) * 2:
+            rollups.refresh(group)
+        self.assertEqual(DailyRollup.objects.count(), 1)
+        self.assertEqual(self.month_rows(), {'s1': 1, 's2': 1})
+        daily = DailyRollup.objects.get()
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            DailyRollup.objects.create(
+                date=daily.date, teacher=self.teacher, subject=self.subject, latest_start=daily.latest_start,
+            )
+
+    def test_student_figures_include_open_sessions(self):
+        totals = analytics.build()
+        self.assertEqual(totals.session_count, 1)
+        self.assertEqual(totals.row(Student.objects.get(student_id='s1').pk, 's1', 'Student 1').attended, 1)
+
+    def test_student_figures_follow_day_filters(self):
+        self.close(self.session)
+        month = rollups.month_start(rollups.month_start(timezone.localdate()) - timedelta(days=1))
+        earlier = self.make_session('early', timezone.make_aware(datetime.combine(month.replace(day=3), time(10))))
+        self.record(earlier, 's3', 'dev-3')
+        self.close(earlier)
+        s3 = Student.objects.get(student_id='s3').pk
+        # Part of the earlier month, without the session
+        totals = analytics.build(date_from=month.replace(day=5).isoformat())
+        self.assertEqual((totals.session_count, totals.rows.get(s3)), (1, None))
+        # Part of it with the session, from the records; then the whole
+        # month, from the month rows
+        for date_from, date_to in (
+            (month.replace(day=2), month.replace(day=20)),
+            (month, rollups.next_month(month) - timedelta(days=1)),
+        ):
+            totals = analytics.build(date_from=date_from.isoformat(), date_to=date_to.isoformat())
+            self.assertEqual((totals.session_count, totals.rows.get(s3)), (1, [1]))
+
+    def test_reports_from_rollups(self):
+        self.close(self.session)
+        totals = analytics.build()
+        self.assertEqual(totals.session_count, 1)
+        summary = analytics.summarize(totals, threshold=75)
+        self.assertEqual((summary['students'], summary['defaulter_count']), (3, 1))
+        self.assertEqual(summary['defaulters'][0].student_id, 's3')
+        self.assertEqual(self.client.get('/reports/').status_code, 200)
+
+
+class SweeperTests(AttendanceTestCase):
+    def setUp(self):
+        super().setUp()
+        earlier = timezone.now() - timedelta(hours=2)
+        self.a = self.make_session('a', earlier)
+        self.b = self.make_session('b', earlier)
+        self.record(self.a, 's1', 'd1')
+
+    def test_sweep_closes_expired(self):
+        self.assertEqual(sweeper.sweep(), 2)
+        self.assertEqual(set(AttendanceSession.objects.filter(is_active=True).values_list('code', flat=True)), {'live'})
+        self.a.refresh_from_db()
+        self.assertTrue(self.a.rolled_up)
+        self.assertEqual(sweeper.sweep(), 0)
+
+    def test_hooks_only_for_sessions_this_sweep_closed(self):
+        def closed_elsewhere(ids):
+            # Another worker closes one while this one drains
+            AttendanceSession.objects.filter(pk=self.a.pk).update(is_active=False)
+            return True
+        with mock.patch.object(sweeper.writebuffer, 'drain', closed_elsewhere), \
+                mock.patch.object(sweeper, 'close_hooks') as hooks:
+            self.assertEqual(sweeper.sweep(), 1)
+        hooks.assert_called_once_with([(self.b.id, 'b')])
+
+
+class DeviceSharingTests(AttendanceTestCase):
+    def setUp(self):
+        super().setUp()
+        self.other = self.make_session('other')
+        self.record(self.session, 's1', 'dev-1')
+        self.record(self.other, 's2', 'dev-1')
+        self.record(self.other, 's3', 'dev-3')
+
+    def test_shared_device_clustered(self):
+        result = devicesharing.scan()
+        self.assertEqual((result.records, result.created), (3, 3))
+        [cluster] = devicesharing.clusters(min_students=2)
+        self.assertEqual(cluster.fingerprint, 'dev-1')
+        self.assertEqual({student_id for student_id, _, _ in cluster.students}, {'s1', 's2'})
+
+    def test_runs_are_incremental(self):
+        devicesharing.scan()
+        third = self.make_session('third')
+        self.record(third, 's1', 'dev-1')
+        result = devicesharing.scan(chunk_size=1)
+        self.assertEqual((result.records, result.created, result.updated), (1, 0, 1))
+        link = DeviceStudentLink.objects.get(fingerprint='dev-1', student__student_id='s1')
+        self.assertEqual(link.sessions, 2)
+        self.assertEqual(devicesharing.scan().records, 0)
+
+    def test_late_commit_picked_up(self):
+        # A record whose id was handed out before the last run but which
+        # committed after it
+        late = AttendanceRecord.objects.get(student__student_id='s2')
+        late_id = late.id
+        late.delete()
+        devicesharing.scan()
+        self.assertEqual(AnalysisCheckpoint.objects.get().gaps[0][0], late_id)
+        AttendanceRecord.objects.create(id=late_id, session=self.other, student=late.student, device_fingerprint='dev-1')
+        result = devicesharing.scan()
+        self.assertEqual(result.records, 1)
+        self.assertEqual(len(devicesharing.clusters(min_students=2)), 1)
+        self.assertEqual(AnalysisCheckpoint.objects.get().gaps, [])
+
+    def test_reset(self):
+        devicesharing.scan()
+        devicesharing.reset()
+        self.assertFalse(DeviceStudentLink.objects.exists())
+        self.assertEqual(devicesharing.scan().records, 3)
+
+
+class ExportTests(AttendanceTestCase):
+    def setUp(self):
+        super().setUp()
+        self.scan('s1')
+
+    def test_csv_exports(self):
+        self.login()
+        for query, expected in (
+            ('export=csv', 'live'),
+            ('export=csv&detail=records', 'Student 1'),
+            ('export=csv&detail=students', 's3'),
+        ):
+            response = self.client.get(f'/reports/?{query}')
+            self.assertFalse(response.is_async, query)
+            self.assertIn(expected, b''.join(response.streaming_content).decode(), query)
+
+    async def test_streams_async_under_asgi(self):
+        # A sync iterator would be buffered whole by Django's ASGI handler
+        await self.async_client.post('/login/', {'pin': '1234'})
+        for path in ('/reports/?export=csv&detail=records', '/settings/students/export'):
+            response = await self.async_client.get(path)
+            self.assertTrue(response.is_async, path)
+            body = b''.join([chunk async for chunk in response.streaming_content]).decode()
+            self.assertIn('s1', body, path)
+
+
+class ImportTests(AttendanceTestCase):
+    def test_create_update_unchanged(self):
+        result = studentio.import_students([
+            {'student_id': 's1', 'full_name': 'Renamed', 'is_active': 'yes'},
+            {'student_id': 's2', 'full_name': 'Student 2'},
+            {'student_id': 's9', 'full_name': 'New Student', 'is_active': '0'},
+        ])
+        self.assertEqual((result.rows, result.created, result.updated, result.unchanged), (3, 1, 1, 1))
+        self.assertEqual(Student.objects.get(student_id='s1').full_name, 'Renamed')
+        self.assertFalse(Student.objects.get(student_id='s9').is_active)
+
+    def test_row_errors(self):
+        lines = [
+            '{"student_id": "s7", "full_name": "Fine"}\n',
+            'not json\n',
+            '["s8", "A list"]\n',
+            '{"full_name": "No ID"}\n',
+            json.dumps({'student_id': 's9', 'full_name': 'x' * 200}) + '\n',
+        ]
+        result = studentio.import_students(studentio.read_rows(lines, 'jsonl'))
+        self.assertEqual((result.rows, result.created, result.skipped), (5, 1, 4))
+        self.assertEqual(result.errors, [
+            'row 2: not valid JSON',
+            'row 3: not a JSON object',
+            'row 4: student_id is missing',
+            'row 5: full_name is longer than 128 characters',
+        ])
+        self.assertFalse(Student.objects.filter(student_id='s9').exists())
+
+    def test_errors_shown_are_capped(self):
+        result = studentio.import_students([{}] * (studentio.ERRORS_SHOWN + 5))
+        self.assertEqual(result.skipped, studentio.ERRORS_SHOWN + 5)
+        self.assertEqual(len(result.errors), studentio.ERRORS_SHOWN)
+
+    def test_created_counts_rows_that_went_in(self):
+        # s1 exists, so it is an update candidate and never counted as created
+        result = studentio.import_students([{'student_id': 's1'}, {'student_id': 's5', 'full_name': 'Five'}])
+        self.assertEqual((result.created, result.unchanged), (1, 1))
+
+    def test_upload(self):
+        self.login()
+        upload = SimpleUploadedFile('roster.csv', b'student_id,full_name,is_active\ns4,Four,1\n,Nobody,1\n')
+        data = self.client.post('/settings/students/import', {'file': upload}).json()
+        self.assertTrue(data['ok'])
+        self.assertEqual((data['created'], data['skipped']), (1, 1))
+        self.assertEqual(data['errors'], ['row 2: student_id is missing'])
+
+    def test_upload_requires_login(self):
+        upload = SimpleUploadedFile('roster.csv', b'student_id,full_name\ns4,Four\n')
+        self.assertEqual(self.client.post('/settings/students/import', {'file': upload}).status_code, 401)
+
+
+class ArchiveTests(AttendanceTestCase):
+    def setUp(self):
+        super().setUp()
+        self.archive_dir = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.archive_dir, ignore_errors=True)
+        self.month = rollups.month_start(rollups.month_start(timezone.localdate()) - timedelta(days=40))
+        starts_at = timezone.make_aware(datetime.combine(self.month + timedelta(days=2), time(10)))
+        self.old = self.make_session('old', starts_at=starts_at)
+        self.record(self.old, 's1', 'dev-1')
+        self.record(self.old, 's2', 'dev-2')
+        self.close(self.old)
+
+    def run_archive(self):
+        with self.settings(ARCHIVE_DIR=self.archive_dir):
+            return archive.archive(rollups.next_month(self.month))
+
+    def test_nothing_archived(self):
+        self.assertIsNone(archive.horizon())
+        self.assertFalse(archive.reaches_archive(''))
+
+    def test_archive_moves_sessions(self):
+        result = self.run_archive()
+        self.assertEqual((result.sessions, result.records), (1, 2))
+        self.assertFalse(AttendanceSession.objects.filter(code='old').exists())
+        self.assertTrue(AttendanceSession.objects.filter(code='live').exists())
+        self.assertEqual(ArchivedSessionSummary.objects.get().present_count, 2)
+        with gzip.open(result.path, 'rt', encoding='utf-8') as fh:
+            entry = json.loads(fh.readline())
+        self.assertEqual({r['student_id'] for r in entry['records']}, {'s1', 's2'})
+
+    def test_horizon(self):
+        self.run_archive()
+        horizon = rollups.next_month(self.month)
+        self.assertEqual(archive.horizon(), horizon)
+        self.assertTrue(archive.reaches_archive(''))
+        self.assertTrue(archive.reaches_archive(self.month.isoformat()))
+        self.assertFalse(archive.reaches_archive(horizon.isoformat()))
+
+    @override_settings(CACHE_SHARED=False)
+    def test_horizon_not_cached_per_process(self):
+        # archive_attendance runs in another process and can't clear this
+        # one's cache
+        self.assertIsNone(archive.horizon())
+        ArchivedSessionSummary.objects.create(
+            code='elsewhere', title='Lecture', starts_at=self.old.starts_at, ends_at=self.old.ends_at,
+            archive_file='other.jsonl.gz',
+        )
+        self.assertEqual(archive.horizon(), rollups.next_month(self.month))
+
+    def test_reports_keep_archived_months(self):
+        before = analytics.build(include_archive=True)
+        self.run_archive()
+        after = analytics.build(include_archive=archive.reaches_archive(''))
+        self.assertEqual((after.session_count, after.rows), (before.session_count, before.rows))
+        self.assertFalse(DailyRollup.objects.filter(date__lt=rollups.next_month(self.month)).exists())
+        self.login()
+        self.assertEqual(self.client.get('/reports/').status_code, 200)
+
+    def test_rolls_up_before_archiving(self):
+        # Ended but never swept or stopped
+        starts_at = self.old.starts_at + timedelta(days=1)
+        unswept = self.make_session('unswept', starts_at=starts_at)
+        self.record(unswept, 's3', 'dev-3')
+        self.assertFalse(unswept.rolled_up)
+        self.run_archive()
+        self.assertFalse(AttendanceSession.objects.filter(code='unswept').exists())
+        self.assertEqual(
+            StudentMonthRollup.objects.get(student__student_id='s3', month=self.month).present, 1,
+        )
+
+
+class MetricsTests(AttendanceTestCase):
+    def setUp(self):
+        super().setUp()
+        metrics.reset()
+        self.addCleanup(metrics.reset)
+
+    def test_server_timing(self):
+        self.login()
+        response = self.client.get('/roster.json')
+        self.assertRegex(response['Server-Timing'], r'^db;dur=[\d.]+;desc="\d+ queries", tpl;dur=[\d.]+, total;dur=')
+
+    async def test_server_timing_async(self):
+        response = await self.async_client.get('/t/live/records.json')
+        self.assertIn('queries"', response['Server-Timing'])
+        self.assertGreater(metrics.snapshot()['session_records_json'].queries, 0)
+
+    @override_settings(QUERY_BUDGETS={'scan_mark': 1})
+    def test_totals_exposed(self):
+        with self.assertLogs('attendance.middleware', 'WARNING') as logs:
+            self.scan('s1')
+            self.scan('s2', ip='10.0.0.2')
+        self.assertEqual(len(logs.output), 2)
+        text = self.client.get('/metrics').content.decode()
+        self.assertIn('qrat_requests_total{view="scan_mark"} 2', text)
+        self.assertIn('qrat_query_budget_exceeded_total{view="scan_mark"} 2', text)
+        self.assertIn('# TYPE qrat_db_queries_total counter', text)
+
+    @override_settings(METRICS_TOKEN='secret')
+    def test_token(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 401)
+        response = self.client.get('/metrics', headers={'Authorization': 'Bearer secret'})
+        self.assertEqual(response.status_code, 200)
+
+
+# SQLite checks foreign keys at COMMIT, so rows for deleted students only
+# fail outside TestCase's wrapping transaction.
+@override_settings(SCAN_WRITE_BEHIND=True, SCAN_FLUSH_INTERVAL_MS=60000)
+class WriteBufferTests(CacheResetMixin, TransactionTestCase):
+    def setUp(self):
+        super().setUp()
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        self.base = Path(self.tmp) / 'scans.log'
+        settings_patch = override_settings(SCAN_WAL_PATH=str(self.base))
+        settings_patch.enable()
+        self.addCleanup(settings_patch.disable)
+        self.s1 = Student.objects.create(student_id='s1', full_name='Student 1')
+        self.s2 = Student.objects.create(student_id='s2', full_name='Student 2')
+        now = timezone.now()
+        self.session = AttendanceSession.objects.create(
+            code='live', title='Lecture', starts_at=now, ends_at=now + timedelta(hours=1),
+        )
+
+    def buffer(self, owner='me'):
+        buf = writebuffer.ScanWriteBuffer(self.base, 60, 100, fsync=False, owner=owner)
+        buf.start()
+        self.addCleanup(buf.close)
+        return buf
+
+    def entry(self, student, device):
+        return {
+            'code': 'live', 'session': self.session.id, 'student': student.id,
+            'student_id': student.student_id, 'fingerprint': device, 'scanned_at': timezone.now().isoformat(),
+        }
+
+    def rejected(self):
+        path = self.base.with_name('scans.rejected.log')
+        return writebuffer._read([path])
+
+    def test_bad_row_set_aside(self):
+        buf = self.buffer()
+        buf.submit('live', self.session.id, self.s1, 'd1', timezone.now())
+        buf.submit('live', self.session.id, self.s2, 'd2', timezone.now())
+        Student.objects.filter(pk=self.s2.pk).delete()
+        with mock.patch.object(live, 'publish') as publish, self.assertLogs('attendance.writebuffer', 'WARNING'):
+            self.assertEqual(buf.flush(), 2)
+        self.assertEqual(list(AttendanceRecord.objects.values_list('student_id', flat=True)), [self.s1.pk])
+        self.assertEqual([e['student'] for e in self.rejected()], [self.s2.pk])
+        # Only the row that went in is announced
+        self.assertEqual(publish.call_count, 1)
+        self.assertEqual(publish.call_args.args[1]['record']['student_id'], 's1')
+        self.session.refresh_from_db()
+        self.assertEqual(self.session.present_count, 1)
+        self.assertEqual(buf.flush(), 0)
+
+    def test_start_replays_leftover_logs(self):
+        # A dead process's log with a row that can't go in, and one left by
+        # an earlier process with this owner name
+        dead, _, dead_lock = writebuffer._paths(self.base, 'dead')
+        dead_lock.touch()
+        dead.write_text(json.dumps(self.entry(self.s2, 'd2')) + '\n')
+        own, _, _ = writebuffer._paths(self.base, 'me')
+        own.write_text(json.dumps(self.entry(self.s1, 'd1')) + '\n')
+        Student.objects.filter(pk=self.s2.pk).delete()
+        with self.assertLogs('attendance.writebuffer', 'WARNING'):
+            buf = self.buffer()
+        self.assertFalse(dead.exists())
+        self.assertEqual(len(self.rejected()), 1)
+        # The buffer's thread is woken for the taken-over scan; flush waits
+        # for it if it got there first
+        buf.flush()
+        self.assertTrue(AttendanceRecord.objects.filter(student=self.s1).exists())
+
+    def test_delete_student_drains_buffer(self):
+        buf = self.buffer()
+        buf.submit('live', self.session.id, self.s1, 'd1', timezone.now())
+        with mock.patch.object(writebuffer, '_buffer', buf):
+            studentio.delete_student(self.s1)
+        self.assertFalse(AttendanceRecord.objects.exists())
+        self.assertEqual(self.rejected(), [])
+        self.session.refresh_from_db()
+        self.assertEqual(self.session.present_count, 0)
+
+    def test_delete_session_drains_buffer(self):
+        buf = self.buffer()
+        buf.submit('live', self.session.id, self.s1, 'd1', timezone.now())
+        self.client.post('/login/', {'pin': '1234'})
+        with mock.patch.object(writebuffer, '_buffer', buf):
+            self.client.post('/dashboard/delete/live')
+        self.assertFalse(AttendanceSession.objects.exists())
+        self.assertEqual(buf.claims(self.session.id), [])
+        self.assertEqual(self.rejected(), [])
+
+
+# Budgets are measured in autocommit mode; TestCase's wrapping transaction
+# turns every atomic() into extra SAVEPOINT queries, so these run outside it.
+@override_settings(QUERY_BUDGET_STRICT=True, SCAN_WRITE_BEHIND=False)
+class QueryBudgetTests(CacheResetMixin, TransactionTestCase):
+    def setUp(self):
+        super().setUp()
+        self.teacher = Teacher.objects.create(full_name='Asha Rao')
+        Student.objects.create(student_id='s1', full_name='Student 1')
+        now = timezone.now()
+        AttendanceSession.objects.create(
+            code='live', title='Lecture', starts_at=now, ends_at=now + timedelta(hours=1), teacher=self.teacher,
+        )
+
+    def scan(self, student_id, ip, path='/scan/live/mark'):
+        return self.client.post(path, {'t': tokens.make_token('live'), 'student_id': student_id}, REMOTE_ADDR=ip)
+
+    def cold_scan(self, student_id, ip, path='/scan/live/mark'):
+        # As the first scan a worker sees for the session
+        self.reset_caches()
+        return self.scan(student_id, ip, path)
+
+    def test_scans_within_budget(self):
+        # QUERY_BUDGET_STRICT turns going over into an exception
+        self.assertEqual(self.cold_scan('s1', '10.0.0.1').status_code, 200)
+        self.assertEqual(self.cold_scan('new-1', '10.0.0.2').status_code, 200)
+        self.assertEqual(self.cold_scan('s1', '10.0.0.3').status_code, 409)
+        self.assertEqual(self.cold_scan('new-2', '10.0.0.4', path='/scan/live').status_code, 200)
+
+    def test_teacher_views_within_budget(self):
+        self.client.post('/login/', {'pin': '1234'})
+        self.scan('s1', '10.0.0.1')
+        for path in ('/roster.json', '/t/live/records.json', '/dashboard/', '/dashboard/sessions.json', '/reports/'):
+            self.reset_caches()
+            self.assertEqual(self.client.get(path).status_code, 200, path)
+
+    def test_archived_reports_within_budget(self):
+        self.client.post('/login/', {'pin': '1234'})
+        earlier = timezone.now() - timedelta(days=90)
+        ArchivedSessionSummary.objects.create(
+            code='old', title='Lecture', starts_at=earlier, ends_at=earlier + timedelta(hours=1),
+            teacher=self.teacher, archive_file='old.jsonl.gz',
+        )
+        self.reset_caches()
+        self.assertEqual(self.client.get('/reports/').status_code, 200)
+
+    @override_settings(QUERY_BUDGETS={'scan_mark': 1})
+    def test_over_budget_raises(self):
+        from .middleware import QueryBudgetExceeded
+        with self.assertRaises(QueryBudgetExceeded):
+            self.scan('s1', '10.0.0.1')
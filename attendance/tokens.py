@@ -0,0 +1,40 @@
+import math
+import time
+
+from django.conf import settings
+from django.utils.crypto import constant_time_compare, salted_hmac
+
+# Rotating QR tokens: an HMAC of (session code, time bucket). Nothing is
+# stored; a token is checked by recomputing it for the last few buckets.
+
+KEY_SALT = 'attendance.tokens.scan'
+TOKEN_LENGTH = 16
+
+
+def enabled() -> bool:
+    return settings.QR_ROTATION_SECONDS > 0
+
+
+def current_bucket(now: float | None = None) -> int:
+    now = time.time() if now is None else now
+    return int(now // settings.QR_ROTATION_SECONDS)
+
+
+def make_token(code: str, bucket: int | None = None) -> str:
+    bucket = current_bucket() if bucket is None else bucket
+    return salted_hmac(KEY_SALT, f"{code}:{bucket}", algorithm='sha256').hexdigest()[:TOKEN_LENGTH]
+
+
+def is_valid(code: str, token: str, now: float | None = None) -> bool:
+    if not enabled():
+        return True
+    if not token:
+        return False
+    bucket = current_bucket(now)
+    # Accept the current bucket plus enough older ones to cover the grace
+    # window, so a student who scanned just before a rotation can still submit.
+    grace = math.ceil(settings.QR_TOKEN_GRACE_SECONDS / settings.QR_ROTATION_SECONDS)
+    return any(
+        constant_time_compare(token, make_token(code, b))
+        for b in range(bucket, bucket - grace - 1, -1)
+    )
@@ -3,14 +3,18 @@ from . import views
 
 urlpatterns = [
     path('favicon.ico', views.favicon),
+    path('metrics', views.metrics_view, name='metrics'),
     path('', views.home, name='home'),
     path('dashboard/', views.dashboard, name='dashboard'),
+    path('dashboard/sessions.json', views.dashboard_sessions_json, name='dashboard_sessions_json'),
     path('dashboard/delete/<str:code>', views.delete_session, name='delete_session'),
     path('login/', views.teacher_login, name='teacher_login'),
     path('reports/', views.reports, name='reports'),
     path('settings/students/', views.settings_students, name='settings_students'),
     path('settings/students/toggle', views.settings_students_toggle, name='settings_students_toggle'),
     path('settings/students/delete', views.settings_students_delete, name='settings_students_delete'),
+    path('settings/students/import', views.settings_students_import, name='settings_students_import'),
+    path('settings/students/export', views.settings_students_export, name='settings_students_export'),
     path('settings/teachers/add', views.settings_teachers_add, name='settings_teachers_add'),
     path('settings/teachers/delete', views.settings_teachers_delete, name='settings_teachers_delete'),
     path('settings/subjects/add', views.settings_subjects_add, name='settings_subjects_add'),
@@ -18,9 +22,13 @@ urlpatterns = [
     path('start/', views.start_session, name='start_session'),
     path('t/<str:code>/', views.teacher_session, name='teacher_session'),
     path('t/<str:code>/records.json', views.session_records_json, name='session_records_json'),
+    path('t/<str:code>/stream', views.session_stream, name='session_stream'),
     path('t/<str:code>/delete', views.delete_record, name='delete_record'),
     path('qr/<str:code>.png', views.qr_image, name='qr_image'),
+    path('qr/<str:code>.svg', views.qr_image, {'fmt': 'svg'}, name='qr_image_svg'),
     path('scan/<str:code>', views.scan, name='scan'),
+    path('scan/<str:code>/mark', views.scan_mark, name='scan_mark'),
+    path('roster.json', views.roster_json, name='roster_json'),
     path('stop/<str:code>', views.stop_session, name='stop_session'),
 ]
 
@@ -1,16 +1,23 @@
 import io
-import os
 import secrets
 from datetime import timedelta
 
-from django.http import HttpResponse, JsonResponse
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.db import transaction
+from django.db.models import OuterRef, Subquery, Value
+from django.db.models.functions import Least
+from django.http import Http404, HttpResponse, JsonResponse, StreamingHttpResponse
 from django.shortcuts import redirect, render
+from django.utils.cache import get_conditional_response
+from django.utils.crypto import constant_time_compare
 from django.utils import timezone
 from django.views.decorators.http import require_http_methods
 
-import qrcode
-
-from .models import AttendanceRecord, AttendanceSession, Student, Teacher, Subject
+from . import analytics, archive, counters, devicesharing, live, metrics, qr, roster, rollups, scanning, sessionlist, sessionmeta, studentio, sweeper, tokens, writebuffer
+from .models import AttendanceRecord, AttendanceSession, RecordTombstone, Student, Teacher, Subject
+from .reporting import Echo, filtered_sessions, record_rows, session_rows, streaming_content, summarize, with_related
 
 
 def home(request):
@@ -51,6 +58,7 @@ def start_session(request):
         teacher=Teacher.objects.filter(id=teacher_id).first() if teacher_id else None,
         subject=Subject.objects.filter(id=subject_id).first() if subject_id else None,
     )
+    qr.prerender(session.code)
     return redirect('teacher_session', code=session.code)
 
 
@@ -58,51 +66,160 @@ def teacher_session(request, code: str):
     # Teacher guard: simple PIN in session
     if request.session.get('teacher_authed') != True:
         return redirect('teacher_login')
-    session = AttendanceSession.objects.get(code=code)
-    return render(request, 'attendance/teacher_session.html', {'session': session})
+    session = sessionmeta.get(code)
+    if session is None:
+        raise Http404('Session not found')
+    records = list(
+        AttendanceRecord.objects.filter(session_id=session.id).select_related('student').order_by('-scanned_at')
+    )
+    return render(request, 'attendance/teacher_session.html', {
+        'session': session,
+        'records': records,
+        'qr_refresh_ms': (settings.QR_ROTATION_SECONDS or 10) * 1000,
+    })
 
 
 def dashboard(request):
     if request.session.get('teacher_authed') != True:
         return redirect('teacher_login')
-    sessions = AttendanceSession.objects.order_by('-starts_at')[:20]
-    open_count = sum(1 for s in sessions if s.is_open)
-    return render(request, 'attendance/dashboard.html', {'sessions': sessions, 'open_count': open_count})
+    sessions, next_cursor = sessionlist.page(request.GET.get('cursor', ''))
+    totals = sessionlist.totals()
+    return render(request, 'attendance/dashboard.html', {
+        'sessions': sessions,
+        'next_cursor': next_cursor,
+        'total_count': totals['total'],
+        'open_count': totals['open'],
+    })
+
+
+def dashboard_sessions_json(request):
+    # Next page of the dashboard list for ?cursor= from the previous page
+    if request.session.get('teacher_authed') != True:
+        return JsonResponse({'ok': False, 'error': 'unauthorized'}, status=401)
+    cursor = request.GET.get('cursor', '')
+    if cursor and sessionlist.decode_cursor(cursor) is None:
+        return JsonResponse({'ok': False, 'error': 'invalid cursor'}, status=400)
+    sessions, next_cursor = sessionlist.page(cursor)
+    return JsonResponse({
+        'ok': True,
+        'sessions': [sessionlist.row(s) for s in sessions],
+        'next': next_cursor,
+    })
 
 
-def session_records_json(request, code: str):
+def _parse_cursor(value: str):
     try:
-        session = AttendanceSession.objects.get(code=code)
-    except AttendanceSession.DoesNotExist:
+        last_record, last_tombstone = (int(part) for part in value.split('.'))
+    except ValueError:
+        return None
+    return last_record, last_tombstone
+
+
+async def session_records_json(request, code: str):
+    # Without ?since= this returns the full list; with the cursor from a
+    # previous response it returns only records added and ids deleted since.
+    session = await sessionmeta.aget(code)
+    if session is None:
+        return JsonResponse({'ok': False, 'error': 'invalid session'}, status=404)
+    last_record = AttendanceRecord.objects.filter(session=OuterRef('pk')).order_by('-id').values('id')[:1]
+    last_tombstone = RecordTombstone.objects.filter(session=OuterRef('pk')).order_by('-id').values('id')[:1]
+    row = await AttendanceSession.objects.filter(pk=session.id).annotate(
+        last_record=Subquery(last_record),
+        last_tombstone=Subquery(last_tombstone),
+    ).values_list('last_record', 'last_tombstone', 'present_count').afirst()
+    if row is None:
+        return JsonResponse({'ok': False, 'error': 'invalid session'}, status=404)
+    last_record, last_tombstone, present_count = row
+
+    # Deltas are keyed on record and tombstone ids, but ids are handed out
+    # at INSERT and become visible at COMMIT: a lower id committed after a
+    # higher one (concurrent MySQL inserts, write-behind flushes) is behind
+    # the cursor already. The stored count moves with every commit, so it is
+    # part of the ETag, and a client whose list doesn't add up to it reloads
+    # the full list (as it also does every so often).
+    cursor = f"{last_record or 0}.{last_tombstone or 0}"
+    etag = f'"{session.id}-{cursor}-{present_count}"'
+    not_modified = get_conditional_response(request, etag=etag)
+    if not_modified is not None:
+        return not_modified
+
+    records = AttendanceRecord.objects.filter(session_id=session.id).select_related('student')
+    since = _parse_cursor(request.GET.get('since', ''))
+    if since is None:
+        records = records.order_by('-scanned_at')
+        data = [live.record_payload(r, r.student) async for r in records]
+        response = JsonResponse({
+            'ok': True, 'full': True, 'records': data, 'deleted': [],
+            'count': len(data), 'cursor': cursor,
+        })
+    else:
+        data, deleted = [], []
+        if last_record and last_record > since[0]:
+            records = records.filter(id__gt=since[0]).order_by('id')
+            data = [live.record_payload(r, r.student) async for r in records]
+        if last_tombstone and last_tombstone > since[1]:
+            tombstones = RecordTombstone.objects.filter(
+                session_id=session.id, id__gt=since[1]
+            ).order_by('id').values_list('record_id', flat=True)
+            deleted = [record_id async for record_id in tombstones]
+        response = JsonResponse({
+            'ok': True, 'full': False, 'records': data, 'deleted': deleted,
+            'count': present_count, 'cursor': cursor,
+        })
+    response['ETag'] = etag
+    response['Cache-Control'] = 'no-cache'
+    return response
+
+
+async def session_stream(request, code: str):
+    # Server-sent events for the teacher screen. Needs an ASGI server; under
+    # WSGI the client sees the 501 and falls back to polling records.json.
+    if not isinstance(request, ASGIRequest):
+        return JsonResponse({'ok': False, 'error': 'live feed requires ASGI'}, status=501)
+    if await sessionmeta.aget(code) is None:
         return JsonResponse({'ok': False, 'error': 'invalid session'}, status=404)
-    data = [
-        {
-            'id': r.id,
-            'student_id': r.student.student_id,
-            'full_name': r.student.full_name,
-            'scanned_at': r.scanned_at.isoformat(),
-        }
-        for r in session.records.order_by('-scanned_at')
-    ]
-    return JsonResponse({'ok': True, 'records': data, 'count': len(data)})
+
+    async def events():
+        sub = await live.get_broadcaster().subscribe(code)
+        try:
+            yield 'retry: 3000\n\n'
+            yield live.sse({'type': 'ready'})
+            while True:
+                event = await sub.get(timeout=settings.LIVE_HEARTBEAT_SECONDS)
+                # Comment lines keep proxies from closing an idle stream
+                yield live.sse(event) if event else ': keepalive\n\n'
+        finally:
+            await sub.close()
+
+    response = StreamingHttpResponse(events(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
 
 
 @require_http_methods(["POST"]) 
 def delete_record(request, code: str):
     if request.session.get('teacher_authed') != True:
         return JsonResponse({'ok': False, 'error': 'unauthorized'}, status=401)
-    try:
-        session = AttendanceSession.objects.get(code=code)
-    except AttendanceSession.DoesNotExist:
+    session = sessionmeta.get(code)
+    if session is None:
         return JsonResponse({'ok': False, 'error': 'invalid session'}, status=404)
     record_id = request.POST.get('record_id')
     if not record_id:
         return JsonResponse({'ok': False, 'error': 'record_id required'}, status=400)
     try:
-        rec = AttendanceRecord.objects.get(id=record_id, session=session)
-        rec.delete()
+        rec = AttendanceRecord.objects.get(id=record_id, session_id=session.id)
+        with transaction.atomic():
+            rec.delete()
+            RecordTombstone.objects.create(session_id=session.id, record_id=int(record_id))
+            counters.adjust(session.id, -1)
+            for group in rollups.groups_of([session.id]):
+                group.student_ids.add(rec.student_id)
+                rollups.refresh(group)
     except AttendanceRecord.DoesNotExist:
         return JsonResponse({'ok': False, 'error': 'not found'}, status=404)
+    scanning.record_removed(session.id)
+    transaction.on_commit(lambda: live.publish(code, live.deleted_event(record_id)))
     return JsonResponse({'ok': True})
 
 
@@ -112,7 +229,15 @@ def delete_session(request, code: str):
         return JsonResponse({'ok': False, 'error': 'unauthorized'}, status=401)
     try:
         sess = AttendanceSession.objects.get(code=code)
-        sess.delete()
+        session_id = sess.id
+        # Buffered scans for it would otherwise fail their flush
+        writebuffer.drain([session_id])
+        with transaction.atomic():
+            groups = rollups.groups_of([session_id])
+            sess.delete()
+            for group in groups:
+                rollups.refresh(group)
+        scanning.forget_session(code, session_id)
     except AttendanceSession.DoesNotExist:
         return JsonResponse({'ok': False, 'error': 'not found'}, status=404)
     return JsonResponse({'ok': True})
@@ -127,75 +252,56 @@ def reports(request):
     date_from = request.GET.get('from') or ''
     date_to = request.GET.get('to') or ''
 
-    sessions_qs = AttendanceSession.objects.all().order_by('-starts_at')
-    if teacher_id:
-        sessions_qs = sessions_qs.filter(teacher_id=teacher_id)
-    if subject_id:
-        sessions_qs = sessions_qs.filter(subject_id=subject_id)
-    if date_from:
-        sessions_qs = sessions_qs.filter(starts_at__date__gte=date_from)
-    if date_to:
-        sessions_qs = sessions_qs.filter(starts_at__date__lte=date_to)
+    try:
+        threshold = min(max(int(request.GET.get('threshold') or settings.DEFAULTER_THRESHOLD), 0), 100)
+    except ValueError:
+        threshold = settings.DEFAULTER_THRESHOLD
 
-    # Eager load counts
-    sessions = list(sessions_qs)
+    sessions_qs = filtered_sessions(teacher_id, subject_id, date_from, date_to)
 
-    # CSV export
+    # CSV export, streamed in bounded chunks so memory stays flat
     if request.GET.get('export') == 'csv':
         import csv
-        from django.utils.encoding import smart_str
-        response = HttpResponse(content_type='text/csv')
-        response['Content-Disposition'] = 'attachment; filename=attendance_report.csv'
-        writer = csv.writer(response)
-        writer.writerow(['Session Code','Title','Teacher','Subject','Slot','Start','End','Present Count'])
-        for s in sessions:
-            writer.writerow([
-                smart_str(s.code), smart_str(s.title), smart_str(s.teacher or ''), smart_str(s.subject or ''),
-                smart_str(s.time_slot or ''), s.starts_at, s.ends_at, s.records.count()
-            ])
+        writer = csv.writer(Echo())
+        if request.GET.get('detail') == 'records':
+            rows, filename = record_rows(sessions_qs), 'attendance_records.csv'
+        elif request.GET.get('detail') == 'students':
+            totals = analytics.build(
+                teacher_id, subject_id, date_from, date_to, include_archive=archive.reaches_archive(date_from),
+            )
+            rows, filename = analytics.student_rows(totals, threshold), 'attendance_students.csv'
+        else:
+            rows, filename = session_rows(sessions_qs), 'attendance_report.csv'
+        response = StreamingHttpResponse(
+            streaming_content(request, (writer.writerow(row) for row in rows)), content_type='text/csv',
+        )
+        response['Content-Disposition'] = f'attachment; filename={filename}'
         return response
 
     teachers = Teacher.objects.all()
     subjects = Subject.objects.all()
-    # Aggregate totals
-    total_present = sum(s.records.count() for s in sessions)
-    total_sessions = len(sessions)
-    unique_devices = sum(s.unique_devices_count for s in sessions)
-    # Chart data: present per subject and per teacher
-    subject_to_count = {}
-    teacher_to_count = {}
-    for s in sessions:
-        count = s.records.count()
-        subj = str(s.subject or 'Unassigned')
-        tch = str(s.teacher or 'Unassigned')
-        subject_to_count[subj] = subject_to_count.get(subj, 0) + count
-        teacher_to_count[tch] = teacher_to_count.get(tch, 0) + count
-    chart = {
-        'subjects': {
-            'labels': list(subject_to_count.keys()),
-            'counts': list(subject_to_count.values()),
-        },
-        'teachers': {
-            'labels': list(teacher_to_count.keys()),
-            'counts': list(teacher_to_count.values()),
-        },
-    }
+    include_archive = archive.reaches_archive(date_from)
+    if include_archive:
+        metrics.set_branch('archive')
+    totals, chart = summarize(teacher_id, subject_id, date_from, date_to, include_archive=include_archive)
+    students = analytics.summarize(
+        analytics.build(teacher_id, subject_id, date_from, date_to, include_archive=include_archive), threshold,
+    )
     return render(request, 'attendance/reports.html', {
         'teachers': teachers,
         'subjects': subjects,
-        'sessions': sessions,
+        'sessions': with_related(sessions_qs),
         'filters': {
             'teacher': teacher_id,
             'subject': subject_id,
             'from': date_from,
             'to': date_to,
+            'threshold': threshold,
         },
-        'metrics': {
-            'total_present': total_present,
-            'total_sessions': total_sessions,
-            'unique_devices': unique_devices,
-        },
+        'metrics': totals,
         'chart': chart,
+        'students': students,
+        'shared_devices': devicesharing.clusters(),
     })
 
 
@@ -207,7 +313,9 @@ def settings_students(request):
         sid = (request.POST.get('student_id') or '').strip()
         name = (request.POST.get('full_name') or '').strip()
         if sid and name:
-            Student.objects.get_or_create(student_id=sid, defaults={'full_name': name, 'is_active': True})
+            _, created = Student.objects.get_or_create(student_id=sid, defaults={'full_name': name, 'is_active': True})
+            if created:
+                roster.invalidate()
         return redirect('settings_students')
     # GET list
     students = Student.objects.order_by('student_id')
@@ -229,6 +337,7 @@ def settings_students_toggle(request):
         s = Student.objects.get(student_id=sid)
         s.is_active = not s.is_active
         s.save(update_fields=['is_active'])
+        roster.invalidate()
         return JsonResponse({'ok': True, 'is_active': s.is_active})
     except Student.DoesNotExist:
         return JsonResponse({'ok': False, 'error': 'not found'}, status=404)
@@ -241,12 +350,45 @@ def settings_students_delete(request):
     sid = request.POST.get('student_id')
     try:
         s = Student.objects.get(student_id=sid)
-        s.delete()
+        studentio.delete_student(s)
         return JsonResponse({'ok': True})
     except Student.DoesNotExist:
         return JsonResponse({'ok': False, 'error': 'not found'}, status=404)
 
 
+@require_http_methods(["POST"]) 
+def settings_students_import(request):
+    # CSV or JSONL upload, applied in chunks like manage.py import_students
+    if request.session.get('teacher_authed') != True:
+        return JsonResponse({'ok': False, 'error': 'unauthorized'}, status=401)
+    upload = request.FILES.get('file')
+    if upload is None:
+        return JsonResponse({'ok': False, 'error': 'file required'}, status=400)
+    fmt = request.POST.get('format') or studentio.guess_format(upload.name)
+    try:
+        result = studentio.import_students(studentio.read_rows(_text_lines(upload), fmt))
+    except (ValueError, UnicodeDecodeError) as exc:
+        return JsonResponse({'ok': False, 'error': f'could not read file: {exc}'}, status=400)
+    return JsonResponse({'ok': True, **vars(result)})
+
+
+def _text_lines(upload):
+    # Uploaded chunks decoded line by line, without reading the whole file
+    return io.TextIOWrapper(upload.file, encoding='utf-8-sig', newline='')
+
+
+def settings_students_export(request):
+    if request.session.get('teacher_authed') != True:
+        return redirect('teacher_login')
+    fmt = 'jsonl' if request.GET.get('format') == 'jsonl' else 'csv'
+    response = StreamingHttpResponse(
+        streaming_content(request, studentio.export_lines(fmt)),
+        content_type='application/x-ndjson' if fmt == 'jsonl' else 'text/csv',
+    )
+    response['Content-Disposition'] = f'attachment; filename=students.{fmt}'
+    return response
+
+
 @require_http_methods(["POST"]) 
 def settings_teachers_add(request):
     if request.session.get('teacher_authed') != True:
@@ -293,107 +435,115 @@ def settings_subjects_delete(request):
         return JsonResponse({'ok': False, 'error': 'not found'}, status=404)
 
 
-def qr_image(request, code: str):
-    # Encodes a scan URL with the session code
-    # Use your LAN IP for mobile access
-    scan_url = f"http://10.68.17.134:8000/scan/{code}"
-    
-    # Generate QR with optimized settings
-    qr = qrcode.QRCode(
-        version=1,
-        error_correction=qrcode.constants.ERROR_CORRECT_L,
-        box_size=10,
-        border=4,
-    )
-    qr.add_data(scan_url)
-    qr.make(fit=True)
-    img = qr.make_image(fill_color="black", back_color="white")
-    
-    # Optimize response
-    buf = io.BytesIO()
-    img.save(buf, format='PNG', optimize=True)
-    response = HttpResponse(buf.getvalue(), content_type='image/png')
-    
-    # Prevent caching to ensure fresh QR codes
-    response['Cache-Control'] = 'no-cache, no-store, must-revalidate'
-    response['Pragma'] = 'no-cache'
-    response['Expires'] = '0'
-    response['Content-Length'] = str(len(buf.getvalue()))
-    
+def _qr_params(request, code: str, fmt: str = 'png'):
+    box_size = qr.SIZES.get(request.GET.get('size'), qr.SIZES[qr.DEFAULT_SIZE])
+    # The payload only changes once per rotation bucket, so each bucket's
+    # image is rendered once and every refresh in between is a cache hit.
+    token = tokens.make_token(code) if tokens.enabled() else ''
+    return qr.scan_url(code, token), box_size, fmt
+
+
+async def qr_image(request, code: str, fmt: str = 'png'):
+    # Encodes a scan URL with the current token, so only the teacher's
+    # screen may fetch it. Images come from the shared QR cache,
+    # pre-rendered from start_session on; a miss is rendered in the QR
+    # process pool. Unchanged refreshes get a 304.
+    if await request.session.aget('teacher_authed') != True:
+        return HttpResponse(status=401)
+    session = await sessionmeta.aget(code)
+    if session is None:
+        return HttpResponse(status=404)
+    params = _qr_params(request, code, fmt)
+    etag = f'"{qr.etag(*params)}"'
+    not_modified = get_conditional_response(request, etag=etag)
+    if not_modified is not None:
+        return not_modified
+    bucket = tokens.current_bucket() if tokens.enabled() else None
+    body = await qr.aimage(*params, bucket=bucket)
+    if session.is_open:
+        # Keep the next few rotation windows rendered ahead
+        await qr.aprerender(code)
+    response = HttpResponse(body, content_type=qr.CONTENT_TYPES[fmt])
+    # Always revalidate so a new payload shows up on the next refresh
+    response['Cache-Control'] = 'no-cache'
+    response['Content-Length'] = str(len(body))
+    response['ETag'] = etag
     return response
 
 
-def scan(request, code: str):
-    # GET shows a simple form; POST records attendance
-    students = Student.objects.filter(is_active=True).order_by('full_name', 'student_id')
-    
-    try:
-        session = AttendanceSession.objects.get(code=code)
-    except AttendanceSession.DoesNotExist:
-        return render(request, 'attendance/scan.html', {
-            'code': code, 
-            'students': students,
-            'message': 'Invalid session code', 
-            'status': 'error'
-        })
+def _scan_token(request) -> str:
+    return (request.POST.get('t') or request.GET.get('t') or '').strip()
 
-    if request.method == 'GET':
-        return render(request, 'attendance/scan.html', {
-            'code': code, 
-            'students': students,
-            'session': session
-        })
 
-    # POST - Handle attendance marking
-    student_id = (request.POST.get('student_select') or request.POST.get('student_id') or '').strip()
-    
-    if not student_id:
-        return render(request, 'attendance/scan.html', {
-            'code': code, 
-            'students': students,
-            'message': 'Please select your name or enter ID', 
-            'status': 'error'
-        })
+async def scan(request, code: str):
+    # GET shows a simple form; POST records attendance (no-JS fallback, the
+    # page itself submits to scan_mark). The student list is not rendered
+    # here: the page loads it from roster_json, which phones keep cached.
+    token = _scan_token(request)
 
-    if not session.is_open:
+    # Rotating QR token: checked statelessly, before any DB work
+    if not tokens.is_valid(code, token):
         return render(request, 'attendance/scan.html', {
-            'code': code, 
-            'students': students,
-            'message': 'Session is closed', 
+            'code': code,
+            'token': token,
+            'message': 'This QR code has expired, please scan the current one',
             'status': 'error'
         })
 
-    # Create or get student
-    student, created = Student.objects.get_or_create(
-        student_id=student_id, 
-        defaults={'full_name': student_id}
-    )
-    
-    # Device fingerprint for anti-proxy
-    ip = request.META.get('HTTP_X_FORWARDED_FOR') or request.META.get('REMOTE_ADDR') or ''
-    ua = request.META.get('HTTP_USER_AGENT', '')
-    fingerprint = (ip + '|' + ua)[:120]
-    
-    try:
-        AttendanceRecord.objects.create(
-            session=session, 
-            student=student, 
-            device_fingerprint=fingerprint
-        )
-        message = f'✅ Attendance marked successfully for {student.full_name}'
-        status = 'success'
-    except Exception as e:
-        message = '❌ Already scanned or same device detected'
-        status = 'error'
+    state = await sessionmeta.aget(code)
+    if request.method == 'GET':
+        context = {'code': code, 'token': token, 'roster_version': await roster.aversion()}
+        if state is None:
+            context.update(message=scanning.MSG_INVALID, status='error')
+        return render(request, 'attendance/scan.html', context)
 
+    student_id = (request.POST.get('student_select') or request.POST.get('student_id') or '').strip()
+    result = await scanning.amark(state, student_id, scanning.device_fingerprint(request))
     return render(request, 'attendance/scan.html', {
-        'code': code, 
-        'students': students,
-        'message': message, 
-        'status': status
+        'code': code,
+        'token': token,
+        'roster_version': await roster.aversion(),
+        'message': result.message,
+        'status': 'success' if result.ok else 'error'
     })
 
 
+@require_http_methods(["POST"])
+async def scan_mark(request, code: str):
+    # JSON endpoint the scan page posts to: no roster, no template render
+    if not tokens.is_valid(code, _scan_token(request)):
+        return JsonResponse({'ok': False, 'error': 'This QR code has expired, please scan the current one'}, status=403)
+    student_id = (request.POST.get('student_select') or request.POST.get('student_id') or '').strip()
+    state = await sessionmeta.aget(code)
+    result = await scanning.amark(state, student_id, scanning.device_fingerprint(request))
+    if not result.ok:
+        return JsonResponse({'ok': False, 'error': result.message}, status=result.status)
+    return JsonResponse({'ok': True, 'message': result.message})
+
+
+def roster_json(request):
+    # Active students for the scan page. Versioned and precompressed; phones
+    # revalidate with the version as ETag and get 304s until it changes.
+    current = roster.version()
+    not_modified = get_conditional_response(request, etag=f'"{current}"')
+    if not_modified is not None:
+        return not_modified
+    encodings = roster.payload(current)
+    encoding = roster.pick_encoding(request.META.get('HTTP_ACCEPT_ENCODING', ''), encodings)
+    response = HttpResponse(encodings[encoding], content_type='application/json')
+    if encoding != 'identity':
+        response['Content-Encoding'] = encoding
+    response['Content-Length'] = str(len(encodings[encoding]))
+    response['ETag'] = f'"{current}"'
+    response['Vary'] = 'Accept-Encoding'
+    if request.GET.get('v') == current:
+        # Versioned URL: contents can never change
+        response['Cache-Control'] = 'public, max-age=31536000, immutable'
+    else:
+        response['Cache-Control'] = 'no-cache'
+    return response
+
+
 def teacher_login(request):
     if request.method == 'GET':
         return render(request, 'attendance/teacher_login.html')
@@ -404,20 +554,34 @@ def teacher_login(request):
     return render(request, 'attendance/teacher_login.html', {'error': 'Invalid PIN'})
 
 
+def metrics_view(request):
+    # Prometheus text exposition of the per-view request metrics
+    if settings.METRICS_TOKEN and not constant_time_compare(
+        request.META.get('HTTP_AUTHORIZATION', ''), f'Bearer {settings.METRICS_TOKEN}'
+    ):
+        return HttpResponse(status=401)
+    return HttpResponse(metrics.prometheus_text(), content_type='text/plain; version=0.0.4')
+
+
 def favicon(request):
     # Return empty 204 to avoid favicon 404 log noise during development
     return HttpResponse(status=204)
 
 
 @require_http_methods(["POST"]) 
-def stop_session(request, code: str):
-    if request.session.get('teacher_authed') != True:
+async def stop_session(request, code: str):
+    if await request.session.aget('teacher_authed') != True:
         return redirect('teacher_login')
-    try:
-        session = AttendanceSession.objects.get(code=code)
-    except AttendanceSession.DoesNotExist:
+    session = await sessionmeta.aget(code)
+    if session is None:
         return redirect('home')
-    session.is_active = False
-    session.ends_at = min(session.ends_at, timezone.now())
-    session.save(update_fields=['is_active', 'ends_at'])
+    # Buffered scans for this session, in any worker, must land before it
+    # is closed
+    await sync_to_async(writebuffer.drain)([session.id])
+    closed = await AttendanceSession.objects.filter(pk=session.id, is_active=True).aupdate(
+        is_active=False, ends_at=Least('ends_at', Value(timezone.now())),
+    )
+    # Unless a sweep got there first and has run them
+    if closed:
+        await sync_to_async(sweeper.close_hooks)([(session.id, code)])
     return redirect('teacher_session', code=code)
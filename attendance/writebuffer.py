@@ -0,0 +1,389 @@
+import atexit
+import json
+import logging
+import os
+import socket
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import IntegrityError, close_old_connections, transaction
+from django.db.models import Max
+
+from . import counters, live, rollups
+from .models import AttendanceRecord, AttendanceSession
+
+try:
+    import fcntl
+except ImportError:  # not on Windows; write-behind needs it
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# Write-behind mode for scans (SCAN_WRITE_BEHIND). Accepted scans are
+# appended to a local log and acknowledged straight away; a background thread
+# inserts them with one bulk_create every SCAN_FLUSH_INTERVAL_MS or as soon as
+# SCAN_FLUSH_BATCH are waiting.
+#
+# Every process has its own log next to SCAN_WAL_PATH, named after host and
+# pid, and holds an flock on a matching .lock file for as long as it runs. A
+# log whose lock nobody holds belongs to a dead process: it is replayed (by
+# the next buffer to start, or by drain()) and removed, and ignore_conflicts
+# makes replaying rows that did get inserted harmless. Closing or deleting a
+# session, or deleting a student, drains every worker's buffer for it first,
+# see drain(). A row that still can't go in (its student or session was
+# deleted regardless) is set aside in the .rejected log beside SCAN_WAL_PATH
+# rather than holding up the rest of its batch.
+
+
+def _paths(base: Path, owner: str):
+    # (log, log being flushed, lock) for one process
+    log = base.with_name(f"{base.stem}.{owner}{base.suffix}")
+    return log, Path(f"{log}.flushing"), base.with_name(f"{base.stem}.{owner}.lock")
+
+
+def _owners(base: Path):
+    prefix = f"{base.stem}."
+    for lock in base.parent.glob(f"{base.stem}.*.lock"):
+        yield lock.name[len(prefix):-len('.lock')]
+
+
+def _acquire(path):
+    # Exclusive and non-blocking; None if a live process holds the lock. A
+    # recovering process may unlink the file between open and flock, so the
+    # lock only counts if it is still on the file at `path`.
+    fh = open(path, 'a')
+    try:
+        fcntl.flock(fh.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        held = os.stat(path).st_ino == os.fstat(fh.fileno()).st_ino
+    except OSError:
+        held = False
+    if not held:
+        fh.close()
+        return None
+    return fh
+
+
+def _read(paths) -> list:
+    batch = []
+    for path in paths:
+        if not os.path.exists(path):
+            continue
+        with open(path, encoding='utf-8') as fh:
+            for line in fh:
+                try:
+                    batch.append(json.loads(line))
+                except ValueError:
+                    # Torn final line from a crash mid-write
+                    logger.warning("skipping unreadable scan log line in %s", path)
+    return batch
+
+
+def _write(batch, base=None) -> int:
+    # Inserts a batch and returns how many rows went in. If the batch fails
+    # an integrity check, its rows are retried one by one and the ones that
+    # still fail are set aside.
+    try:
+        with transaction.atomic():
+            records = _insert(batch)
+            _settle(batch)
+    except IntegrityError:
+        records, kept, rejected = [], [], []
+        for e in batch:
+            try:
+                with transaction.atomic():
+                    records += _insert([e])
+            except IntegrityError:
+                rejected.append(e)
+            else:
+                kept.append(e)
+        _set_aside(rejected, base)
+        if kept:
+            with transaction.atomic():
+                _settle(kept)
+    _publish(records, {e['session']: e['code'] for e in batch})
+    return len(records)
+
+
+def _settle(batch):
+    sessions = {e['session'] for e in batch}
+    # ignore_conflicts doesn't say which rows went in, so recount
+    counters.recount(AttendanceSession.objects.filter(id__in=sessions))
+    # Scans accepted just before a session closed can land after it was
+    # rolled up
+    for group in rollups.groups_of(sessions):
+        rollups.refresh(group)
+
+
+def _insert(batch) -> list:
+    # Returns the records that went in. ignore_conflicts skips rows that
+    # exist already (a replayed log, or the scan got in some other way) and
+    # leaves the pks unset, so they are read back: above the highest id
+    # before the insert and matching an entry exactly.
+    floor = AttendanceRecord.objects.aggregate(last=Max('id'))['last'] or 0
+    rows = [
+        AttendanceRecord(
+            session_id=e['session'],
+            student_id=e['student'],
+            device_fingerprint=e['fingerprint'],
+            scanned_at=datetime.fromisoformat(e['scanned_at']),
+        )
+        for e in batch
+    ]
+    AttendanceRecord.objects.bulk_create(rows, ignore_conflicts=True)
+    wanted = {(r.session_id, r.student_id, r.device_fingerprint, r.scanned_at) for r in rows}
+    return [
+        r for r in AttendanceRecord.objects.filter(
+            id__gt=floor, session_id__in={r.session_id for r in rows}
+        ).select_related('student')
+        if (r.session_id, r.student_id, r.device_fingerprint, r.scanned_at) in wanted
+    ]
+
+
+def _set_aside(rejected, base=None):
+    if not rejected:
+        return
+    base = Path(base or settings.SCAN_WAL_PATH)
+    path = base.with_name(f"{base.stem}.rejected{base.suffix}")
+    logger.warning("setting aside %d buffered scans that could not be inserted, see %s", len(rejected), path)
+    with open(path, 'a', encoding='utf-8') as fh:
+        for e in rejected:
+            fh.write(json.dumps(e, separators=(',', ':')) + '\n')
+
+
+def _publish(records, codes):
+    for record in records:
+        live.publish(codes[record.session_id], live.created_event(record, record.student))
+
+
+def _replay(log, flushing, base=None):
+    batch = _read([flushing, log])
+    if batch:
+        logger.info("replaying %d buffered scans from %s", len(batch), log)
+        _write(batch, base)
+    for path in (flushing, log):
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def recover(base, skip=None) -> int:
+    # Replays the logs of processes that died with scans still buffered
+    base = Path(base)
+    recovered = 0
+    for owner in _owners(base):
+        if owner == skip:
+            continue
+        log, flushing, lock = _paths(base, owner)
+        fh = _acquire(lock)
+        if fh is None:
+            continue
+        try:
+            _replay(log, flushing, base)
+            os.remove(lock)
+        finally:
+            fh.close()
+        recovered += 1
+    return recovered
+
+
+class ScanWriteBuffer:
+    def __init__(self, base, interval, batch_size, fsync=True, owner=None):
+        self.base = Path(base)
+        self.owner = owner or f"{socket.gethostname()}-{os.getpid()}"
+        log, flushing, lock = _paths(self.base, self.owner)
+        self.path = str(log)
+        self.flushing_path = str(flushing)
+        self.lock_path = str(lock)
+        self.interval = interval
+        self.batch_size = batch_size
+        self.fsync = fsync
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._pending = []
+        self._writing = []  # batch being inserted by flush()
+        self._log = None
+        self._owner_lock = None
+        self._thread = None
+
+    def start(self):
+        if fcntl is None:
+            raise ImproperlyConfigured("SCAN_WRITE_BEHIND needs fcntl file locks, which this platform lacks")
+        os.makedirs(self.base.parent, exist_ok=True)
+        for _ in range(3):
+            # A process recovering a dead log of the same name can hold the
+            # lock for a moment
+            self._owner_lock = _acquire(self.lock_path)
+            if self._owner_lock is not None:
+                break
+            time.sleep(self.interval)
+        if self._owner_lock is None:
+            raise ImproperlyConfigured(f"scan log {self.path} is locked by another running process")
+        # Left behind by an earlier process that had the same host and pid:
+        # taken over and inserted with the first flush
+        self._pending = _read([self.flushing_path, self.path])
+        try:
+            recover(self.base, skip=self.owner)
+        except Exception:
+            # Their logs stay for the next drain() or start to replay
+            logger.exception("replaying dead processes' scan logs failed")
+        self._log = open(self.path, 'a', encoding='utf-8')
+        if self._pending:
+            self._wake.set()
+        self._thread = threading.Thread(target=self._run, name='scan-write-buffer', daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def submit(self, session_code, session_id, student, fingerprint, scanned_at):
+        entry = {
+            'code': session_code,
+            'session': session_id,
+            'student': student.id,
+            'student_id': student.student_id,
+            'fingerprint': fingerprint,
+            'scanned_at': scanned_at.isoformat(),
+        }
+        line = json.dumps(entry, separators=(',', ':')) + '\n'
+        with self._lock:
+            self._log.write(line)
+            self._log.flush()
+            if self.fsync:
+                os.fsync(self._log.fileno())
+            self._pending.append(entry)
+            full = len(self._pending) >= self.batch_size
+        if full:
+            self._wake.set()
+
+    def flush(self):
+        with self._flush_lock:
+            with self._lock:
+                if not self._pending:
+                    return 0
+                batch, self._pending = self._pending, []
+                self._writing = batch
+                self._rotate()
+            try:
+                _write(batch, self.base)
+            except Exception:
+                with self._lock:
+                    self._pending = batch + self._pending
+                raise
+            finally:
+                with self._lock:
+                    self._writing = []
+            os.remove(self.flushing_path)
+            return len(batch)
+
+    def claims(self, session_id):
+        # (student_id, fingerprint) of the scans for a session not in the
+        # database yet, for scanning's seen sets
+        with self._lock:
+            return [
+                (e.get('student_id'), e['fingerprint'])
+                for e in self._writing + self._pending if e['session'] == session_id
+            ]
+
+    def close(self):
+        # On a clean exit an empty log and its lock are removed; if the last
+        # flush fails they stay for the next process to replay.
+        if self._owner_lock is None or self._owner_lock.closed:
+            return
+        self.flush()
+        with self._lock:
+            self._log.close()
+            os.remove(self.path)
+            os.remove(self.lock_path)
+            self._owner_lock.close()
+
+    def _rotate(self):
+        # What is being flushed moves aside and new scans go to a fresh file.
+        # A .flushing file left by a failed flush still holds pending entries,
+        # so the current log is appended to it instead of replacing it.
+        self._log.close()
+        if os.path.exists(self.flushing_path):
+            with open(self.flushing_path, 'a', encoding='utf-8') as dst, open(self.path, encoding='utf-8') as src:
+                dst.write(src.read())
+            os.remove(self.path)
+        else:
+            os.replace(self.path, self.flushing_path)
+        self._log = open(self.path, 'a', encoding='utf-8')
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            close_old_connections()
+            try:
+                self.flush()
+            except Exception:
+                # The batch goes back to pending and is retried on the next
+                # flush; the .flushing log still holds it if the process dies
+                logger.exception("scan buffer flush failed")
+
+
+_buffer = None
+_buffer_lock = threading.Lock()
+
+
+def get_buffer():
+    global _buffer
+    if _buffer is None:
+        with _buffer_lock:
+            if _buffer is None:
+                buf = ScanWriteBuffer(
+                    settings.SCAN_WAL_PATH,
+                    settings.SCAN_FLUSH_INTERVAL_MS / 1000,
+                    settings.SCAN_FLUSH_BATCH,
+                    fsync=settings.SCAN_WAL_FSYNC,
+                )
+                buf.start()
+                _buffer = buf
+    return _buffer
+
+
+def flush():
+    if _buffer is not None:
+        _buffer.flush()
+
+
+def claims(session_id) -> list:
+    return _buffer.claims(session_id) if _buffer is not None else []
+
+
+def _holds(base, owner, session_ids, student_ids) -> bool:
+    log, flushing, _ = _paths(base, owner)
+    return any(
+        e.get('session') in session_ids or e.get('student') in student_ids for e in _read([flushing, log])
+    )
+
+
+def drain(session_ids=(), student_ids=(), timeout=None) -> bool:
+    # Called before sessions are closed or deleted and before students are
+    # deleted: flushes this process's buffer, replays dead processes' logs
+    # and waits (up to a few flush intervals) until no other worker's log
+    # holds scans for the sessions or students. Returns False on timeout;
+    # those scans still land with the owner's next flush, which recounts
+    # and re-rolls-up their sessions, or are set aside if their session or
+    # student is gone by then.
+    if not settings.SCAN_WRITE_BEHIND:
+        return True
+    flush()
+    base = Path(settings.SCAN_WAL_PATH)
+    if fcntl is None or not base.parent.is_dir():
+        return True
+    session_ids, student_ids = set(session_ids), set(student_ids)
+    own = _buffer.owner if _buffer is not None else None
+    interval = settings.SCAN_FLUSH_INTERVAL_MS / 1000
+    deadline = time.monotonic() + (timeout if timeout is not None else max(2.0, 4 * interval))
+    while True:
+        recover(base, skip=own)
+        waiting = [o for o in _owners(base) if o != own and _holds(base, o, session_ids, student_ids)]
+        if not waiting:
+            return True
+        if time.monotonic() >= deadline:
+            logger.warning("scans still buffered by %s", ', '.join(waiting))
+            return False
+        time.sleep(interval / 4)
@@ -14,3 +14,8 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'qrat.settings')
 
 application = get_asgi_application()
+
+# Close expired sessions in the background (attendance.sweeper)
+from attendance import sweeper  # noqa: E402
+
+sweeper.start()
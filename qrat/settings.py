@@ -32,6 +32,9 @@ DEBUG = True
 
 ALLOWED_HOSTS = ['127.0.0.1', 'localhost', '10.94.11.134']
 
+# Base URL encoded into session QR codes; use your LAN IP for mobile access
+PUBLIC_BASE_URL = os.getenv('PUBLIC_BASE_URL', 'http://10.68.17.134:8000')
+
 
 # Application definition
 
@@ -47,6 +50,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'attendance.middleware.RequestMetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -60,7 +64,8 @@ ROOT_URLCONF = 'qrat.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # Stock Django templates, timed for Server-Timing and /metrics
+        'BACKEND': 'attendance.templating.TimedDjangoTemplates',
         'DIRS': [BASE_DIR / 'templates'],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -75,11 +80,45 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'qrat.wsgi.application'
 
+# Request instrumentation (attendance.middleware.RequestMetricsMiddleware).
+# Query budgets are per URL name and include the session lookup; going over
+# logs a warning, or raises when QUERY_BUDGET_STRICT is on. They are the
+# counts measured with cold per-process caches (session state, seen set,
+# roster stamp). "<url name>:<branch>" entries cover the paths that cost
+# more: a scan that enrols an unknown student ID, a report reaching into
+# archived months.
+QUERY_BUDGETS = {
+    'scan': 7,
+    'scan:enrol': 9,
+    'scan_mark': 6,
+    'scan_mark:enrol': 8,
+    'roster_json': 1,
+    'session_records_json': 4,
+    'qr_image': 2,
+    'reports': 12,
+    'reports:archive': 15,
+    'dashboard': 3,
+    'dashboard_sessions_json': 2,
+}
+QUERY_BUDGET_STRICT = os.getenv('QUERY_BUDGET_STRICT', '0') == '1'
+# When set, /metrics requires "Authorization: Bearer <token>"
+METRICS_TOKEN = os.getenv('METRICS_TOKEN', '')
+
 
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
 DB_ENGINE = os.getenv('DB_ENGINE', 'sqlite')
+# Seconds to keep a connection open between requests (0 = one per request,
+# the default). Under ASGI every request can run in a new thread, so
+# persistent connections pile up there; opt in (e.g. 60) for WSGI
+# deployments only, where Django has no built-in pool for MySQL otherwise.
+DB_CONN_MAX_AGE = int(os.getenv('DB_CONN_MAX_AGE', '0'))
+# SQLite production profile: WAL, busy timeout, mmap and a larger page cache
+SQLITE_TUNING = os.getenv('SQLITE_TUNING', '1') == '1'
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv('SQLITE_BUSY_TIMEOUT_MS', '5000'))
+SQLITE_MMAP_SIZE = int(os.getenv('SQLITE_MMAP_SIZE', str(128 * 1024 * 1024)))
+SQLITE_CACHE_KB = int(os.getenv('SQLITE_CACHE_KB', '20000'))
 
 if DB_ENGINE == 'mysql':
     DATABASES = {
@@ -92,8 +131,12 @@ if DB_ENGINE == 'mysql':
             'PORT': os.getenv('MYSQL_PORT', '3306'),
             'OPTIONS': {
                 'charset': 'utf8mb4',
-                'init_command': "SET sql_mode='STRICT_ALL_TABLES'",
+                # attendance.analytics joins a session's student pks with
+                # GROUP_CONCAT; the 1 KB default would cut them short
+                'init_command': "SET sql_mode='STRICT_ALL_TABLES', group_concat_max_len=4194304",
             },
+            'CONN_MAX_AGE': DB_CONN_MAX_AGE,
+            'CONN_HEALTH_CHECKS': True,
         }
     }
 else:
@@ -101,8 +144,64 @@ else:
         'default': {
             'ENGINE': 'django.db.backends.sqlite3',
             'NAME': BASE_DIR / 'db.sqlite3',
+            'CONN_MAX_AGE': DB_CONN_MAX_AGE,
+            'CONN_HEALTH_CHECKS': True,
         }
     }
+    if SQLITE_TUNING:
+        DATABASES['default']['OPTIONS'] = {
+            # Wait for a competing writer instead of failing with
+            # "database is locked", and take the write lock up front so two
+            # scans can't deadlock upgrading from a read lock.
+            'timeout': SQLITE_BUSY_TIMEOUT_MS / 1000,
+            'transaction_mode': 'IMMEDIATE',
+            # WAL lets readers carry on while a scan is being written;
+            # synchronous=NORMAL is durable across app crashes in WAL mode.
+            'init_command': (
+                'PRAGMA journal_mode=WAL;'
+                'PRAGMA synchronous=NORMAL;'
+                f'PRAGMA mmap_size={SQLITE_MMAP_SIZE};'
+                f'PRAGMA cache_size=-{SQLITE_CACHE_KB};'
+            ),
+        }
+
+
+# Cache: per-process memory by default. Point CACHE_REDIS_URL at a Redis (or
+# compatible) server to share scan and roster state between workers.
+CACHE_REDIS_URL = os.getenv('CACHE_REDIS_URL', '')
+# Whether every worker sees the same default cache. State other workers must
+# notice (roster version, session metadata, archive horizon) only lives in
+# the cache when it is; otherwise it is read from the database.
+CACHE_SHARED = bool(CACHE_REDIS_URL)
+# How long a worker reuses the roster version it read from the database
+# when the cache is not shared
+ROSTER_VERSION_SECONDS = int(os.getenv('ROSTER_VERSION_SECONDS', '5'))
+# Rendered QR images (per payload, size and format) get their own cache so
+# they can't evict scan state; this bounds the in-memory one.
+QR_CACHE_SIZE = int(os.getenv('QR_CACHE_SIZE', '512'))
+
+if CACHE_REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': CACHE_REDIS_URL,
+        },
+        'qr': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': CACHE_REDIS_URL,
+        },
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        },
+        'qr': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'qr',
+            'OPTIONS': {'MAX_ENTRIES': QR_CACHE_SIZE},
+        },
+    }
 
 
 # Password validation
@@ -147,3 +246,61 @@ STATICFILES_DIRS = [BASE_DIR / 'static']
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+# Worker processes that encode QR images, and how many rotation windows
+# ahead start_session pre-renders
+QR_RENDER_PROCESSES = int(os.getenv('QR_RENDER_PROCESSES', '2'))
+QR_PRERENDER_WINDOWS = int(os.getenv('QR_PRERENDER_WINDOWS', '4'))
+
+# Rotating QR tokens: the scan URL carries an HMAC of (code, time bucket).
+# A rotation of 0 turns tokens off; the grace window covers the time a
+# student needs between scanning and submitting the form.
+QR_ROTATION_SECONDS = int(os.getenv('QR_ROTATION_SECONDS', '15'))
+QR_TOKEN_GRACE_SECONDS = int(os.getenv('QR_TOKEN_GRACE_SECONDS', '90'))
+
+# Live attendance feed (server-sent events, served under ASGI). The
+# in-process broadcaster covers a single worker; with several workers use
+# attendance.live.RedisBroadcaster and point LIVE_REDIS_URL at a Redis or
+# compatible server.
+LIVE_BROADCASTER = os.getenv('LIVE_BROADCASTER', 'attendance.live.InProcessBroadcaster')
+LIVE_REDIS_URL = os.getenv('LIVE_REDIS_URL', 'redis://127.0.0.1:6379/0')
+LIVE_HEARTBEAT_SECONDS = int(os.getenv('LIVE_HEARTBEAT_SECONDS', '15'))
+LIVE_QUEUE_SIZE = 1000
+
+# Session metadata cache (attendance.sessionmeta): how long a worker trusts
+# its in-process copy, how many it keeps (also the number of sessions whose
+# seen sets attendance.scanning keeps), and the timeout in the default
+# cache, which is only used when it is shared (CACHE_SHARED)
+SCAN_SESSION_CACHE_SECONDS = int(os.getenv('SCAN_SESSION_CACHE_SECONDS', '5'))
+SESSION_CACHE_SIZE = int(os.getenv('SESSION_CACHE_SIZE', '256'))
+SESSION_CACHE_SECONDS = int(os.getenv('SESSION_CACHE_SECONDS', '300'))
+
+# Per-student attendance on the reports page: students below this
+# percentage are listed as defaulters (?threshold= overrides it)
+DEFAULTER_THRESHOLD = int(os.getenv('DEFAULTER_THRESHOLD', '75'))
+DEFAULTERS_SHOWN = int(os.getenv('DEFAULTERS_SHOWN', '50'))
+
+# Shared-device report (attendance.devicesharing, filled by the
+# detect_device_sharing command): devices that marked at least this many
+# different students are listed
+DEVICE_SHARING_MIN_STUDENTS = int(os.getenv('DEVICE_SHARING_MIN_STUDENTS', '3'))
+DEVICE_SHARING_SHOWN = int(os.getenv('DEVICE_SHARING_SHOWN', '20'))
+
+# Where archive_attendance writes the gzipped JSONL of archived sessions
+ARCHIVE_DIR = Path(os.getenv('ARCHIVE_DIR', BASE_DIR / 'var' / 'archive'))
+
+# Session sweeper (attendance.sweeper): closes sessions past ends_at every
+# SESSION_SWEEP_SECONDS from a thread in each web process. Turn it off when
+# running the sweep_sessions command as a separate process instead.
+SESSION_SWEEPER = os.getenv('SESSION_SWEEPER', '1') == '1'
+SESSION_SWEEP_SECONDS = int(os.getenv('SESSION_SWEEP_SECONDS', '30'))
+
+# Write-behind scans: acknowledge after appending to a local log, insert in
+# batches. Off by default; mainly useful on SQLite during class-start bursts.
+# SCAN_WAL_PATH names the logs: each process writes its own
+# scan-buffer.<host>-<pid>.log beside it (POSIX only, they are flock'ed).
+SCAN_WRITE_BEHIND = os.getenv('SCAN_WRITE_BEHIND', '0') == '1'
+SCAN_FLUSH_INTERVAL_MS = int(os.getenv('SCAN_FLUSH_INTERVAL_MS', '250'))
+SCAN_FLUSH_BATCH = int(os.getenv('SCAN_FLUSH_BATCH', '200'))
+SCAN_WAL_PATH = Path(os.getenv('SCAN_WAL_PATH', BASE_DIR / 'var' / 'scan-buffer.log'))
+SCAN_WAL_FSYNC = os.getenv('SCAN_WAL_FSYNC', '1') == '1'